@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+""" Device availability, from each device's own broadcast interval, as learned from its traffic.
+
+    A device is offline once nothing has been heard from it for a number of its usual intervals. Rather than a timer
+    per device, the expiry checks are on a hierarchical timer wheel, which is advanced every few seconds. A packet just
+    updates the device's last seen time and interval (O(1)); the device's (single) wheel entry is only moved on when
+    it comes due and the device has been heard from since, so the wheel does no work per packet either.
+"""
+
+import time
+
+SZ_ONLINE   = "online"
+SZ_OFFLINE  = "offline"
+
+MIN_GAP_SECS        = 5     # Closer packets are treated as one burst (e.g. a reply and its repeats), not an interval
+INTERVAL_WEIGHT     = 0.2   # Of each new gap in the interval's moving average
+LEARN_GAPS          = 3     # Gaps needed before the learned interval is used, rather than the default timeout
+
+
+class TimerWheel():
+    ''' Hierarchical timer wheel. Level 0 has a slot per tick, and each higher level a slot per full turn of the level
+        below. Entries far in the future sit in the higher levels, and cascade down as their time approaches, so
+        scheduling is O(1) and advancing is O(1) per tick plus the entries that come due.
+    '''
+    def __init__(self, tick_secs=5, slots=64, levels=3, now=None):
+        self.tick_secs = tick_secs
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = int((now if now is not None else time.time()) / tick_secs)
+        self.count = 0
+
+    def schedule(self, key, deadline):
+        self.count += 1
+        self._insert(key, max(int(deadline / self.tick_secs) + 1, self.current + 1))
+
+    def _insert(self, key, ticks):
+        delta = ticks - self.current
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1) or level == self.levels - 1:
+                self.wheels[level][(ticks // self.slots ** level) % self.slots].append((key, ticks))
+                return
+
+    def advance(self, now=None):
+        """ Move the wheel on to now, returning the keys that have come due """
+        due = []
+        target = int((now if now is not None else time.time()) / self.tick_secs)
+        while self.current < target:
+            self.current += 1
+            for level in range(1, self.levels):
+                # Cascade the next slot of each level that the level below has just completed a turn of
+                if self.current % self.slots ** level:
+                    break
+                index = (self.current // self.slots ** level) % self.slots
+                bucket, self.wheels[level][index] = self.wheels[level][index], []
+                for key, ticks in bucket:
+                    self._insert(key, ticks)
+
+            index = self.current % self.slots
+            bucket, self.wheels[0][index] = self.wheels[0][index], []
+            for key, ticks in bucket:
+                if ticks <= self.current:
+                    self.count -= 1
+                    due.append(key)
+                else:
+                    self._insert(key, ticks)
+        return due
+
+
+class DeviceAvailability():
+    __slots__ = ("last_seen", "interval", "gaps", "online", "scheduled")
+
+    def __init__(self, now):
+        self.last_seen = now
+        self.interval = None
+        self.gaps = 0
+        self.online = True
+        self.scheduled = False
+
+
+class AvailabilityTracker():
+    ''' Devices are offline once not heard from for missed_intervals of their learned interval (but never less than
+        min_timeout_secs), or default_timeout_secs until their interval has been learned.
+    '''
+    def __init__(self, missed_intervals=3, min_timeout_secs=600, default_timeout_secs=3600, max_timeout_secs=86400, now=None):
+        self.missed_intervals = missed_intervals
+        self.min_timeout_secs = min_timeout_secs
+        self.default_timeout_secs = default_timeout_secs
+        self.max_timeout_secs = max_timeout_secs
+        self.devices = {}
+        self.wheel = TimerWheel(now=now)
+        self._changed = {}
+
+    def timeout(self, device):
+        if device.gaps < LEARN_GAPS:
+            return self.default_timeout_secs
+        return min(max(device.interval * self.missed_intervals, self.min_timeout_secs), self.max_timeout_secs)
+
+    def note(self, device_id, now=None):
+        """ Record a packet from the device """
+        now = now if now is not None else time.time()
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = DeviceAvailability(now)
+            self._changed[device_id] = SZ_ONLINE
+        else:
+            gap = now - device.last_seen
+            if gap >= MIN_GAP_SECS:
+                device.interval = gap if device.interval is None else device.interval + INTERVAL_WEIGHT * (gap - device.interval)
+                device.gaps += 1
+            device.last_seen = now
+            if not device.online:
+                device.online = True
+                self._changed[device_id] = SZ_ONLINE
+
+        if not device.scheduled:
+            device.scheduled = True
+            self.wheel.schedule(device_id, now + self.timeout(device))
+
+    def check(self, now=None):
+        """ Advance the wheel, marking the devices that are overdue as offline """
+        now = now if now is not None else time.time()
+        for device_id in self.wheel.advance(now):
+            device = self.devices.get(device_id)
+            if device is None:
+                continue
+            deadline = device.last_seen + self.timeout(device)
+            if deadline > now:
+                # Heard from since it was scheduled, so just move it on
+                self.wheel.schedule(device_id, deadline)
+            else:
+                device.scheduled = False
+                device.online = False
+                self._changed[device_id] = SZ_OFFLINE
+
+    def pop_changed(self):
+        """ {device_id: online/offline} for the devices changed since the last call """
+        changed, self._changed = self._changed, {}
+        return changed
+
+    def is_online(self, device_id):
+        device = self.devices.get(device_id)
+        return device.online if device else None
+
+    def stats(self):
+        online = sum(1 for device in self.devices.values() if device.online)
+        return {"devices": len(self.devices), "online": online, "offline": len(self.devices) - online,
+            "wheel_entries": self.wheel.count}
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Memory allocated per received packet by each stage of the gateway's hot path, measured with tracemalloc against
+    a corpus of recorded messages, with regression checks against a saved baseline.
+
+    Stages (each per packet, i.e. for every item of array payloads):
+    - display_text: the display handler's text for the payload (cleanup_display_text)
+    - display_row: resolving the names and colours of the console row, and printing it (display_simple_msg)
+    - publish: resolving the topics, and publishing the values (mqtt_publish_received_msg), to a stand-in client
+    - process: all of the above and the rest of process_gwy_message (logging etc), with the optional features off
+
+    For each stage: 'peak' is the most memory allocated at once while the packet is processed (i.e. the transient
+    garbage that the GC and allocator have to deal with), and 'retained' is what is still allocated afterwards (e.g.
+    caches, which should be 0 once warmed up). The time per packet is measured separately, without tracemalloc.
+
+    The corpus is json lines as sent by the event stream (EVENT_STREAM_SOCKET), e.g. recorded with
+    socat -u UNIX-CONNECT:/tmp/evogateway.sock - > corpus.jsonl, or the samples in bench_code_handlers.py by default.
+
+    python3 benchmarks/bench_allocations.py [--corpus corpus.jsonl] [--save-baseline allocs.json]
+    python3 benchmarks/bench_allocations.py [--corpus corpus.jsonl] --baseline allocs.json [--tolerance 0.1]
+        exits with 1 if any stage's mean peak bytes per packet is more than 'tolerance' over the baseline
+"""
+
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import evogateway as gw
+from bench_code_handlers import SAMPLES
+
+CTL_ID = "01:123456"
+
+
+class NullClient():
+    ''' Stand-in for the paho client, that just counts what would be published '''
+    def __init__(self):
+        self.published = 0
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+
+
+class StandInGateway():
+    ''' Stand-in for the ramses_rf Gateway, for the device lookup made when resolving a message's zone '''
+    def get_device(self, device_id):
+        return None
+
+
+def corpus_msg(record):
+    """ A message, with the attributes of a ramses_rf Message that the gateway uses, from an event stream record """
+    src, dst = record["src"], record.get("dst") or record["src"]
+    verb = f"{record['verb']:>2}"
+    code_name = record.get("code_name") or gw.CODE_NAMES.get(record["code"], record["code"])
+    return SimpleNamespace(code=record["code"], code_name=code_name, verb=verb, payload=record["payload"],
+        src=SimpleNamespace(id=src, type=src[:2]), dst=SimpleNamespace(id=dst, type=dst[:2]),
+        dtm=datetime.datetime.fromisoformat(record["dtm"]) if "dtm" in record else datetime.datetime.now(),
+        _pkt=SimpleNamespace(_rssi=record.get("rssi") or "060", _frame=f"{verb} --- {src} {dst} --:------ {record['code']}"))
+
+
+def load_corpus(file_path):
+    if not file_path:
+        return [corpus_msg({"src": CTL_ID, "code": code, "verb": verb.strip(), "payload": payload})
+            for code, verb, payload in SAMPLES if code in gw.CODE_NAMES]
+    with open(file_path) as fp:
+        return [corpus_msg(json.loads(line)) for line in fp if line.strip()]
+
+
+def setup(msgs):
+    """ Gateway state for the corpus: every device known, and zones named, as in a running system """
+    gw.MQTT_CLIENT = NullClient()
+    gw.GWY = StandInGateway()
+    gw.update_zones_from_gwy = lambda *args, **kwargs: None     # The zones are fixed for the benchmark
+    gw.PIPELINE = None
+    gw.DISPLAY_FULL_JSON = False
+    gw.ZONES.update({f"{i:02X}": f"Zone {i}" for i in range(12)})
+    gw.TOPIC_TEMPLATES = gw.new_topic_templates(gw.MQTT_TOPIC_TEMPLATES, gw.MQTT_GROUP_BY_ZONE)
+    for msg in msgs:
+        for device in (msg.src, msg.dst):
+            if device.type not in ("18", "--", "63") and device.id not in gw.DEVICES:
+                gw.DEVICES[device.id] = {gw.SZ_ALIAS: f"Device {device.id[3:]}"}
+
+
+def items_of(msg):
+    return msg.payload if isinstance(msg.payload, list) else [msg.payload]
+
+
+def stage_display_text(msg):
+    for item in items_of(msg):
+        gw.cleanup_display_text(msg, item)
+
+
+def stage_display_row(msg):
+    for item in items_of(msg):
+        gw.display_simple_msg(msg, item, item.get(gw.SZ_ZONE_IDX) if isinstance(item, dict) else None)
+
+
+def stage_publish(msg):
+    for item in items_of(msg):
+        gw.mqtt_publish_received_msg(msg, item)
+
+
+def stage_process(msg):
+    gw.process_gwy_message(msg)
+
+
+STAGES = {"display_text": stage_display_text, "display_row": stage_display_row, "publish": stage_publish,
+    "process": stage_process}
+
+
+def measure(stage, msgs, repeat):
+    """ {peak_bytes, max_peak_bytes, retained_bytes, us} per packet """
+    for msg in msgs:
+        # Warm up, i.e. fill the caches, as in a running gateway
+        stage(msg)
+
+    gc.collect()
+    tracemalloc.start()
+    peaks = []
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    for msg in msgs:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        stage(msg)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - start_bytes
+    tracemalloc.stop()
+
+    collections = sum(generation["collections"] for generation in gc.get_stats())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for msg in msgs:
+            stage(msg)
+    secs = time.perf_counter() - start
+    collections = sum(generation["collections"] for generation in gc.get_stats()) - collections
+
+    count = len(msgs)
+    return {"peak_bytes": round(sum(peaks) / count), "max_peak_bytes": max(peaks), "retained_bytes": round(retained / count),
+        "us": round(secs / (count * repeat) * 1e6, 2), "gc_per_1000": round(collections * 1000 / (count * repeat), 2)}
+
+
+def compare(results, baseline, tolerance):
+    """ The stages whose mean peak bytes per packet has regressed by more than the tolerance """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name, {}).get("peak_bytes")
+        if expected is not None and result["peak_bytes"] > expected * (1 + tolerance):
+            regressions.append(f"{name}: {result['peak_bytes']} bytes/packet, baseline {expected}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory allocated per packet by each stage of the hot path")
+    parser.add_argument("-c", "--corpus", help="Event stream json lines (default: the code handler samples)")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="Passes over the corpus for the timings")
+    parser.add_argument("-s", "--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("-b", "--baseline", help="Fail if the peak bytes/packet of any stage has regressed from this baseline")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1, help="Regression allowed, as a fraction of the baseline")
+    parser.add_argument("--save-baseline", help="Save the results as the baseline")
+    args = parser.parse_args(argv)
+
+    msgs = load_corpus(args.corpus)
+    if not msgs:
+        print("Corpus is empty")
+        return 1
+    setup(msgs)
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name in args.stages:
+            results[name] = measure(STAGES[name], msgs, args.repeat)
+
+    print(f"{len(msgs)} packets, {gw.MQTT_CLIENT.published} publishes")
+    print(f"{'stage':<14} {'peak B/pkt':>10} {'max peak B':>10} {'retained B':>10} {'µs/pkt':>8} {'gc/1000':>8}")
+    for name, result in results.items():
+        print(f"{name:<14} {result['peak_bytes']:>10} {result['max_peak_bytes']:>10} {result['retained_bytes']:>10} "
+            f"{result['us']:>8} {result['gc_per_1000']:>8}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(results, fp, indent=4)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Micro-benchmark of the per-code display and MQTT handlers, i.e. the per-packet cost of each code's special casing.
+
+    python3 benchmarks/bench_code_handlers.py [--number 20000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import evogateway as gw
+
+# Representative payloads, as decoded by ramses_rf, for the common codes and each of the special cased ones
+SAMPLES = [
+    ("30C9", " I", {"zone_idx": "01", "temperature": 19.5}),
+    ("2309", " I", {"zone_idx": "01", "setpoint": 21.0}),
+    ("3150", " I", {"zone_idx": "01", "heat_demand": 0.35}),
+    ("0008", " I", {"domain_id": "FC", "relay_demand": 0.5}),
+    ("2349", " I", {"zone_idx": "01", "mode": "temporary_override", "setpoint": 21.0, "until": "2021-05-31 17:40:00"}),
+    ("1F41", " I", {"active": True, "mode": "temporary_override", "until": "2021-05-31 17:40:00"}),
+    ("0418", "RP", {"log_idx": "00", "timestamp": "21-05-20T10:00:00", "fault_state": "fault", "fault_type": "comms_fault",
+                    "domain_idx": "00", "device_class": "actuator", "device_id": "04:123456"}),
+    ("3220", "RP", {"msg_id": 0x11, "msg_type": "Read-Ack", "msg_name": "RelativeModulationLevel", "value": 0.2,
+                    "description": "Relative modulation level"}),
+    ("1F09", " I", {"remaining_seconds": 178.5, "_next_sync": "21:34:10"}),
+    ("000A", "RP", {"zone_idx": "01", "min_temp": 5.0, "max_temp": 35.0, "local_override": True,
+                    "openwindow_function": True, "multiroom_mode": False}),
+]
+
+
+def fake_msg(code, verb, payload):
+    src = SimpleNamespace(id="01:123456", type="01")
+    return SimpleNamespace(code=code, code_name=gw.CODE_NAMES[code], verb=verb, payload=payload, src=src, dst=src)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the per-code display and MQTT handlers")
+    parser.add_argument("-n", "--number", type=int, default=20000, help="Iterations per code")
+    args = parser.parse_args(argv)
+
+    print(f"{'code':<5} {'code_name':<20} {'display handler':<22} {'mqtt handler':<24} {'display µs':>10} {'mqtt µs':>9}")
+    for code, verb, payload in SAMPLES:
+        if code not in gw.CODE_NAMES:
+            continue
+        msg = fake_msg(code, verb, payload)
+        display_handler, mqtt_handler = gw.get_code_handlers(msg.code_name)
+
+        display_secs = timeit.timeit(lambda: gw.cleanup_display_text(msg, payload), number=args.number)
+        mqtt_secs = timeit.timeit(lambda: gw.get_code_handlers(msg.code_name)[1](msg, payload, gw.MQTT_ZONE_IND_TOPIC, "ctl_controller"),
+            number=args.number)
+
+        print(f"{code:<5} {msg.code_name:<20} {display_handler.__name__:<22} {mqtt_handler.__name__:<24} "
+            f"{display_secs / args.number * 1e6:>10.2f} {mqtt_secs / args.number * 1e6:>9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" End to end benchmark of the MQTT -> RF command path (mqtt_process_msg -> GWY.send_cmd -> send_command_callback),
+    against a virtual controller on a pty and a local stand-in broker, so it runs on any Linux box.
+
+    An unmodified evogateway.py is run in a temporary folder, with its own config. Commands are published to it over
+    the stand-in broker, and measured by the send status it publishes:
+
+    - sequential: single commands, one at a time; the ack latency is from publishing the command to its 'Successful'
+      (or 'Failed') status on _last_command/status
+    - batch: 'batch' commands of each size, for the command throughput; completed when _last_batch is published
+    - schedules: a (multi-fragment) schedule transfer for each zone, timed by the virtual controller
+
+    Retries are counted by the virtual controller, as the same request received again within a few seconds.
+
+    python3 benchmarks/bench_command_path.py [--commands 50] [--batches 10 50] [--delay-ms 50] [--loss 0.05] [--split 0.2]
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from mini_broker import MiniBroker
+from virtual_controller import VirtualController, open_pty
+
+GATEWAY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evogateway.py")
+PUB_TOPIC = "evobench"
+SUB_TOPIC = f"{PUB_TOPIC}/_zone_independent/command"
+STARTUP_TIMEOUT_SECS = 90
+COMMAND_TIMEOUT_SECS = 30
+
+CONFIG = """
+[Serial Port]
+COM_PORT = {port}
+
+[Files]
+EVENTS_FILE = events.log
+PACKET_LOG_FILE = packet.log
+
+[MQTT]
+MQTT_SERVER = 127.0.0.1
+MQTT_PORT = {mqtt_port}
+MQTT_SUB_TOPIC = {sub_topic}
+MQTT_PUB_TOPIC = {pub_topic}
+
+[MISC]
+RF_BUDGET_PER_MIN = 0
+"""
+
+
+def command_mix(ctl_id, zones):
+    """ Cycle of the commands sent, of each type that the controller answers """
+    commands = []
+    for i in range(zones):
+        zone_idx = f"{i:02X}"
+        commands += [{"command": "get_zone_mode", "ctl_id": ctl_id, "zone_idx": zone_idx},
+            {"command": "set_zone_setpoint", "ctl_id": ctl_id, "zone_idx": zone_idx, "setpoint": 20 + i % 3},
+            {"command": "get_zone_config", "ctl_id": ctl_id, "zone_idx": zone_idx}]
+    # ramses_rf's non-zone constructors take the controller as dst_id (see validate_api_params)
+    commands.append({"command": "get_system_mode", "dst_id": ctl_id})
+    return commands
+
+
+class CommandBench():
+    ''' Publishes the commands to the stand-in broker, and waits for their statuses '''
+    def __init__(self, broker, controller):
+        self.broker = broker
+        self.controller = controller
+        self._waiter = None
+        self._batch_waiters = {}
+        broker.add_listener(f"{SUB_TOPIC}/_last_command/status", self._on_status)
+        broker.add_listener(f"{SUB_TOPIC}/_last_batch", self._on_batch)
+
+    def _on_status(self, topic, payload):
+        status = payload.decode()
+        if self._waiter and not self._waiter.done() and status in ("Successful", "Failed", "Invalid"):
+            self._waiter.set_result(status)
+
+    def _on_batch(self, topic, payload):
+        result = json.loads(payload)
+        waiter = self._batch_waiters.pop(result.get("batch_id"), None)
+        if waiter and not waiter.done():
+            waiter.set_result(result)
+
+    async def send(self, command, timeout=COMMAND_TIMEOUT_SECS):
+        """ Send a single command, returning (status, secs) """
+        self._waiter = asyncio.get_running_loop().create_future()
+        start = time.monotonic()
+        self.broker.publish(SUB_TOPIC, json.dumps(command))
+        try:
+            status = await asyncio.wait_for(self._waiter, timeout)
+        except asyncio.TimeoutError:
+            status = "Timed out"
+        return status, time.monotonic() - start
+
+    async def send_batch(self, batch_id, commands):
+        waiter = self._batch_waiters[batch_id] = asyncio.get_running_loop().create_future()
+        start = time.monotonic()
+        self.broker.publish(SUB_TOPIC, json.dumps({"batch_id": batch_id, "batch": commands}))
+        try:
+            result = await asyncio.wait_for(waiter, COMMAND_TIMEOUT_SECS * 5)
+        except asyncio.TimeoutError:
+            result = {"status": "Timed out"}
+        return result, time.monotonic() - start
+
+    async def wait_until_ready(self, gateway):
+        """ Until the gateway has discovered the controller and answers commands """
+        start = time.monotonic()
+        while time.monotonic() - start < STARTUP_TIMEOUT_SECS:
+            if gateway.returncode is not None:
+                raise RuntimeError(f"evogateway.py exited with code {gateway.returncode} (see events.log)")
+            if self.broker.sessions:
+                status, _ = await self.send({"command": "get_zone_mode", "ctl_id": self.controller.ctl_id, "zone_idx": "00"},
+                    timeout=5)
+                if status == "Successful":
+                    return time.monotonic() - start
+            await asyncio.sleep(1)
+        raise RuntimeError("Timed out waiting for the gateway to answer commands")
+
+    async def sequential(self, count, mix):
+        retries = self.controller.stats["retries"]
+        latencies, outcomes = [], {}
+        start = time.monotonic()
+        for i in range(count):
+            status, secs = await self.send(mix[i % len(mix)])
+            outcomes[status] = outcomes.get(status, 0) + 1
+            if status == "Successful":
+                latencies.append(secs * 1000)
+        elapsed = time.monotonic() - start
+        latencies.sort()
+        return {"commands": count, "per_sec": round(count / elapsed, 1), "outcomes": outcomes,
+            "retries": self.controller.stats["retries"] - retries,
+            "p50_ms": round(statistics.median(latencies), 1) if latencies else None,
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None,
+            "max_ms": round(latencies[-1], 1) if latencies else None}
+
+    async def batch(self, size, mix):
+        retries = self.controller.stats["retries"]
+        result, secs = await self.send_batch(f"bench_{size}", [mix[i % len(mix)] for i in range(size)])
+        return {"commands": size, "secs": round(secs, 2), "per_sec": round(size / secs, 1), "status": result.get("status"),
+            "succeeded": result.get("succeeded"), "retries": self.controller.stats["retries"] - retries}
+
+    async def schedules(self, zones):
+        retries = self.controller.stats["retries"]
+        for i in range(zones):
+            self.broker.publish(SUB_TOPIC, json.dumps({"command": "get_schedule", "zone_idx": f"{i:02X}"}))
+        start = time.monotonic()
+        while time.monotonic() - start < COMMAND_TIMEOUT_SECS * 2:
+            transfers = self.controller.transfers
+            if len(transfers) == zones and all(t["completed"] for t in transfers.values()):
+                break
+            await asyncio.sleep(0.2)
+        transfers = self.controller.transfers.values()
+        done = [t["completed"] - t["started"] for t in transfers if t["completed"]]
+        return {"zones": zones, "completed": len(done), "fragments": sum(t["fragments"] for t in transfers),
+            "mean_secs": round(statistics.mean(done), 2) if done else None, "max_secs": round(max(done), 2) if done else None,
+            "retries": self.controller.stats["retries"] - retries}
+
+
+def write_config(folder, port, mqtt_port, settings):
+    config = configparser.RawConfigParser()
+    config.optionxform = str
+    config.read_string(CONFIG.format(port=port, mqtt_port=mqtt_port, sub_topic=SUB_TOPIC, pub_topic=PUB_TOPIC))
+    for setting in settings:
+        name, value = setting.split("=", 1)
+        section, key = name.split(".", 1)
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, value)
+    with open(os.path.join(folder, "evogateway.cfg"), "w") as fp:
+        config.write(fp)
+
+
+async def run(args):
+    broker = MiniBroker(port=0)
+    await broker.start()
+    master_fd, slave_fd, port = open_pty()
+    controller = VirtualController(master_fd, zones=args.zones, delay_ms=args.delay_ms, loss=args.loss, split=args.split)
+    controller.start()
+    bench = CommandBench(broker, controller)
+
+    with tempfile.TemporaryDirectory(prefix="evobench_") as folder:
+        write_config(folder, port, broker.port, args.set)
+        gateway = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(GATEWAY), cwd=folder,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            secs = await bench.wait_until_ready(gateway)
+            print(f"Gateway ready after {secs:.1f}s. Controller: {args.zones} zones, {args.delay_ms}ms delay, "
+                f"{args.loss:.0%} loss, {args.split:.0%} split")
+            mix = command_mix(controller.ctl_id, args.zones)
+
+            result = await bench.sequential(args.commands, mix)
+            print(f"sequential  {result['commands']:>4} commands {result['per_sec']:>7}/s  ack p50 {result['p50_ms']}ms "
+                f"p95 {result['p95_ms']}ms max {result['max_ms']}ms  retries {result['retries']}  {result['outcomes']}")
+            for size in args.batches:
+                result = await bench.batch(size, mix)
+                print(f"batch       {result['commands']:>4} commands {result['per_sec']:>7}/s  {result['secs']}s  "
+                    f"{result['status']} ({result['succeeded']} succeeded)  retries {result['retries']}")
+            if args.schedules:
+                result = await bench.schedules(args.zones)
+                print(f"schedules   {result['completed']}/{result['zones']} zones, {result['fragments']} fragments  "
+                    f"mean {result['mean_secs']}s max {result['max_secs']}s  retries {result['retries']}")
+            print(f"Controller: {controller.stats}")
+        finally:
+            if gateway.returncode is None:
+                gateway.terminate()
+                await gateway.wait()
+            controller.stop()
+            await broker.close()
+            os.close(master_fd)
+            os.close(slave_fd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MQTT -> RF command path against a virtual controller")
+    parser.add_argument("-n", "--commands", type=int, default=50, help="Sequential commands")
+    parser.add_argument("-b", "--batches", type=int, nargs="*", default=[10, 50], help="Batch sizes")
+    parser.add_argument("-z", "--zones", type=int, default=8)
+    parser.add_argument("-d", "--delay-ms", type=float, default=50, help="Controller's mean response delay")
+    parser.add_argument("-l", "--loss", type=float, default=0, help="Fraction of requests the controller does not answer")
+    parser.add_argument("-s", "--split", type=float, default=0, help="Fraction of responses split over several serial reads")
+    parser.add_argument("--no-schedules", dest="schedules", action="store_false", help="Skip the schedule transfers")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.SETTING=VALUE",
+        help="Extra gateway config setting, e.g. MISC.RF_BUDGET_PER_MIN=30")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(run(args))
+    except RuntimeError as ex:
+        print(ex)
+        return 1
+    except KeyboardInterrupt:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
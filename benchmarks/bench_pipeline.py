@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Throughput of the publish and display stages, in the gateway process vs. split across pipeline worker processes.
+
+    By default the MQTT client is a stand-in that encodes each PUBLISH packet (as paho does) without sending it,
+    so the figures are for the CPU work only. Use --broker to publish to a real broker instead.
+
+    python3 benchmarks/bench_pipeline.py [--messages 20000] [--workers 1 2 3] [--broker localhost]
+"""
+
+import argparse
+import contextlib
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import paho.mqtt.client as mqtt
+
+import evogateway as gw
+from bench_code_handlers import SAMPLES, fake_msg
+from pipeline import ProcessPipeline
+
+BROKER = None
+
+
+class EncodingClient():
+    ''' Stand-in for the paho client, which builds the PUBLISH packet but does not send it '''
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        topic = topic.encode("utf-8")
+        payload = payload.encode("utf-8") if isinstance(payload, str) else payload or b""
+        packet = struct.pack("!BH", 0x31 if retain else 0x30, len(topic)) + topic + payload
+        self.published += 1
+        return len(packet)
+
+    def disconnect(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+def create_client():
+    if not BROKER:
+        return EncodingClient()
+    client = mqtt.Client()
+    client.connect(BROKER)
+    client.loop_start()
+    return client
+
+
+def worker_init(index):
+    sys.stdout = open(os.devnull, "w")
+    return create_client()
+
+
+def build_records(count):
+    """ The (topic key, publish args, display row) of each message, as mqtt_publish_received_msg and display_simple_msg would submit """
+    samples = [(fake_msg(code, verb, payload), payload) for code, verb, payload in SAMPLES if code in gw.CODE_NAMES]
+    records = []
+    for i in range(count):
+        msg, payload = samples[i % len(samples)]
+        payload = dict(payload)
+        zone, device = f"zone_{i % 8}", f"trv_zone_{i % 8}_{i % 20:02d}"
+        topic_idx, new_key, updated_payload = gw.get_code_handlers(msg.code_name)[1](msg, payload, zone, device)
+        topic_base = f"{gw.MQTT_PUB_TOPIC}/{zone}/{device}/{msg.code_name}{topic_idx}"
+        publish = (topic_base, new_key, payload, updated_payload, None, msg.code_name, "2021-05-20T12:34:56", False)
+        display = (msg.code_name, msg.verb, payload, f"TRV {device}", "Controller", f"@ {zone:<20}", f"[Zone {i % 8:<3}]", "", "070", "")
+        records.append((topic_base, publish, display))
+    return records
+
+
+def run_single(records):
+    client = create_client()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for topic_base, publish, display in records:
+            gw.mqtt_publish_values(client, *publish)
+            gw.pipeline_worker_handle(None, (gw.PIPELINE_DISPLAY, display))
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    client.disconnect()
+    return elapsed, cpu
+
+
+def run_pipeline(records, workers):
+    pipeline = ProcessPipeline(workers, worker_init, gw.pipeline_worker_handle, gw.pipeline_worker_finish)
+    pipeline.start()
+    time.sleep(0.5)     # Let the workers connect
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for topic_base, publish, display in records:
+        pipeline.submit(topic_base, (gw.PIPELINE_PUBLISH, publish))
+        pipeline.submit(gw.PIPELINE_DISPLAY, (gw.PIPELINE_DISPLAY, display))
+        pipeline.flush()
+    submit_cpu = time.process_time() - cpu_start
+    pipeline.close()    # i.e. until the workers have drained their queues
+    elapsed = time.perf_counter() - start
+    if pipeline.dropped:
+        print(f"  ({pipeline.dropped} records dropped as the queues were full)")
+    return elapsed, submit_cpu
+
+
+def main(argv=None):
+    global BROKER
+    parser = argparse.ArgumentParser(description="Benchmark the publish/display stages in process vs. in pipeline workers")
+    parser.add_argument("-n", "--messages", type=int, default=20000, help="Number of messages")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 3], help="Worker counts to compare")
+    parser.add_argument("-b", "--broker", help="Publish to this broker, rather than just encoding the packets")
+    args = parser.parse_args(argv)
+    BROKER = args.broker
+
+    records = build_records(args.messages)
+    print(f"{args.messages} messages, {'broker ' + BROKER if BROKER else 'encode only'}")
+    print(f"{'mode':<14} {'msgs/sec':>10} {'elapsed s':>10} {'gateway cpu µs/msg':>20}")
+
+    elapsed, cpu = run_single(records)
+    print(f"{'single':<14} {args.messages / elapsed:>10.0f} {elapsed:>10.2f} {cpu / args.messages * 1e6:>20.1f}")
+    for workers in args.workers:
+        elapsed, cpu = run_pipeline(records, workers)
+        print(f"{f'{workers} worker(s)':<14} {args.messages / elapsed:>10.0f} {elapsed:>10.2f} {cpu / args.messages * 1e6:>20.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Synthetic RAMSES traffic generator, for finding the rate at which evoGateway starts to fall behind on a large site.
+
+    Synthesizes valid frames for a site of any size (zones of TRVs and thermostats, UFH controllers, a chatty OpenTherm
+    bridge, DHW and a noisy neighbour's system), and writes them to a virtual serial port (pty), which an unmodified
+    evogateway.py is run against, in a temporary folder with its own config. Nothing is mocked; the frames go through
+    ramses_rf's serial transport, parser and the whole of evoGateway, as in production.
+
+    The rate is stepped up until the gateway degrades. Each TRV temperature frame is a probe, with a unique value per
+    TRV, and its latency is from being written to the pty to arriving on the gateway's event stream (EVENT_STREAM_SOCKET).
+    Probes not received by the end of the step (plus a grace period) are counted as dropped.
+
+    python3 benchmarks/load_generator.py [--broker localhost] [--zones 12] [--trvs 8] [--rates 10 20 50 100 200 400]
+        [--set MISC.PIPELINE_WORKERS=2]
+
+    Requires an MQTT broker, as evoGateway will not start without one. Linux only (pty, /proc).
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import pty
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tty
+
+GATEWAY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evogateway.py")
+STARTUP_TIMEOUT_SECS = 60
+DRAIN_GRACE_SECS = 2
+TICK_SECS = 0.01
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+CONFIG = """
+[Serial Port]
+COM_PORT = {port}
+
+[Files]
+EVENTS_FILE = events.log
+PACKET_LOG_FILE = packet.log
+EVENT_STREAM_SOCKET = {socket}
+EVENT_STREAM_BUFFER = 100000
+
+[MQTT]
+MQTT_SERVER = {broker}
+MQTT_SUB_TOPIC = evoload/_zone_independent/command
+MQTT_PUB_TOPIC = evoload
+
+[MISC]
+DISABLE_SENDING = True
+
+[Ramses_rf]
+enable_eavesdrop = True
+"""
+
+
+def device_id(type, index):
+    # The device number is 18 bits, shown in decimal
+    return f"{type}:{(0x01000 + index * 7919) % 0x40000:06d}"
+
+
+def temp_hex(temp):
+    return f"{round(temp * 100) & 0xFFFF:04X}"
+
+
+def opentherm_frame(msg_type, msg_id, value):
+    """ OpenTherm frame, with the parity bit set so that the 32 bits have an even number of ones """
+    frame = (msg_type << 28) | (msg_id << 16) | (value & 0xFFFF)
+    if bin(frame).count("1") % 2:
+        frame |= 0x80000000
+    return f"{frame:08X}"
+
+
+def frame(verb, src, dst, code, payload, rssi=None):
+    """ Frame as received from the HGI80/evofw3, e.g. '045  I --- 04:123456 --:------ 01:145038 3150 002 0100' """
+    rssi = rssi or random.randint(40, 80)
+    addrs = f"{src} {dst} --:------" if verb in ("RQ", "RP", " W") else f"{src} --:------ {dst}"
+    return f"{rssi:03d} {verb} --- {addrs} {code} {len(payload) // 2:03d} {payload}"
+
+
+class SyntheticSite():
+    ''' The devices of a site, and one 'round' of their frames, in the proportions they are seen in on a real system '''
+    def __init__(self, zones=12, trvs_per_zone=8, ufh_controllers=3, opentherm=True, neighbour_zones=4):
+        self.ctl_id = device_id("01", 1)
+        self.zones = list(range(zones))
+        self.trvs = {zone: [device_id("04", zone * 100 + i) for i in range(trvs_per_zone)] for zone in self.zones}
+        self.thermostats = {zone: device_id("34", zone) for zone in self.zones}
+        self.ufh_ids = [device_id("02", i) for i in range(ufh_controllers)]
+        self.otb_id = device_id("10", 1) if opentherm else None
+        self.dhw_id = device_id("07", 1)
+        self.neighbour_ctl_id = device_id("01", 2) if neighbour_zones else None
+        self.neighbour_trvs = [device_id("04", 9000 + i) for i in range(neighbour_zones * 2)]
+        self.probe_ids = [trv for trvs in self.trvs.values() for trv in trvs]
+        self.probe_counts = {trv: 0 for trv in self.probe_ids}
+
+    @property
+    def device_count(self):
+        return (1 + len(self.probe_ids) + len(self.thermostats) + len(self.ufh_ids) + (1 if self.otb_id else 0) + 1
+            + (1 + len(self.neighbour_trvs) if self.neighbour_ctl_id else 0))
+
+    def probe(self, trv):
+        """ TRV temperature frame, with a temperature that is unique to it for its last 2000 probes. Returns (frame, key) """
+        count = self.probe_counts[trv] = self.probe_counts[trv] + 1
+        temp = 10 + (count % 2000) / 100
+        return frame(" I", trv, self.ctl_id, "30C9", f"00{temp_hex(temp)}"), (trv, round(temp, 2))
+
+    def round(self):
+        """ One round of frames, as a list of (frame, probe key or None), shuffled """
+        frames = []
+        ctl = self.ctl_id
+        frames.append((frame(" I", ctl, ctl, "1F09", "FF0532"), None))
+        frames.append((frame(" I", ctl, ctl, "30C9", "".join(f"{z:02X}{temp_hex(random.uniform(17, 22))}" for z in self.zones)), None))
+        frames.append((frame(" I", ctl, ctl, "2309", "".join(f"{z:02X}{temp_hex(21)}" for z in self.zones)), None))
+        frames.append((frame(" I", ctl, ctl, "3B00", "FCC8"), None))
+
+        for zone, trvs in self.trvs.items():
+            for trv in trvs:
+                frames.append(self.probe(trv))
+                frames.append((frame(" I", trv, ctl, "3150", f"{zone:02X}{random.randint(0, 200):02X}"), None))
+                if random.random() < 0.2:
+                    frames.append((frame(" I", trv, ctl, "12B0", f"{zone:02X}0000"), None))
+            thermostat = self.thermostats[zone]
+            frames.append((frame(" I", thermostat, thermostat, "30C9", f"00{temp_hex(random.uniform(17, 22))}"), None))
+
+        for ufh_id in self.ufh_ids:
+            for circuit in range(8):
+                frames.append((frame(" I", ufh_id, ufh_id, "3150", f"{circuit:02X}{random.randint(0, 200):02X}"), None))
+            frames.append((frame(" I", ufh_id, ufh_id, "0008", f"FA{random.randint(0, 200):02X}"), None))
+
+        if self.otb_id:
+            # The controller polls the bridge for a number of OpenTherm values every minute or so
+            for msg_id, value in ((0x11, 0x1400), (0x19, 0x3C00), (0x1C, 0x3200), (0x12, 0x0180), (0x00, 0x0300), (0x05, 0x0000)):
+                frames.append((frame("RQ", ctl, self.otb_id, "3220", f"00{opentherm_frame(0, msg_id, 0)}"), None))
+                frames.append((frame("RP", self.otb_id, ctl, "3220", f"00{opentherm_frame(4, msg_id, value)}"), None))
+            frames.append((frame(" I", self.otb_id, self.otb_id, "3EF0", "000010"), None))
+
+        frames.append((frame(" I", self.dhw_id, self.dhw_id, "1260", f"00{temp_hex(random.uniform(45, 55))}"), None))
+
+        if self.neighbour_ctl_id:
+            # Out of range, so weaker signal, and not part of our system
+            for trv in self.neighbour_trvs:
+                frames.append((frame(" I", trv, self.neighbour_ctl_id, "30C9", f"00{temp_hex(random.uniform(15, 20))}", random.randint(85, 99)), None))
+            frames.append((frame(" I", self.neighbour_ctl_id, self.neighbour_ctl_id, "1F09", "FF0532", 90), None))
+
+        random.shuffle(frames)
+        return frames
+
+
+class LoadRun():
+    ''' Drives the gateway through the pty, and matches the probes received on its event stream '''
+    def __init__(self, site, master_fd):
+        self.site = site
+        self.master_fd = master_fd
+        self.pending = {}       # {probe key: time written}
+        self.latencies = []
+        self.written = 0
+        self.tx_dropped = 0     # Frames the pty would not take, i.e. the gateway is not reading fast enough
+        self.frames = []
+
+    def next_frame(self):
+        if not self.frames:
+            self.frames = self.site.round()
+        return self.frames.pop()
+
+    def write(self, count):
+        for _ in range(count):
+            line, key = self.next_frame()
+            try:
+                os.write(self.master_fd, f"{line}\r\n".encode())
+            except BlockingIOError:
+                self.tx_dropped += 1
+                continue
+            self.written += 1
+            if key:
+                self.pending[key] = time.monotonic()
+
+    def drain_pty(self):
+        # Discard anything the gateway writes
+        try:
+            os.read(self.master_fd, 4096)
+        except OSError:
+            pass
+
+    async def read_events(self, reader):
+        while line := await reader.readline():
+            event = json.loads(line)
+            payload = event.get("payload")
+            if isinstance(payload, dict) and "temperature" in payload:
+                sent = self.pending.pop((event["src"], round(payload["temperature"], 2)), None)
+                if sent is not None:
+                    self.latencies.append(time.monotonic() - sent)
+
+    async def step(self, rate, secs):
+        """ Write at 'rate' frames/sec for secs, and return the stats for the probes written in that time """
+        self.latencies, self.pending = [], {}
+        written, tx_dropped = self.written, self.tx_dropped
+        start = time.monotonic()
+        due = 0.0
+        while (now := time.monotonic()) - start < secs:
+            due += rate * TICK_SECS
+            self.write(int(due))
+            due -= int(due)
+            await asyncio.sleep(max(0, TICK_SECS - (time.monotonic() - now)))
+        actual_secs = time.monotonic() - start
+        await asyncio.sleep(DRAIN_GRACE_SECS)
+
+        received, dropped = len(self.latencies), len(self.pending)
+        latencies_ms = sorted(x * 1000 for x in self.latencies)
+        return {"rate": rate, "actual_rate": round((self.written - written) / actual_secs),
+            "probes": received + dropped, "dropped_pct": round(100 * dropped / max(received + dropped, 1), 2),
+            "tx_dropped": self.tx_dropped - tx_dropped,
+            "p50_ms": round(statistics.median(latencies_ms), 1) if latencies_ms else None,
+            "p95_ms": round(latencies_ms[int(len(latencies_ms) * 0.95)], 1) if latencies_ms else None,
+            "max_ms": round(latencies_ms[-1], 1) if latencies_ms else None}
+
+
+def process_cpu_secs(pid):
+    with open(f"/proc/{pid}/stat") as fp:
+        fields = fp.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def write_config(folder, port, socket_path, broker, settings):
+    config = configparser.RawConfigParser()
+    config.optionxform = str
+    config.read_string(CONFIG.format(port=port, socket=socket_path, broker=broker))
+    for setting in settings:
+        name, value = setting.split("=", 1)
+        section, key = name.split(".", 1)
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, value)
+    with open(os.path.join(folder, "evogateway.cfg"), "w") as fp:
+        config.write(fp)
+
+
+async def wait_for_socket(socket_path, gateway):
+    start = time.time()
+    while not os.path.exists(socket_path):
+        if gateway.returncode is not None:
+            raise RuntimeError(f"evogateway.py exited with code {gateway.returncode} (see events.log)")
+        if time.time() - start > STARTUP_TIMEOUT_SECS:
+            raise RuntimeError("Timed out waiting for the gateway's event stream")
+        await asyncio.sleep(0.5)
+    return await asyncio.open_unix_connection(socket_path, limit=2 ** 20)
+
+
+async def run(args):
+    site = SyntheticSite(args.zones, args.trvs, args.ufh, not args.no_opentherm, args.neighbour_zones)
+    print(f"Site: {len(site.zones)} zones, {site.device_count} devices ({len(site.probe_ids)} TRVs, "
+        f"{len(site.ufh_ids)} UFH controllers{', OpenTherm bridge' if site.otb_id else ''}"
+        f"{f', neighbour with {len(site.neighbour_trvs)} TRVs' if site.neighbour_ctl_id else ''})")
+
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(slave_fd)
+    os.set_blocking(master_fd, False)
+    port = os.ttyname(slave_fd)
+
+    with tempfile.TemporaryDirectory(prefix="evoload_") as folder:
+        socket_path = os.path.join(folder, "events.sock")
+        write_config(folder, port, socket_path, args.broker, args.set)
+        gateway = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(GATEWAY), cwd=folder,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        loop = asyncio.get_running_loop()
+        load = LoadRun(site, master_fd)
+        loop.add_reader(master_fd, load.drain_pty)
+        try:
+            reader, writer = await wait_for_socket(socket_path, gateway)
+            writer.write(json.dumps({"codes": ["30C9"]}).encode() + b"\n")
+            await writer.drain()
+            events_task = asyncio.ensure_future(load.read_events(reader))
+
+            print(f"Warming up for {args.warmup}s at {args.rates[0]} frames/sec (discovery)...")
+            await load.step(args.rates[0], args.warmup)
+
+            print(f"{'rate':>6} {'actual':>7} {'probes':>7} {'drop %':>7} {'tx drop':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'cpu %':>6}")
+            last_good = None
+            for rate in args.rates:
+                cpu_start = process_cpu_secs(gateway.pid)
+                result = await load.step(rate, args.step_secs)
+                cpu_pct = 100 * (process_cpu_secs(gateway.pid) - cpu_start) / (args.step_secs + DRAIN_GRACE_SECS)
+                print(f"{rate:>6} {result['actual_rate']:>7} {result['probes']:>7} {result['dropped_pct']:>7} {result['tx_dropped']:>8} "
+                    f"{result['p50_ms'] or '-':>8} {result['p95_ms'] or '-':>8} {result['max_ms'] or '-':>8} {cpu_pct:>6.0f}")
+                degraded = (result["dropped_pct"] > args.max_drop_pct or result["tx_dropped"]
+                    or (result["p95_ms"] or 0) > args.max_latency_ms)
+                if degraded:
+                    print(f"Degraded at {rate} frames/sec (last good: {last_good or 'none'})")
+                    break
+                last_good = rate
+            else:
+                print(f"Not degraded up to {args.rates[-1]} frames/sec")
+
+            events_task.cancel()
+            writer.close()
+        finally:
+            loop.remove_reader(master_fd)
+            if gateway.returncode is None:
+                gateway.terminate()
+                await gateway.wait()
+            os.close(master_fd)
+            os.close(slave_fd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Step up synthetic RAMSES traffic until evoGateway degrades")
+    parser.add_argument("-b", "--broker", default="localhost", help="MQTT broker for the gateway")
+    parser.add_argument("-z", "--zones", type=int, default=12)
+    parser.add_argument("-t", "--trvs", type=int, default=8, help="TRVs per zone")
+    parser.add_argument("-u", "--ufh", type=int, default=3, help="UFH controllers (8 circuits each)")
+    parser.add_argument("-n", "--neighbour-zones", type=int, default=4, help="Zones of the neighbour's system (0 for none)")
+    parser.add_argument("--no-opentherm", action="store_true", help="No OpenTherm bridge")
+    parser.add_argument("-r", "--rates", type=int, nargs="+", default=[10, 20, 50, 100, 200, 400, 800], help="Frames/sec steps")
+    parser.add_argument("-s", "--step-secs", type=int, default=20)
+    parser.add_argument("-w", "--warmup", type=int, default=20)
+    parser.add_argument("--max-latency-ms", type=float, default=500, help="p95 latency above which the gateway is degraded")
+    parser.add_argument("--max-drop-pct", type=float, default=1, help="Dropped probes above which the gateway is degraded")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.SETTING=VALUE",
+        help="Extra gateway config setting, e.g. MISC.PIPELINE_WORKERS=2")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    try:
+        asyncio.run(run(args))
+    except RuntimeError as ex:
+        print(ex)
+        return 1
+    except KeyboardInterrupt:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Minimal MQTT 3.1.1 broker, as a local stand-in for benchmarks, so they need no broker installed and are not
+    affected by other clients.
+
+    Supports what evoGateway uses: CONNECT (with a will), PUBLISH (QoS 0-2 in, always delivered at QoS 0), retained
+    messages, SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, PINGREQ and DISCONNECT. No authentication; any
+    username/password is accepted.
+
+    The benchmark itself can publish (publish()) and listen (add_listener()) in process, without a client connection.
+
+    python3 benchmarks/mini_broker.py [--port 1883]
+"""
+
+import argparse
+import asyncio
+import struct
+import sys
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_matches(filter, topic):
+    filter_parts, topic_parts = filter.split("/"), topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts) or (part != "+" and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def encode_string(value):
+    value = value.encode("utf-8") if isinstance(value, str) else value
+    return struct.pack("!H", len(value)) + value
+
+
+def encode_packet(packet_type, flags, body):
+    length, remaining = len(body), bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        remaining.append(byte | (0x80 if length else 0))
+        if not length:
+            break
+    return bytes([(packet_type << 4) | flags]) + bytes(remaining) + body
+
+
+def publish_packet(topic, payload, retain=False):
+    return encode_packet(PUBLISH, 1 if retain else 0, encode_string(topic) + payload)
+
+
+class Session():
+    ''' A connected client '''
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = set()
+        self.will = None
+        self.received = 0
+        self.sent = 0
+
+    def send(self, packet):
+        self.sent += 1
+        self.writer.write(packet)
+
+
+class MiniBroker():
+    ''' The broker, e.g. broker = MiniBroker(port=0); await broker.start(); port = broker.port '''
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.retained = {}
+        self.listeners = []     # (topic filter, callback(topic, payload))
+        self.published = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for session in list(self.sessions):
+            session.writer.close()
+
+    def add_listener(self, filter, callback):
+        self.listeners.append((filter, callback))
+
+    def publish(self, topic, payload, retain=False):
+        """ Publish to the subscribers (and listeners) """
+        payload = payload.encode("utf-8") if isinstance(payload, str) else payload
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+        packet = None
+        for session in self.sessions:
+            if any(topic_matches(filter, topic) for filter in session.subscriptions):
+                packet = packet or publish_packet(topic, payload)
+                session.send(packet)
+        for filter, callback in self.listeners:
+            if topic_matches(filter, topic):
+                callback(topic, payload)
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header[0] >> 4, header[0] & 0x0F, await reader.readexactly(length)
+
+    async def _handle_client(self, reader, writer):
+        session = Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+                session.received += 1
+                if packet_type == CONNECT:
+                    self._connect(session, body)
+                elif packet_type == PUBLISH:
+                    self._publish(session, flags, body)
+                elif packet_type == PUBREL:
+                    session.send(encode_packet(PUBCOMP, 0, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    session.send(encode_packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT:
+                    session.will = None
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+            if session.will:
+                self.publish(*session.will)
+
+    def _connect(self, session, body):
+        pos = 2 + struct.unpack("!H", body[:2])[0]     # Protocol name
+        connect_flags = body[pos + 1]
+        pos += 4                                        # Level, flags, keep alive
+        strings = []
+        while pos < len(body):
+            length = struct.unpack("!H", body[pos:pos + 2])[0]
+            strings.append(body[pos + 2:pos + 2 + length])
+            pos += 2 + length
+        session.client_id = strings[0].decode("utf-8") if strings else ""
+        if connect_flags & 0x04 and len(strings) >= 3:
+            session.will = (strings[1].decode("utf-8"), strings[2], bool(connect_flags & 0x20))
+        session.send(encode_packet(CONNACK, 0, b"\x00\x00"))
+
+    def _publish(self, session, flags, body):
+        qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+        length = struct.unpack("!H", body[:2])[0]
+        topic, pos = body[2:2 + length].decode("utf-8"), 2 + length
+        if qos:
+            packet_id, pos = body[pos:pos + 2], pos + 2
+            session.send(encode_packet(PUBACK if qos == 1 else PUBREC, 0, packet_id))
+        self.publish(topic, body[pos:], retain)
+
+    def _subscribe(self, session, body):
+        packet_id, pos, granted, filters = body[:2], 2, bytearray(), []
+        while pos < len(body):
+            length = struct.unpack("!H", body[pos:pos + 2])[0]
+            filters.append(body[pos + 2:pos + 2 + length].decode("utf-8"))
+            pos += 3 + length
+            granted.append(0)
+        session.subscriptions.update(filters)
+        session.send(encode_packet(SUBACK, 0, packet_id + bytes(granted)))
+        for topic, payload in list(self.retained.items()):
+            if any(topic_matches(filter, topic) for filter in filters):
+                session.send(publish_packet(topic, payload, retain=True))
+
+    def _unsubscribe(self, session, body):
+        pos = 2
+        while pos < len(body):
+            length = struct.unpack("!H", body[pos:pos + 2])[0]
+            session.subscriptions.discard(body[pos + 2:pos + 2 + length].decode("utf-8"))
+            pos += 2 + length
+        session.send(encode_packet(UNSUBACK, 0, body[:2]))
+
+    def stats(self):
+        return {"clients": len(self.sessions), "published": self.published, "retained": len(self.retained)}
+
+
+async def serve(port):
+    broker = MiniBroker("0.0.0.0", port)
+    await broker.start()
+    print(f"Listening on port {broker.port}")
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker for local benchmarks")
+    parser.add_argument("-p", "--port", type=int, default=1883)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Virtual evohome controller (and HGI80/evofw3 radio) on a pty, so that the command path can be tested and
+    benchmarked without any RF hardware or a real controller.
+
+    The gateway opens the pty's slave end as its serial port. Frames the gateway sends are echoed back (as the HGI80
+    does), and those addressed to the controller are answered with the RP (for RQ) or I (for W) responses a real
+    controller sends, after a configurable delay, and with configurable loss (no response, so the gateway retries)
+    and fragmentation (a frame split over several serial reads). Zone schedules are served as multi-fragment 0404
+    transfers. The controller also announces itself and its zones every few seconds, as a real one does, so that the
+    gateway discovers it.
+
+    python3 benchmarks/virtual_controller.py [--zones 8] [--delay-ms 50] [--loss 0.05]
+        then set COM_PORT to the pty path it prints
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import pty
+import random
+import re
+import struct
+import sys
+import time
+import tty
+import zlib
+
+FRAME_REGEX = re.compile(r"^\s?(RQ|RP|I|W)\s+\S+\s+(\S+)\s+(\S+)\s+(\S+)\s+([0-9A-F]{4})\s+(\d{3})\s+([0-9A-F]*)")
+NO_ADDR = "--:------"
+FRAGMENT_BYTES = 41
+ZONE_TYPE_RAD = "08"        # Radiator valve zones, as announced in the 0005 zone mask
+RETRY_WINDOW_SECS = 5       # The same request received again within this time is counted as a retry
+ZONE_NAMES = ("Living Room", "Kitchen", "Hall", "Dining Room", "Bedroom 1", "Bedroom 2", "Bedroom 3", "Bathroom",
+    "Study", "Landing", "Utility", "Conservatory")
+
+
+def temp_hex(temp):
+    return f"{round(temp * 100) & 0xFFFF:04X}"
+
+
+def dtm_hex(dtm):
+    return f"{dtm.second:02X}{dtm.minute:02X}{dtm.hour:02X}{dtm.day:02X}{dtm.month:02X}{dtm.year:04X}"
+
+
+def frame(verb, src, dst, code, payload, rssi=None):
+    """ Frame as received from the HGI80/evofw3, with the RSSI first """
+    verb = f"{verb:>2}"
+    addrs = f"{src} {dst} {NO_ADDR}" if dst != NO_ADDR else f"{src} {NO_ADDR} {src}"
+    return f"{rssi or random.randint(40, 70):03d} {verb} --- {addrs} {code} {len(payload) // 2:03d} {payload}"
+
+
+def encode_schedule(zone_idx):
+    """ Zone schedule (4 switchpoints a day), zlib compressed as the controller stores it """
+    records = b"".join(struct.pack("<xxxxBxxxBxxxHxxHxx", zone_idx, day, mins, round(setpoint * 100))
+        for day in range(7) for mins, setpoint in ((390, 21), (510, 18), (1020, 21.5), (1350, 16)))
+    return zlib.compress(records, 9).hex().upper()
+
+
+class VirtualController():
+    ''' Answers the frames written to the pty. delay_ms is the mean response delay (with +/-50% jitter), loss the
+        fraction of requests not answered, and split the fraction of responses written in several pieces.
+    '''
+    def __init__(self, master_fd, ctl_id="01:145038", zones=8, delay_ms=50, loss=0.0, split=0.0, announce_secs=5):
+        self.master_fd = master_fd
+        self.ctl_id = ctl_id
+        self.zones = {f"{i:02X}": {"name": ZONE_NAMES[i % len(ZONE_NAMES)], "setpoint": 21.0, "temperature": 19.5 + i / 10,
+            "schedule": encode_schedule(i)} for i in range(zones)}
+        self.system_mode = "00FFFFFFFFFFFF00"
+        self.change_counter = 1
+        self.delay_ms = delay_ms
+        self.loss = loss
+        self.split = split
+        self.announce_secs = announce_secs
+        self.stats = {"received": 0, "requests": 0, "responses": 0, "lost": 0, "retries": 0, "unsupported": 0, "write_errors": 0}
+        self.transfers = {}     # {zone_idx: {"started", "completed", "fragments", "total"}}
+        self._recent = {}       # {request: time first received}, for counting retries
+        self._buffer = b""
+        self._tasks = set()
+        self._queue = asyncio.Queue()   # Lines to write, in order, so that split frames are not interleaved
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.master_fd, self._on_readable)
+        self._tasks.update((asyncio.ensure_future(self._announce_loop()), asyncio.ensure_future(self._writer_loop())))
+
+    def stop(self):
+        asyncio.get_running_loop().remove_reader(self.master_fd)
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _on_readable(self):
+        try:
+            self._buffer += os.read(self.master_fd, 4096)
+        except OSError:
+            return
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            self._on_line(line.decode("ascii", errors="replace").rstrip("\r"))
+
+    def _write(self, line, split=False):
+        self._queue.put_nowait((f"{line}\r\n".encode(), split))
+
+    async def _writer_loop(self):
+        while True:
+            data, split = await self._queue.get()
+            if split:
+                # As if the frame arrived over several serial reads
+                cut = random.randint(1, len(data) - 1)
+                pieces = (data[:cut], data[cut:])
+            else:
+                pieces = (data,)
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(0.005)
+                try:
+                    os.write(self.master_fd, piece)
+                except OSError:
+                    self.stats["write_errors"] += 1
+
+    def _on_line(self, line):
+        if line.startswith("!V"):
+            # The gateway has just opened the port, so announce straight away rather than it waiting for the next one
+            self._write("# evofw3 0.7.1")
+            self._announce()
+            return
+        match = FRAME_REGEX.match(line)
+        if not match:
+            return
+        self.stats["received"] += 1
+        verb, addr0, addr1, addr2, code, _, payload = match.groups()
+        self._write(f"000 {line}")     # The HGI80's echo of what it sent
+
+        dst = addr1 if addr1 != NO_ADDR else addr2
+        if dst != self.ctl_id or verb not in ("RQ", "W"):
+            return
+        self.stats["requests"] += 1
+
+        now = time.monotonic()
+        key = (verb, code, payload)
+        if key in self._recent and now - self._recent[key] < RETRY_WINDOW_SECS:
+            self.stats["retries"] += 1
+        else:
+            self._recent[key] = now
+        if len(self._recent) > 1000:
+            self._recent = {k: v for k, v in self._recent.items() if now - v < RETRY_WINDOW_SECS}
+
+        response = self._respond(verb, code, payload)
+        if response is None:
+            self.stats["unsupported"] += 1
+            return
+        if random.random() < self.loss:
+            self.stats["lost"] += 1
+            return
+        response_verb, response_payload = response
+        task = asyncio.ensure_future(self._send_response(frame(response_verb, self.ctl_id, addr0, code, response_payload)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_response(self, line):
+        await asyncio.sleep(self.delay_ms * random.uniform(0.5, 1.5) / 1000)
+        self.stats["responses"] += 1
+        self._write(line, random.random() < self.split)
+
+    def _respond(self, verb, code, payload):
+        """ (verb, payload) of the response, or None if the request is not supported """
+        zone = self.zones.get(payload[:2])
+        if verb == "W":
+            if code == "2309" and zone:
+                zone["setpoint"] = int(payload[2:6], 16) / 100
+            elif code == "2E04":
+                self.system_mode = payload
+            elif code not in ("2349", "1F41", "313F", "000A", "0004", "10A0"):
+                return None
+            self.change_counter += 1
+            return "I", payload
+
+        if code == "0005":
+            return "RP", f"00{payload[2:4]}{self._zone_mask() if payload[2:4] == ZONE_TYPE_RAD else '0000'}"
+        elif code == "0404" and zone:
+            return self._schedule_fragment(payload[:2], int(payload[10:12], 16))
+        elif code == "2349" and zone:
+            return "RP", f"{payload[:2]}{temp_hex(zone['setpoint'])}00FFFFFF"
+        elif code == "2309" and zone:
+            return "RP", f"{payload[:2]}{temp_hex(zone['setpoint'])}"
+        elif code == "30C9" and zone:
+            return "RP", f"{payload[:2]}{temp_hex(zone['temperature'])}"
+        elif code == "000A" and zone:
+            return "RP", f"{payload[:2]}1001F40DAC"
+        elif code == "0004" and zone:
+            return "RP", f"{payload[:2]}00{zone['name'].encode('ascii').hex().upper():0<40}"
+        elif code == "2E04":
+            return "RP", self.system_mode
+        elif code == "1F09":
+            return "RP", "0004B5"
+        elif code == "313F":
+            return "RP", f"00FC{dtm_hex(datetime.datetime.now())}"
+        elif code == "0006":
+            return "RP", f"0005{self.change_counter:04X}"
+        return None
+
+    def _zone_mask(self):
+        """ The zones as a 0005 zone mask, i.e. a bit per zone, lsb first, over 2 bytes """
+        mask = sum(1 << int(idx, 16) for idx in self.zones)
+        return f"{mask & 0xFF:02X}{mask >> 8:02X}"
+
+    def _schedule_fragment(self, zone_idx, frag_idx):
+        schedule = self.zones[zone_idx]["schedule"]
+        total = -(-len(schedule) // (FRAGMENT_BYTES * 2))
+        frag_idx = min(max(frag_idx, 1), total)
+        fragment = schedule[(frag_idx - 1) * FRAGMENT_BYTES * 2:frag_idx * FRAGMENT_BYTES * 2]
+
+        transfer = self.transfers.get(zone_idx)
+        if frag_idx == 1 and (transfer is None or transfer["completed"]):
+            transfer = self.transfers[zone_idx] = {"started": time.monotonic(), "completed": None, "fragments": 0, "total": total}
+        if transfer:
+            transfer["fragments"] += 1
+            if frag_idx == total:
+                transfer["completed"] = time.monotonic()
+        return "RP", f"{zone_idx}200008{len(fragment) // 2:02X}{frag_idx:02X}{total:02X}{fragment}"
+
+    def _announce(self):
+        ctl = self.ctl_id
+        self._write(frame("I", ctl, NO_ADDR, "1F09", "FF0532"))
+        self._write(frame("I", ctl, NO_ADDR, "0005", f"00{ZONE_TYPE_RAD}{self._zone_mask()}"))
+        self._write(frame("I", ctl, NO_ADDR, "30C9", "".join(f"{idx}{temp_hex(z['temperature'])}" for idx, z in self.zones.items())))
+        self._write(frame("I", ctl, NO_ADDR, "2309", "".join(f"{idx}{temp_hex(z['setpoint'])}" for idx, z in self.zones.items())))
+
+    async def _announce_loop(self):
+        while True:
+            self._announce()
+            await asyncio.sleep(self.announce_secs)
+
+
+def open_pty():
+    """ (master_fd, slave_fd, slave path). The slave end is kept open, so the pty survives the gateway reopening it """
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(slave_fd)
+    os.set_blocking(master_fd, False)
+    return master_fd, slave_fd, os.ttyname(slave_fd)
+
+
+async def serve(args):
+    master_fd, slave_fd, port = open_pty()
+    controller = VirtualController(master_fd, args.ctl_id, args.zones, args.delay_ms, args.loss, args.split)
+    controller.start()
+    print(f"Virtual controller {args.ctl_id} on {port}")
+    while True:
+        await asyncio.sleep(10)
+        print(controller.stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Virtual evohome controller on a pty")
+    parser.add_argument("-c", "--ctl-id", default="01:145038")
+    parser.add_argument("-z", "--zones", type=int, default=8)
+    parser.add_argument("-d", "--delay-ms", type=float, default=50, help="Mean response delay")
+    parser.add_argument("-l", "--loss", type=float, default=0, help="Fraction of requests not answered")
+    parser.add_argument("-s", "--split", type=float, default=0, help="Fraction of responses split over several reads")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+""" Command topics mirroring the publish hierarchy, e.g.
+
+        evohome/evogateway/living_room/command              json command, as for MQTT_SUB_TOPIC, with the zone filled in
+        evohome/evogateway/living_room/set/setpoint         just the value, e.g. 21.5
+        evohome/evogateway/living_room/trv_xx/set/setpoint  the same, via one of the zone's devices
+
+    The routing table maps each topic to its target IDs, and for 'set' topics to the Command constructor and its
+    value argument, so a received command only needs its value converting. The table is rebuilt (and the
+    subscriptions updated) when the zones or devices change, rather than resolved per command.
+"""
+
+import json
+
+SZ_COMMAND  = "command"
+SZ_SET      = "set"
+
+
+def to_bool(value):
+    if value.lower() in ("true", "on", "1"):
+        return True
+    elif value.lower() in ("false", "off", "0"):
+        return False
+    raise ValueError(f"'{value}' is not a boolean")
+
+
+def to_str(value):
+    # Allow json strings too, e.g. "\"follow_schedule\""
+    return json.loads(value) if value.startswith('"') else value
+
+
+# {set topic name: (Command constructor name, value argument, value conversion)}. There is no DHW setpoint, as
+# set_dhw_params would also reset the overrun and differential to their defaults
+ZONE_SETTERS    = {"setpoint": ("set_zone_setpoint", "setpoint", float), "mode": ("set_zone_mode", "mode", to_str)}
+DHW_SETTERS     = {"mode": ("set_dhw_mode", "mode", to_str), "active": ("set_dhw_mode", "active", to_bool)}
+SYSTEM_SETTERS  = {"system_mode": ("set_system_mode", "system_mode", to_str)}
+
+
+class Route():
+    ''' A command topic, with its target IDs (as default command args) and for 'set' topics, the constructor '''
+    def __init__(self, topic, defaults, constructor=None, value_arg=None, convert=None):
+        self.topic = topic
+        self.defaults = defaults
+        self.constructor = constructor
+        self.value_arg = value_arg
+        self.convert = convert
+
+    def build(self, payload, build_command):
+        """ Command for the received payload. build_command(json_data, defaults) is used for json commands.
+            Raises ValueError if the payload is not valid for the route
+        """
+        if self.constructor:
+            value = self.convert(payload.strip())
+            try:
+                return self.constructor(**self.defaults, **{self.value_arg: value})
+            except Exception as ex:
+                raise ValueError(ex) from ex
+
+        try:
+            json_data = json.loads(payload)
+        except json.JSONDecodeError:
+            raise ValueError("Payload is not in JSON format")
+        if not isinstance(json_data, dict):
+            raise ValueError("Payload must be a JSON object")
+        return build_command(json_data, self.defaults)
+
+
+def get_setter_routes(topic_base, defaults, setters, command_class):
+    """ Routes for the 'set' topics below topic_base, for the setters that the Command class has constructors for """
+    routes = []
+    for name, (constructor_name, value_arg, convert) in setters.items():
+        constructor = getattr(command_class, constructor_name, None)
+        if constructor:
+            routes.append(Route(f"{topic_base}/{SZ_SET}/{name}", defaults, constructor, value_arg, convert))
+    return routes
+
+
+class CommandRoutes():
+    ''' The routing table, {topic: Route}. Replaced as a whole on update, so lookups need no locking. '''
+    def __init__(self):
+        self.routes = {}
+
+    def update(self, routes):
+        """ Replace the routes, returning the (added, removed) topics, to update the subscriptions with """
+        new_routes = {route.topic: route for route in routes}
+        added = [topic for topic in new_routes if topic not in self.routes]
+        removed = [topic for topic in self.routes if topic not in new_routes]
+        self.routes = new_routes
+        return added, removed
+
+    def get(self, topic):
+        return self.routes.get(topic)
+
+    def topics(self):
+        return list(self.routes)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Local stream of decoded messages, as compact json lines over a UNIX socket, for any number of subscribers.
+
+    A subscriber may send a single json line with its filter when it connects, e.g.
+
+        {"devices": ["04:123456"], "codes": ["30C9", "heat_demand"], "zones": ["01"], "verbs": ["I"]}
+
+    Each filter key is optional; an event must match every key given (and any of the values within a key).
+    Filters are applied in the gateway, and each event is only encoded once, however many subscribers match.
+    Every subscriber has its own bounded buffer, so a slow subscriber only drops its own events (which are
+    counted) and never holds up the gateway or other subscribers.
+
+    Can also be run from the command line as a subscriber, e.g.
+
+        python3 event_stream.py /tmp/evogateway.sock --device 04:123456 --code 30C9
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+
+FILTER_WAIT_SECS    = 2
+SZ_ZONE_IDX         = "zone_idx"
+HEX_CODE            = re.compile(r"^[0-9A-Fa-f]{4}$")
+
+
+class Subscriber():
+    ''' A connected stream client, with its filter and bounded buffer of encoded events '''
+    def __init__(self, peer, writer, filter, buffer_size):
+        self.peer = peer
+        self.writer = writer
+        self.devices = frozenset(filter.get("devices", ())) or None
+        # Codes may be hex (matched uppercase, e.g. 30C9) or names (matched lowercase, e.g. temperature)
+        self.codes = frozenset(c.upper() if HEX_CODE.match(c) else c.lower() for c in filter.get("codes", ())) or None
+        self.zones = frozenset(z.upper() for z in filter.get("zones", ())) or None
+        self.verbs = frozenset(v.strip() for v in filter.get("verbs", ())) or None
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.sent = 0
+        self.dropped = 0
+
+    def matches(self, src_id, dst_id, code, code_name, verb, zones):
+        if self.devices and src_id not in self.devices and dst_id not in self.devices:
+            return False
+        if self.codes and code not in self.codes and code_name not in self.codes:
+            return False
+        if self.verbs and verb not in self.verbs:
+            return False
+        if self.zones and not self.zones.intersection(zones):
+            return False
+        return True
+
+
+class EventStreamServer():
+    ''' UNIX socket server for the event stream. publish_msg() is called for every message, from the asyncio loop. '''
+    def __init__(self, socket_path, buffer_size=1000, log=None):
+        self.socket_path = socket_path
+        self.buffer_size = buffer_size
+        self.log = log
+        self.subscribers = []
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)     # Stale socket from a previous run
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+
+    def close(self):
+        if self._server:
+            self._server.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    async def _handle_client(self, reader, writer):
+        peer = f"subscriber_{id(writer):x}"
+        try:
+            line = await asyncio.wait_for(reader.readline(), FILTER_WAIT_SECS)
+            filter = json.loads(line) if line.strip() else {}
+            if not isinstance(filter, dict):
+                raise ValueError("filter must be a json object")
+        except asyncio.TimeoutError:
+            filter = {}
+        except (ValueError, UnicodeDecodeError) as ex:
+            writer.write(json.dumps({"error": f"Invalid filter: {ex}"}).encode() + b"\n")
+            writer.close()
+            return
+
+        subscriber = Subscriber(peer, writer, filter, self.buffer_size)
+        self.subscribers.append(subscriber)
+        if self.log:
+            self.log.info(f"Event stream {peer} connected with filter {filter}")
+
+        try:
+            while True:
+                writer.write(await subscriber.queue.get())
+                await writer.drain()
+                subscriber.sent += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.subscribers.remove(subscriber)
+            writer.close()
+            if self.log:
+                self.log.info(f"Event stream {peer} disconnected. Sent: {subscriber.sent}, dropped: {subscriber.dropped}")
+
+    def publish_msg(self, msg):
+        """ Queue a ramses_rf message for every subscriber whose filter it matches """
+        if not self.subscribers:
+            return
+
+        payload = msg.payload
+        items = payload if isinstance(payload, list) else (payload,)
+        zones = {item[SZ_ZONE_IDX] for item in items if isinstance(item, dict) and SZ_ZONE_IDX in item}
+        if not zones:
+            zone = getattr(msg.src, "zone", None)
+            if zone is not None and getattr(zone, "idx", None):
+                zones = {zone.idx}
+
+        src_id, dst_id, code, verb = msg.src.id, msg.dst.id, msg.code, msg.verb.strip()
+        code_name = getattr(msg, "code_name", None)
+        line = None
+        for subscriber in self.subscribers:
+            if not subscriber.matches(src_id, dst_id, code, code_name, verb, zones):
+                continue
+            if line is None:
+                # Only encode once, and only if someone wants it
+                line = json.dumps({"dtm": msg.dtm.isoformat(timespec="milliseconds"), "rssi": msg._pkt._rssi, "verb": verb,
+                    "src": src_id, "dst": dst_id, "code": code, "code_name": code_name, "zones": sorted(zones), "payload": payload},
+                    separators=(",", ":"), default=str).encode() + b"\n"
+            try:
+                subscriber.queue.put_nowait(line)
+            except asyncio.QueueFull:
+                subscriber.dropped += 1
+
+    def stats(self):
+        return {"subscribers": len(self.subscribers),
+            "sent": sum(s.sent for s in self.subscribers),
+            "dropped": sum(s.dropped for s in self.subscribers),
+            "by_subscriber": {s.peer: {"sent": s.sent, "dropped": s.dropped, "queued": s.queue.qsize()} for s in self.subscribers}}
+
+
+async def subscribe(socket_path, filter):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(json.dumps(filter).encode() + b"\n")
+    await writer.drain()
+    while line := await reader.readline():
+        sys.stdout.write(line.decode())
+        sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Subscribe to the evoGateway event stream")
+    parser.add_argument("socket", help="Path of the event stream socket, i.e. EVENT_STREAM_SOCKET")
+    parser.add_argument("-d", "--device", action="append", default=[], help="Device ID (source or destination)")
+    parser.add_argument("-c", "--code", action="append", default=[], help="Code or code name, e.g. 30C9 or temperature")
+    parser.add_argument("-z", "--zone", action="append", default=[], help="Zone index, e.g. 01")
+    parser.add_argument("-v", "--verb", action="append", default=[], help="Verb, e.g. I, RQ, RP, W")
+    args = parser.parse_args(argv)
+
+    filter = {k: v for k, v in {"devices": args.device, "codes": args.code, "zones": args.zone, "verbs": args.verb}.items() if v}
+    try:
+        asyncio.run(subscribe(args.socket, filter))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,14 +10,16 @@ import traceback
 import re
 import glob
 from typing import Tuple
-from signal import SIGINT, SIGTERM
+from signal import SIGHUP, SIGINT, SIGTERM
 import os
 import inspect
+import tracemalloc
+from collections import OrderedDict
 import configparser
 import paho.mqtt.client as mqtt
 import time
 import datetime
-from threading import Timer
+from threading import Timer, Lock, Thread
 from datetime import timedelta as td
 from types import SimpleNamespace
 from colorama import init as colorama_init, Fore, Style, Back
@@ -70,6 +72,25 @@ from ramses_rf.schemas import (
     SZ_NAME
 )
 
+from packet_archive import PacketArchive
+from loop_watchdog import LoopWatchdog
+from event_stream import EventStreamServer
+from zone_state import ZoneStateAggregator
+from rolling_stats import RollingStats
+from link_stats import LinkStats
+from availability import AvailabilityTracker, SZ_ONLINE, SZ_OFFLINE
+from history_store import HistoryStore
+import thermal_analytics
+from packet_filter import PacketFilter
+from pipeline import ProcessPipeline
+from retained_registry import RetainedTopicRegistry
+from rf_budget import RfBudget
+from fault_log import FaultLog
+from string_cache import StringCache, SecondTimestamp
+from topic_templates import TopicTemplates
+from sampling_profiler import SamplingProfiler, tracemalloc_start, tracemalloc_summary
+from command_routes import CommandRoutes, Route, get_setter_routes, SZ_COMMAND, ZONE_SETTERS, DHW_SETTERS, SYSTEM_SETTERS
+
 LIB_KEYS = tuple(SCH_GLOBAL_CONFIG({}).keys()) + (SZ_SERIAL_PORT,)
 
 DEFAULT_COLORS = {" I": f"{Fore.WHITE}", "RP": f"{Fore.LIGHTWHITE_EX}", "RQ": f"{Fore.BLACK}",
@@ -88,11 +109,12 @@ CONFIG_FILE     = "evogateway.cfg"
 config = configparser.RawConfigParser()
 config.read(CONFIG_FILE)
 
-def get_display_colorscheme(reload_config=False):
+def get_display_colorscheme(reload_config=False, colours_string=None):
     if reload_config:
         config.read(CONFIG_FILE)
 
-    colours_string = config.get("MISC", "DISPLAY_COLOURS", fallback=None)
+    if colours_string is None:
+        colours_string = config.get("MISC", "DISPLAY_COLOURS", fallback=None)
     try: # TODO! Get rid of eval and tidy up!
         scheme = eval(colours_string) if colours_string else None
     except:
@@ -115,50 +137,210 @@ def get_display_colorscheme(reload_config=False):
 
     return scheme
 
-COM_PORT                = config.get("Serial Port","COM_PORT", fallback="/dev/ttyUSB0")
-COM_BAUD                = config.get("Serial Port","COM_BAUD", fallback=115200)
-
-EVENTS_FILE             = config.get("Files", "EVENTS_FILE", fallback="events.log")
-PACKET_LOG_FILE         = config.get("Files", "PACKET_LOG_FILE", fallback="packet.log")
-LOG_FILE_ROTATE_COUNT   = config.getint("Files", "LOG_FILE_ROTATE_COUNT", fallback=9)
-LOG_FILE_ROTATE_BYTES   = config.getint("Files", "LOG_FILE_ROTATE_BYTES", fallback=1000000)
-
-DEVICES_FILE            = config.get("Files", "DEVICES_FILE", fallback="devices.json")
-ZONES_FILE              = config.get("Files", "ZONES_FILE", fallback="zones.json")
-LOAD_ZONES_FROM_FILE    = config.getboolean("Files", "LOAD_ZONES_FROM_FILE", fallback=True)
-SCHEMA_FILE             = config.get("Files", "SCHEMA_FILE", fallback="ramsesrf_schema.json")
-MAX_SAVE_FILE_COUNT     = config.getint("Files", "MAX_SAVE_FILE_COUNT", fallback=9)
-
-MQTT_SERVER             = config.get("MQTT", "MQTT_SERVER", fallback="")
-MQTT_USER               = config.get("MQTT", "MQTT_USER", fallback="")
-MQTT_PW                 = config.get("MQTT", "MQTT_PW", fallback="")
-MQTT_CLIENTID           = config.get("MQTT", "MQTT_CLIENTID", fallback="evoGateway")
-
-MQTT_PUB_JSON_ONLY      = config.getboolean("MQTT", "MQTT_PUB_AS_JSON", fallback=False)
-MQTT_PUB_KV_WITH_JSON   = config.getboolean("MQTT", "MQTT_PUB_KV_WITH_JSON", fallback=False)
-if MQTT_PUB_KV_WITH_JSON:
-    MQTT_PUB_JSON_ONLY = False
-
-MQTT_GROUP_BY_ZONE      = config.getboolean("MQTT", "MQTT_GROUP_BY_ZONE", fallback=True)
-MQTT_REQUIRE_ZONE_NAMES = config.getboolean("MQTT", "MQTT_REQUIRE_ZONE_NAMES", fallback=True)
 
-MQTT_SUB_TOPIC          = config.get("MQTT", "MQTT_SUB_TOPIC", fallback="")
-MQTT_PUB_TOPIC          = config.get("MQTT", "MQTT_PUB_TOPIC", fallback="")
-MQTT_ZONE_IND_TOPIC     = config.get("MQTT", "MQTT_ZONE_INDEP_TOPIC", fallback="_zone_independent")
-MQTT_ZONE_UNKNOWN       = config.get("MQTT", "MQTT_ZONE_UNKNOWN", fallback="_zone_unknown")
-
-THIS_GATEWAY_NAME       = config.get("MISC", "THIS_GATEWAY_NAME", fallback="EvoGateway")
-RAMSESRF_DISABLE_SENDING = config.getboolean("MISC", "DISABLE_SENDING", fallback=False)
-
-DISPLAY_FULL_JSON       = config.getboolean("MISC", "DISPLAY_FULL_JSON", fallback=False)
-FORCE_SINGLE_HGI        = config.getboolean("Misc", "FORCE_SINGLE_HGI", fallback=True)
-DHW_ZONE_PREFIX         = config.get("Misc", "DHW_ZONE_PREFIX", fallback="_dhw")
-
-RAMSESRF_DISABLE_DISCOVERY = config.getboolean("Ramses_rf", SZ_DISABLE_DISCOVERY, fallback=False)
-RAMSESRF_ALLOW_EAVESDROP   = config.getboolean("Ramses_rf", SZ_ENABLE_EAVESDROP, fallback=False)
-RAMSESRF_KNOWN_LIST        = config.getboolean("Ramses_rf", SZ_KNOWN_LIST, fallback=True)
-
-MIN_ROW_LENGTH          = config.get("MISC", "MIN_ROW_LENGTH", fallback=160)
+def read_config_settings(config):
+    """ Read the config file settings into a dict, keyed by the name of the module level global that holds each one """
+    s = {}
+    s["COM_PORT"]                   = config.get("Serial Port","COM_PORT", fallback="/dev/ttyUSB0")
+    s["COM_BAUD"]                   = config.get("Serial Port","COM_BAUD", fallback=115200)
+    s["SERIAL_SILENCE_RESTART_MINS"] = config.getint("Serial Port", "SERIAL_SILENCE_RESTART_MINS", fallback=0)
+
+    s["EVENTS_FILE"]                = config.get("Files", "EVENTS_FILE", fallback="events.log")
+    s["PACKET_LOG_FILE"]            = config.get("Files", "PACKET_LOG_FILE", fallback="packet.log")
+    s["LOG_FILE_ROTATE_COUNT"]      = config.getint("Files", "LOG_FILE_ROTATE_COUNT", fallback=9)
+    s["LOG_FILE_ROTATE_BYTES"]      = config.getint("Files", "LOG_FILE_ROTATE_BYTES", fallback=1000000)
+
+    s["DEVICES_FILE"]               = config.get("Files", "DEVICES_FILE", fallback="devices.json")
+    s["ZONES_FILE"]                 = config.get("Files", "ZONES_FILE", fallback="zones.json")
+    s["LOAD_ZONES_FROM_FILE"]       = config.getboolean("Files", "LOAD_ZONES_FROM_FILE", fallback=True)
+    s["SCHEMA_FILE"]                = config.get("Files", "SCHEMA_FILE", fallback="ramsesrf_schema.json")
+    s["MAX_SAVE_FILE_COUNT"]        = config.getint("Files", "MAX_SAVE_FILE_COUNT", fallback=9)
+    s["PACKET_ARCHIVE_DIR"]         = config.get("Files", "PACKET_ARCHIVE_DIR", fallback="")
+    s["PACKET_ARCHIVE_RETENTION_DAYS"] = config.getint("Files", "PACKET_ARCHIVE_RETENTION_DAYS", fallback=90)
+    s["EVENT_STREAM_SOCKET"]        = config.get("Files", "EVENT_STREAM_SOCKET", fallback="")
+    s["EVENT_STREAM_BUFFER"]        = config.getint("Files", "EVENT_STREAM_BUFFER", fallback=1000)
+    s["RETAINED_TOPICS_FILE"]       = config.get("Files", "RETAINED_TOPICS_FILE", fallback="retained_topics.json")
+    s["PROFILE_DIR"]                = config.get("Files", "PROFILE_DIR", fallback="profiles")
+    s["FAULT_LOG_FILE"]             = config.get("Files", "FAULT_LOG_FILE", fallback="fault_log.json")
+
+    s["MQTT_SERVER"]                = config.get("MQTT", "MQTT_SERVER", fallback="")
+    s["MQTT_PORT"]                  = config.getint("MQTT", "MQTT_PORT", fallback=1883)
+    s["MQTT_USER"]                  = config.get("MQTT", "MQTT_USER", fallback="")
+    s["MQTT_PW"]                    = config.get("MQTT", "MQTT_PW", fallback="")
+    s["MQTT_CLIENTID"]              = config.get("MQTT", "MQTT_CLIENTID", fallback="evoGateway")
+
+    s["MQTT_PUB_JSON_ONLY"]         = config.getboolean("MQTT", "MQTT_PUB_AS_JSON", fallback=False)
+    s["MQTT_PUB_KV_WITH_JSON"]      = config.getboolean("MQTT", "MQTT_PUB_KV_WITH_JSON", fallback=False)
+    if s["MQTT_PUB_KV_WITH_JSON"]:
+        s["MQTT_PUB_JSON_ONLY"] = False
+
+    s["MQTT_GROUP_BY_ZONE"]         = config.getboolean("MQTT", "MQTT_GROUP_BY_ZONE", fallback=True)
+    s["MQTT_PUB_KV"]                = config.getboolean("MQTT", "MQTT_PUB_KV", fallback=True)
+    s["MQTT_PUB_ZONE_STATE"]        = config.getboolean("MQTT", "MQTT_PUB_ZONE_STATE", fallback=False)
+    s["MQTT_ZONE_STATE_INTERVAL"]   = config.getint("MQTT", "MQTT_ZONE_STATE_INTERVAL", fallback=10)
+    s["MQTT_REQUIRE_ZONE_NAMES"]    = config.getboolean("MQTT", "MQTT_REQUIRE_ZONE_NAMES", fallback=True)
+    s["MQTT_RETAINED_GRACE_DAYS"]   = config.getfloat("MQTT", "MQTT_RETAINED_GRACE_DAYS", fallback=0)
+    s["MQTT_PUB_CHANGES_ONLY"]      = config.getboolean("MQTT", "MQTT_PUB_CHANGES_ONLY", fallback=False)
+    s["MQTT_PUB_CHANGES_REFRESH_MINS"] = config.getint("MQTT", "MQTT_PUB_CHANGES_REFRESH_MINS", fallback=60)
+    s["MQTT_WARM_START"]            = config.getboolean("MQTT", "MQTT_WARM_START", fallback=False)
+    s["MQTT_WARM_START_SECS"]       = config.getint("MQTT", "MQTT_WARM_START_SECS", fallback=10)
+    s["MQTT_ZONE_COMMANDS"]         = config.getboolean("MQTT", "MQTT_ZONE_COMMANDS", fallback=False)
+
+    s["MQTT_SUB_TOPIC"]             = config.get("MQTT", "MQTT_SUB_TOPIC", fallback="")
+    s["MQTT_PUB_TOPIC"]             = config.get("MQTT", "MQTT_PUB_TOPIC", fallback="")
+    s["MQTT_ZONE_IND_TOPIC"]        = config.get("MQTT", "MQTT_ZONE_INDEP_TOPIC", fallback="_zone_independent")
+    s["MQTT_ZONE_UNKNOWN"]          = config.get("MQTT", "MQTT_ZONE_UNKNOWN", fallback="_zone_unknown")
+
+    s["THIS_GATEWAY_NAME"]          = config.get("MISC", "THIS_GATEWAY_NAME", fallback="EvoGateway")
+    s["RAMSESRF_DISABLE_SENDING"]   = config.getboolean("MISC", "DISABLE_SENDING", fallback=False)
+
+    s["DISPLAY_FULL_JSON"]          = config.getboolean("MISC", "DISPLAY_FULL_JSON", fallback=False)
+    s["FORCE_SINGLE_HGI"]           = config.getboolean("Misc", "FORCE_SINGLE_HGI", fallback=True)
+    s["DHW_ZONE_PREFIX"]            = config.get("Misc", "DHW_ZONE_PREFIX", fallback="_dhw")
+
+    s["RAMSESRF_DISABLE_DISCOVERY"] = config.getboolean("Ramses_rf", SZ_DISABLE_DISCOVERY, fallback=False)
+    s["RAMSESRF_ALLOW_EAVESDROP"]   = config.getboolean("Ramses_rf", SZ_ENABLE_EAVESDROP, fallback=False)
+    s["RAMSESRF_KNOWN_LIST"]        = config.getboolean("Ramses_rf", SZ_KNOWN_LIST, fallback=True)
+
+    s["MIN_ROW_LENGTH"]             = config.get("MISC", "MIN_ROW_LENGTH", fallback=160)
+
+    s["WATCHDOG_LAG_THRESHOLD_MS"]  = config.getint("MISC", "WATCHDOG_LAG_THRESHOLD_MS", fallback=500)
+    s["WATCHDOG_PUBLISH_SECS"]      = config.getint("MISC", "WATCHDOG_PUBLISH_SECS", fallback=60)
+
+    # Rolling mean/min/max of temperatures, setpoints and demand, published every STATS_INTERVAL_MINS (0 = disabled)
+    s["STATS_INTERVAL_MINS"]        = config.getint("MISC", "STATS_INTERVAL_MINS", fallback=0)
+    s["STATS_WINDOW_SAMPLES"]       = config.getint("MISC", "STATS_WINDOW_SAMPLES", fallback=512)
+    # Per-device RSSI, packet rate and gaps, published every LINK_STATS_INTERVAL_MINS (0 = disabled)
+    s["LINK_STATS_INTERVAL_MINS"]   = config.getint("MISC", "LINK_STATS_INTERVAL_MINS", fallback=15)
+    s["LINK_STATS_SAMPLES"]         = config.getint("MISC", "LINK_STATS_SAMPLES", fallback=256)
+    # Retained online/offline per device and zone, from each device's learned broadcast interval
+    s["AVAILABILITY_TRACKING"]      = config.getboolean("MISC", "AVAILABILITY_TRACKING", fallback=False)
+    s["AVAILABILITY_MISSED_INTERVALS"] = config.getint("MISC", "AVAILABILITY_MISSED_INTERVALS", fallback=3)
+    s["AVAILABILITY_MIN_TIMEOUT_MINS"] = config.getint("MISC", "AVAILABILITY_MIN_TIMEOUT_MINS", fallback=10)
+    # Incremental refresh of the controller's fault log every FAULT_LOG_INTERVAL_MINS (0 = only on request), and
+    # optionally when the controller announces a new fault
+    s["FAULT_LOG_INTERVAL_MINS"]    = config.getint("MISC", "FAULT_LOG_INTERVAL_MINS", fallback=0)
+    s["FAULT_LOG_ON_NEW_FAULT"]     = config.getboolean("MISC", "FAULT_LOG_ON_NEW_FAULT", fallback=False)
+    s["FAULT_LOG_CONCURRENCY"]      = config.getint("MISC", "FAULT_LOG_CONCURRENCY", fallback=3)
+    s["ANALYTICS_INTERVAL_MINS"]    = config.getint("MISC", "ANALYTICS_INTERVAL_MINS", fallback=0)
+    s["ANALYTICS_WINDOW_MINS"]      = config.getint("MISC", "ANALYTICS_WINDOW_MINS", fallback=60)
+
+    # In-memory history of published numeric values, for the 'history' command (HISTORY_DAYS = 0 to disable)
+    s["HISTORY_DAYS"]               = config.getint("MISC", "HISTORY_DAYS", fallback=0)
+    s["HISTORY_SAMPLES_PER_KEY"]    = config.getint("MISC", "HISTORY_SAMPLES_PER_KEY", fallback=2016)
+    s["HISTORY_MEMORY_MB"]          = config.getint("MISC", "HISTORY_MEMORY_MB", fallback=16)
+
+    # Devices not in the system schema (e.g. neighbours' or corrupted IDs) are candidates until seen often enough
+    s["DEVICE_PROMOTE_SIGHTINGS"]   = config.getint("MISC", "DEVICE_PROMOTE_SIGHTINGS", fallback=3)
+    s["DEVICE_CANDIDATE_MAX"]       = config.getint("MISC", "DEVICE_CANDIDATE_MAX", fallback=200)
+    s["DEVICE_CANDIDATE_EXPIRY_MINS"] = config.getint("MISC", "DEVICE_CANDIDATE_EXPIRY_MINS", fallback=1440)
+
+    # Rate limit for commands sent in bulk (e.g. batches), as a token bucket
+    s["RF_BUDGET_PER_MIN"]          = config.getint("MISC", "RF_BUDGET_PER_MIN", fallback=30)
+    s["RF_BUDGET_BURST"]            = config.getint("MISC", "RF_BUDGET_BURST", fallback=10)
+
+    # Worker processes for MQTT publishing and display (0 = everything in the one process)
+    s["PIPELINE_WORKERS"]           = config.getint("MISC", "PIPELINE_WORKERS", fallback=0)
+
+    # Allow/deny rules applied before any processing of a message, as (name, rule) in the order given
+    s["PACKET_FILTER_RULES"]        = tuple(config.items("Packet Filter")) if config.has_section("Packet Filter") else ()
+    s["MQTT_TOPIC_TEMPLATES"]       = tuple(config.items("Topic Templates")) if config.has_section("Topic Templates") else ()
+
+    # Not held as a global itself, but tracked so that a reload knows when to rebuild DISPLAY_COLOURS
+    s["DISPLAY_COLOURS_CFG"]        = config.get("MISC", "DISPLAY_COLOURS", fallback=None)
+    return s
+
+
+# Settings that are only used at startup (serial port, broker connection, log handlers and the ramses_rf
+# library config). Changing these in the config file requires a restart; a reload keeps the current values.
+RESTART_ONLY_SETTINGS   = ("COM_PORT", "COM_BAUD", "EVENTS_FILE", "PACKET_LOG_FILE", "LOG_FILE_ROTATE_COUNT",
+                            "LOG_FILE_ROTATE_BYTES", "PACKET_ARCHIVE_DIR", "EVENT_STREAM_SOCKET", "PIPELINE_WORKERS", "RETAINED_TOPICS_FILE", "FAULT_LOG_FILE", "LOAD_ZONES_FROM_FILE", "MQTT_SERVER", "MQTT_PORT", "MQTT_USER", "MQTT_PW",
+                            "MQTT_CLIENTID", "RAMSESRF_DISABLE_SENDING", "RAMSESRF_DISABLE_DISCOVERY",
+                            "RAMSESRF_ALLOW_EAVESDROP", "RAMSESRF_KNOWN_LIST")
+
+# Settings that are only tracked for changes on a reload, and are not globals themselves
+TRACKING_ONLY_SETTINGS  = ("DISPLAY_COLOURS_CFG",)
+
+# The settings as last read from the config file. Runtime changes (e.g. the DISPLAY_FULL_JSON sys_config
+# command) are made to the globals only, so that a reload just applies what has changed in the file.
+CONFIG_SETTINGS         = read_config_settings(config)
+
+# Each setting is also a module level global, which a reload replaces along with any objects that depend on it
+COM_PORT                = CONFIG_SETTINGS["COM_PORT"]
+COM_BAUD                = CONFIG_SETTINGS["COM_BAUD"]
+SERIAL_SILENCE_RESTART_MINS = CONFIG_SETTINGS["SERIAL_SILENCE_RESTART_MINS"]
+EVENTS_FILE             = CONFIG_SETTINGS["EVENTS_FILE"]
+PACKET_LOG_FILE         = CONFIG_SETTINGS["PACKET_LOG_FILE"]
+LOG_FILE_ROTATE_COUNT   = CONFIG_SETTINGS["LOG_FILE_ROTATE_COUNT"]
+LOG_FILE_ROTATE_BYTES   = CONFIG_SETTINGS["LOG_FILE_ROTATE_BYTES"]
+DEVICES_FILE            = CONFIG_SETTINGS["DEVICES_FILE"]
+ZONES_FILE              = CONFIG_SETTINGS["ZONES_FILE"]
+LOAD_ZONES_FROM_FILE    = CONFIG_SETTINGS["LOAD_ZONES_FROM_FILE"]
+SCHEMA_FILE             = CONFIG_SETTINGS["SCHEMA_FILE"]
+MAX_SAVE_FILE_COUNT     = CONFIG_SETTINGS["MAX_SAVE_FILE_COUNT"]
+PACKET_ARCHIVE_DIR      = CONFIG_SETTINGS["PACKET_ARCHIVE_DIR"]
+PACKET_ARCHIVE_RETENTION_DAYS = CONFIG_SETTINGS["PACKET_ARCHIVE_RETENTION_DAYS"]
+EVENT_STREAM_SOCKET     = CONFIG_SETTINGS["EVENT_STREAM_SOCKET"]
+EVENT_STREAM_BUFFER     = CONFIG_SETTINGS["EVENT_STREAM_BUFFER"]
+RETAINED_TOPICS_FILE    = CONFIG_SETTINGS["RETAINED_TOPICS_FILE"]
+PROFILE_DIR             = CONFIG_SETTINGS["PROFILE_DIR"]
+FAULT_LOG_FILE          = CONFIG_SETTINGS["FAULT_LOG_FILE"]
+MQTT_SERVER             = CONFIG_SETTINGS["MQTT_SERVER"]
+MQTT_PORT               = CONFIG_SETTINGS["MQTT_PORT"]
+MQTT_USER               = CONFIG_SETTINGS["MQTT_USER"]
+MQTT_PW                 = CONFIG_SETTINGS["MQTT_PW"]
+MQTT_CLIENTID           = CONFIG_SETTINGS["MQTT_CLIENTID"]
+MQTT_PUB_JSON_ONLY      = CONFIG_SETTINGS["MQTT_PUB_JSON_ONLY"]
+MQTT_PUB_KV_WITH_JSON   = CONFIG_SETTINGS["MQTT_PUB_KV_WITH_JSON"]
+MQTT_GROUP_BY_ZONE      = CONFIG_SETTINGS["MQTT_GROUP_BY_ZONE"]
+MQTT_PUB_KV             = CONFIG_SETTINGS["MQTT_PUB_KV"]
+MQTT_PUB_ZONE_STATE     = CONFIG_SETTINGS["MQTT_PUB_ZONE_STATE"]
+MQTT_ZONE_STATE_INTERVAL = CONFIG_SETTINGS["MQTT_ZONE_STATE_INTERVAL"]
+MQTT_REQUIRE_ZONE_NAMES = CONFIG_SETTINGS["MQTT_REQUIRE_ZONE_NAMES"]
+MQTT_RETAINED_GRACE_DAYS = CONFIG_SETTINGS["MQTT_RETAINED_GRACE_DAYS"]
+MQTT_PUB_CHANGES_ONLY   = CONFIG_SETTINGS["MQTT_PUB_CHANGES_ONLY"]
+MQTT_PUB_CHANGES_REFRESH_MINS = CONFIG_SETTINGS["MQTT_PUB_CHANGES_REFRESH_MINS"]
+MQTT_WARM_START         = CONFIG_SETTINGS["MQTT_WARM_START"]
+MQTT_WARM_START_SECS    = CONFIG_SETTINGS["MQTT_WARM_START_SECS"]
+MQTT_ZONE_COMMANDS      = CONFIG_SETTINGS["MQTT_ZONE_COMMANDS"]
+MQTT_SUB_TOPIC          = CONFIG_SETTINGS["MQTT_SUB_TOPIC"]
+MQTT_PUB_TOPIC          = CONFIG_SETTINGS["MQTT_PUB_TOPIC"]
+MQTT_ZONE_IND_TOPIC     = CONFIG_SETTINGS["MQTT_ZONE_IND_TOPIC"]
+MQTT_ZONE_UNKNOWN       = CONFIG_SETTINGS["MQTT_ZONE_UNKNOWN"]
+THIS_GATEWAY_NAME       = CONFIG_SETTINGS["THIS_GATEWAY_NAME"]
+RAMSESRF_DISABLE_SENDING = CONFIG_SETTINGS["RAMSESRF_DISABLE_SENDING"]
+DISPLAY_FULL_JSON       = CONFIG_SETTINGS["DISPLAY_FULL_JSON"]
+FORCE_SINGLE_HGI        = CONFIG_SETTINGS["FORCE_SINGLE_HGI"]
+DHW_ZONE_PREFIX         = CONFIG_SETTINGS["DHW_ZONE_PREFIX"]
+RAMSESRF_DISABLE_DISCOVERY = CONFIG_SETTINGS["RAMSESRF_DISABLE_DISCOVERY"]
+RAMSESRF_ALLOW_EAVESDROP = CONFIG_SETTINGS["RAMSESRF_ALLOW_EAVESDROP"]
+RAMSESRF_KNOWN_LIST     = CONFIG_SETTINGS["RAMSESRF_KNOWN_LIST"]
+MIN_ROW_LENGTH          = CONFIG_SETTINGS["MIN_ROW_LENGTH"]
+WATCHDOG_LAG_THRESHOLD_MS = CONFIG_SETTINGS["WATCHDOG_LAG_THRESHOLD_MS"]
+WATCHDOG_PUBLISH_SECS   = CONFIG_SETTINGS["WATCHDOG_PUBLISH_SECS"]
+STATS_INTERVAL_MINS     = CONFIG_SETTINGS["STATS_INTERVAL_MINS"]
+STATS_WINDOW_SAMPLES    = CONFIG_SETTINGS["STATS_WINDOW_SAMPLES"]
+LINK_STATS_INTERVAL_MINS = CONFIG_SETTINGS["LINK_STATS_INTERVAL_MINS"]
+LINK_STATS_SAMPLES      = CONFIG_SETTINGS["LINK_STATS_SAMPLES"]
+AVAILABILITY_TRACKING   = CONFIG_SETTINGS["AVAILABILITY_TRACKING"]
+AVAILABILITY_MISSED_INTERVALS = CONFIG_SETTINGS["AVAILABILITY_MISSED_INTERVALS"]
+AVAILABILITY_MIN_TIMEOUT_MINS = CONFIG_SETTINGS["AVAILABILITY_MIN_TIMEOUT_MINS"]
+FAULT_LOG_INTERVAL_MINS = CONFIG_SETTINGS["FAULT_LOG_INTERVAL_MINS"]
+FAULT_LOG_ON_NEW_FAULT  = CONFIG_SETTINGS["FAULT_LOG_ON_NEW_FAULT"]
+FAULT_LOG_CONCURRENCY   = CONFIG_SETTINGS["FAULT_LOG_CONCURRENCY"]
+ANALYTICS_INTERVAL_MINS = CONFIG_SETTINGS["ANALYTICS_INTERVAL_MINS"]
+ANALYTICS_WINDOW_MINS   = CONFIG_SETTINGS["ANALYTICS_WINDOW_MINS"]
+HISTORY_DAYS            = CONFIG_SETTINGS["HISTORY_DAYS"]
+HISTORY_SAMPLES_PER_KEY = CONFIG_SETTINGS["HISTORY_SAMPLES_PER_KEY"]
+HISTORY_MEMORY_MB       = CONFIG_SETTINGS["HISTORY_MEMORY_MB"]
+DEVICE_PROMOTE_SIGHTINGS = CONFIG_SETTINGS["DEVICE_PROMOTE_SIGHTINGS"]
+DEVICE_CANDIDATE_MAX    = CONFIG_SETTINGS["DEVICE_CANDIDATE_MAX"]
+DEVICE_CANDIDATE_EXPIRY_MINS = CONFIG_SETTINGS["DEVICE_CANDIDATE_EXPIRY_MINS"]
+RF_BUDGET_PER_MIN       = CONFIG_SETTINGS["RF_BUDGET_PER_MIN"]
+RF_BUDGET_BURST         = CONFIG_SETTINGS["RF_BUDGET_BURST"]
+PIPELINE_WORKERS        = CONFIG_SETTINGS["PIPELINE_WORKERS"]
+PACKET_FILTER_RULES     = CONFIG_SETTINGS["PACKET_FILTER_RULES"]
+MQTT_TOPIC_TEMPLATES    = CONFIG_SETTINGS["MQTT_TOPIC_TEMPLATES"]
 
 DISPLAY_COLOURS         = get_display_colorscheme()
 
@@ -166,28 +348,79 @@ MQTT_STATUS_SUBTOPIC    = "status"
 MQTT_OFFLINE            = "Offline"
 MQTT_ONLINE             = "Online"
 SYS_CONFIG_COMMAND      = "sys_config"
+HISTORY_COMMAND         = "history"
+PIPELINE_PUBLISH        = "publish"
+PIPELINE_DISPLAY        = "display"
+PIPELINE_SETTINGS       = "settings"
 SYSTEM_MSG_TAG          = "*"
 SEND_STATUS_TRANSMITTED = "Transmitted"
 SEND_STATUS_FAILED      = "Failed"
 SEND_STATUS_SUCCESS     = "Successful"
+SEND_STATUS_INVALID     = "Invalid"
+BATCH_COMMAND           = "batch"
+BATCH_MAX_COMMANDS      = 50
+BATCH_TIMEOUT_SECS      = 120
+PROFILER_INTERVAL_MS    = 5
+PROFILER_DEFAULT_SECS   = 60
+PROFILER_MAX_SECS       = 3600
+PROFILER_TOP_COUNT      = 20
+TRACEMALLOC_FRAMES      = 10
+FAULT_LOG_COMMAND       = "get_fault_log"
+FAULT_LOG_TIMEOUT_SECS  = 10
 
 RELAYS                  = {"f9": "Radiators", "fa": "DHW", "fc": "Appliance Controller"}
 
 SZ_TOPIC_IDX            = "topic_idx"
 SZ_LOG_IDX              = "log_idx"
+SZ_LOG_ENTRY            = "log_entry"
 SZ_FRAG_NUMBER          = "frag_number"
 SZ_FORCE_IO             = "force_io"
 
 GET_SCHED_WAIT_PERIOD   = 5
+HISTORY_MAX_PACKETS     = 5000
+HISTORY_CHUNK_SIZE      = 100
+HISTORY_MAX_KEYS        = 100
+WARM_START_QUIET_SECS   = 1         # Retained messages are complete once none have been received for this long
+RETAINED_GC_INTERVAL_SECS = 3600
+RETAINED_GC_BATCH       = 100       # Stale topics cleared per round
+RETAINED_GC_WAIT_SECS   = 5         # Time allowed for the broker to send the retained topics under each stale topic
+SERIAL_RESTART_DELAY    = 5
+AVAILABILITY_CHECK_SECS = 5         # i.e. the timer wheel tick
 
 # -----------------------------------
 DEVICES = {}
+CANDIDATE_DEVICES = OrderedDict()   # device_id: [sightings, last_seen], least recently seen first
+DEVICE_REGISTRY_STATS = {"promoted": 0, "evicted": 0, "expired": 0}
 ZONES = {}
 UFH_CIRCUITS = {}
 MQTT_CLIENT = None
 GWY = None
 GWY_MODE = None
 LAST_SEND_MSG = None
+PACKET_ARCHIVE = None
+WATCHDOG = None
+EVENT_STREAM = None
+ZONE_STATE = None
+ROLLING_STATS = None
+LINK_STATS = None
+AVAILABILITY = None
+HISTORY = None
+PACKET_FILTER = None
+TOPIC_TEMPLATES = None
+PIPELINE = None
+RETAINED_TOPICS = None
+RF_BUDGET = None
+FAULT_LOG = None
+LAST_VALUES = {}            # {topic: (value, publish time)}, for MQTT_PUB_CHANGES_ONLY
+COMMAND_ROUTES = CommandRoutes()    # Per zone/device command topics, for MQTT_ZONE_COMMANDS
+PROFILER = None
+TRACEMALLOC_SNAPSHOT = None     # The last snapshot, which the next is compared with
+SERIAL_RESTART_TASK = None
+SERIAL_RESTARTS = 0
+
+CONFIG_LOCK = Lock()
+CONFIG_RELOAD_BUILDERS = []     # (setting names, builder) pairs, for objects that depend on config settings
+CONFIG_RELOAD_HOOKS = []    # (setting names, callback) pairs, for caches that depend on config settings
 
 # -----------------------------------
 
@@ -212,7 +445,7 @@ log.addHandler(console_handler)
 
 _first_cap_re = re.compile('(.)([A-Z][a-z]+)')
 _all_cap_re = re.compile('([a-z0-9])([A-Z])')
-def to_snake(name):
+def _to_snake(name):
     if name:
         name=name.strip().replace("'","").replace(" ","_")
         s1 = _first_cap_re.sub(r'\1_\2', name)
@@ -220,6 +453,24 @@ def to_snake(name):
         return s2.replace("__","_")
 
 
+def to_snake(name):
+    """ Cached, as it is called for the zone, device and every key of every message published """
+    return SNAKE_NAMES.get(name)
+
+
+def build_topic_base(src_zone, src_device, code_name, topic_idx):
+    return TOPIC_TEMPLATES.get(code_name).base(MQTT_PUB_TOPIC, src_zone, src_device, code_name, topic_idx)
+
+
+# The strings built for every received message, built once and reused (see string_cache.py)
+SNAKE_NAMES             = StringCache(_to_snake)
+TOPIC_BASES             = StringCache(build_topic_base)
+SUBTOPICS               = StringCache(lambda topic, key: f"{topic}/{to_snake(key)}")
+TIMESTAMP_TOPICS        = StringCache(lambda topic_base, code_name: f"{topic_base}/{code_name}_ts")
+PUBLISH_TIMESTAMP       = SecondTimestamp("%Y-%m-%dT%X%Z")
+DISPLAY_TIMESTAMP       = SecondTimestamp("%Y-%m-%d %X")
+
+
 def truncate_str(str, length):
     if str:
         return (str[:length - 3] + '...') if len(str) > length else str
@@ -317,6 +568,40 @@ def get_msg_zone_name(src, target_zone_id=None):
     return zone_name
 
 
+def get_zone_topic_name(zone_idx):
+    """ Topic name for a zone given just its zone_idx, e.g. for stats not tied to a particular message """
+    if zone_idx in ZONES:
+        return to_snake(ZONES[zone_idx])
+    elif zone_idx == "HW":
+        return DHW_ZONE_PREFIX
+    elif zone_idx.lower() in RELAYS:
+        return f"{MQTT_ZONE_IND_TOPIC}/relays"
+    return f"_zone_{zone_idx}"
+
+
+def get_device_topic_base(device_id):
+    """ Topic base for a device given just its device_id, i.e. where its received values are published (less the
+        code), as per the default topic template
+    """
+    src = SimpleNamespace(id=device_id, type=device_id[:2])
+    device = to_snake(get_device_name(src))
+    zone_idx = DEVICES[device_id].get("zone_id") if device_id in DEVICES else None
+    if GWY and device_id in GWY.device_by_id:
+        # The same zone as for its own messages (e.g. _zone_independent for the controller, or the relays)
+        zone = to_snake(get_msg_zone_name(src))
+    else:
+        # Not yet heard from, so not known to ramses_rf (and get_msg_zone_name would create it)
+        zone = get_zone_topic_name(zone_idx) if zone_idx else None
+
+    template = TOPIC_TEMPLATES.default
+    if ("dhw_" in device or zone_idx == "HW") and DHW_ZONE_PREFIX:
+        if template.uses_zone:
+            zone = DHW_ZONE_PREFIX
+        else:
+            device = f"{DHW_ZONE_PREFIX}/{device}"
+    return template.base(MQTT_PUB_TOPIC, zone, device, None, None)
+
+
 def get_opentherm_msg(msg):
     if msg.code_name == "opentherm_msg":
         name = msg.payload.get("msg_name", None)
@@ -369,42 +654,158 @@ def spawn_schedule_task(action, **kwargs):
     timer.start()
 
 
+def get_topic_idx(payload, src_zone, src_device):
+    """ Sub-topic for payloads that need one under the CTL, HGI or UFH controller, e.g. zone or domain specific payloads """
+    if "topic_idx" in payload:
+        # topic_idx is not currently sent in ramses_rf payloads. Use here for custom topics, e.g. schedules
+        return f"/{payload['topic_idx']}"
+    elif src_zone.endswith("/relays") and "ufx_idx" in payload:
+        return f"/_ufx_idx_{payload['ufx_idx']}"
+    elif src_zone.startswith(MQTT_ZONE_IND_TOPIC) and (src_device.startswith("hgi_") or src_device.startswith("ctl_") or src_device.startswith("ufc_")) and (SZ_ZONE_IDX in payload or SZ_DOMAIN_ID in payload):
+        if SZ_ZONE_IDX in payload:
+            return f"/{payload[SZ_ZONE_IDX]}"
+        elif payload[SZ_DOMAIN_ID].lower() in RELAYS:
+            return f"/_domain_{payload['domain_id'].upper()}_{to_snake(RELAYS[payload['domain_id'].lower()])}"
+        else:
+            return payload[SZ_DOMAIN_ID].lower()
+    return ""
+
+
+# Per-code handlers. Each code_name is resolved once to a (display, mqtt) pair of handlers by get_code_handlers(),
+# falling back to the generic handlers for codes that need no special treatment.
+#   display handler:    fn(msg, payload_dict) -> text to display
+#   mqtt handler:       fn(msg, payload_dict, src_zone, src_device) -> (topic_idx, sub_key, payload to be flattened)
+DISPLAY_HANDLERS = {}
+MQTT_HANDLERS = {}
+_CODE_HANDLERS = {}
+
+DISPLAY_HIDDEN_KEYS     = (SZ_ZONE_IDX, "parent_idx", "msg_id", "msg_type")
+DISPLAY_PERCENT_KEYS    = ("heat_demand", "relay_demand", "modulation_level")
+
+
+def display_generic(msg, payload):
+    if msg.code_name in payload:
+        # remove the command name (dict key) from the displayed text
+        return payload[msg.code_name]
+
+    # Remove extra detail, not required for 'simple/clean' display
+    display_dict = {k: v for k, v in payload.items() if k not in DISPLAY_HIDDEN_KEYS and "unknown" not in k}
+
+    if "value" in display_dict and display_dict["value"] is not None and any("temperature" in k for k in display_dict):
+        display_dict["value"] = "{:.1f}°C".format(float(display_dict["value"]))
+    for key in DISPLAY_PERCENT_KEYS:
+        if key in display_dict and display_dict[key] is not None:
+            display_dict[key] = "{:.0f}%".format(float(display_dict[key]) * 100)
+
+    text = ", ".join(f"{k}: {display_value(display_dict[k])}" for k in sorted(display_dict)).replace('"', '').strip()
+    if msg.verb == "RQ":
+        text = "REQUEST: {}{}".format("" if text else msg.code_name, text)
+    return text
+
+
+def display_value(value):
+    """ The value as json.dumps would show it, without the json encoder's overhead for the common (scalar) values """
+    if value is None:
+        return "null"
+    elif value is True:
+        return "true"
+    elif value is False:
+        return "false"
+    elif type(value) is str and value.isascii() and value.isprintable() and "\\" not in value:
+        return value
+    elif type(value) is int:
+        return str(value)
+    return json.dumps(value, sort_keys=True)
+
+
+def display_temperature(msg, payload):
+    value = payload.get(msg.code_name)
+    if value is None:
+        return display_generic(msg, payload)
+    return "{:>05.2f}°C".format(float(value))
+
+
+def display_demand(msg, payload):
+    value = payload.get(msg.code_name)
+    if value is None:
+        return display_generic(msg, payload)
+    return "{:> 5.0f}%".format(float(value) * 100)
+
+
+def mqtt_generic(msg, payload, src_zone, src_device):
+    return get_topic_idx(payload, src_zone, src_device), None, payload
+
+
+def mqtt_mode_until(msg, payload, src_zone, src_device):
+    """ Modes with an 'until' datetime, which is patched with a T separator """
+    until = payload.get("until")
+    if not MQTT_PUB_JSON_ONLY and until and " " in until:
+        try:
+            d, t = until.split(" ")
+            payload["until"] = f"{d}T{t}"
+        except Exception as ex:
+            log.error(f"Exception occured in patching 'until' value '{until}': {ex}", exc_info=True)
+    return mqtt_generic(msg, payload, src_zone, src_device)
+
+
+def mqtt_fault_log(msg, payload, src_zone, src_device):
+    """ Fault log entries each have their own sub-topic """
+    if SZ_LOG_IDX in payload and "topic_idx" not in payload:
+        if (FAULT_LOG and FAULT_LOG_ON_NEW_FAULT and msg.verb.strip() == "I" and payload.get(SZ_LOG_ENTRY) and not FAULT_LOG.refreshing
+                and json.loads(json.dumps(payload[SZ_LOG_ENTRY])) not in FAULT_LOG.entries):
+            # The controller announces each new fault, so read it (and any others missed) into the local copy
+            asyncio.run_coroutine_threadsafe(refresh_fault_log(), GWY._loop)
+        return f"/{payload[SZ_LOG_IDX]}", None, payload
+    return mqtt_generic(msg, payload, src_zone, src_device)
+
+
+def mqtt_schedule_fragment(msg, payload, src_zone, src_device):
+    """ Schedule fragments each have their own sub-topic """
+    if SZ_FRAG_NUMBER in payload and "topic_idx" not in payload:
+        return f"/fragment_{payload[SZ_FRAG_NUMBER]}", None, payload
+    return mqtt_generic(msg, payload, src_zone, src_device)
+
+
+def mqtt_opentherm(msg, payload, src_zone, src_device):
+    """ OpenTherm msgs are published under a sub-topic of their msg_name """
+    topic_idx = get_topic_idx(payload, src_zone, src_device)
+    new_key, updated_payload = get_opentherm_msg(msg)
+    return topic_idx, new_key, updated_payload
+
+
+def register_code_handlers(code_names, display=None, mqtt=None):
+    for code_name in code_names:
+        if display:
+            DISPLAY_HANDLERS[code_name] = display
+        if mqtt:
+            MQTT_HANDLERS[code_name] = mqtt
+    _CODE_HANDLERS.clear()
+
+
+def get_code_handlers(code_name):
+    """ Return the (display, mqtt) handlers for the given code name, resolving them on first use """
+    handlers = _CODE_HANDLERS.get(code_name)
+    if handlers is None:
+        display = DISPLAY_HANDLERS.get(code_name)
+        if display is None:
+            display = display_demand if "_demand" in code_name else display_generic
+        handlers = _CODE_HANDLERS[code_name] = (display, MQTT_HANDLERS.get(code_name, mqtt_generic))
+    return handlers
+
+
+register_code_handlers(["temperature", "setpoint"], display=display_temperature)
+register_code_handlers([CODE_NAMES[c] for c in ("2349", "1F41", "2E04") if c in CODE_NAMES], mqtt=mqtt_mode_until)
+register_code_handlers([CODE_NAMES[c] for c in ("0418",) if c in CODE_NAMES], mqtt=mqtt_fault_log)
+register_code_handlers([CODE_NAMES[c] for c in ("0404",) if c in CODE_NAMES], mqtt=mqtt_schedule_fragment)
+register_code_handlers(["opentherm_msg"], mqtt=mqtt_opentherm)
+
+
 def cleanup_display_text(msg, display_text):
     """ Clean up/Simplify the displayed text for given message. display_text must be a dict """
     try:
         if type(display_text) == dict:
-            if msg.code_name in display_text:
-                # remove the command name (dict key) from the displayed text
-                filtered_text = display_text[msg.code_name]
-
-                # Formatting for temperature/demand numbers
-                if msg.code_name in "temperature setpoint" and filtered_text is not None:
-                    filtered_text = "{:>05.2f}°C".format(float(filtered_text))
-                elif "_demand" in msg.code_name and filtered_text is not None:
-                    filtered_text = "{:> 5.0f}%".format(float(filtered_text) * 100)
-
-            else:
-                filtered_text = display_text
-
-                # Remove extra detail, not required for 'simple/clean' display
-                for key in [SZ_ZONE_IDX, "parent_idx", "msg_id", "msg_type"] + [k for k in filtered_text if "unknown" in k]:
-                    if key in filtered_text:
-                        del filtered_text[key]
-
-                if "value" in filtered_text and "temperature" in str(filtered_text.keys()) and filtered_text["keys]"]:
-                    filtered_text["value"] = "{:.1f}°C".format(float(filtered_text))
-                if "heat_demand" in filtered_text and filtered_text["heat_demand]"] is not None:
-                    filtered_text["heat_demand"] = "{:.0f}%".format(float(filtered_text["heat_demand"]) * 100)
-                if "relay_demand" in filtered_text and filtered_text["relay_demand]"] is not None:
-                    filtered_text["relay_demand"] = "{:.0f}%".format(float(filtered_text["relay_demand"]) * 100)
-                if "modulation_level" in filtered_text and filtered_text["modulation_level"] is not None:
-                    filtered_text["modulation_level"] = "{:.0f}%".format(float(filtered_text["modulation_level"]) * 100)
-
-                filtered_text = json.dumps(filtered_text, sort_keys=True)[1:-1]
-                filtered_text = filtered_text.replace('"', '').strip()
-                if msg.verb == "RQ":
-                    filtered_text = "REQUEST: {}{}".format("" if filtered_text else msg.code_name, filtered_text)
-            return filtered_text
+            display_handler, _ = get_code_handlers(msg.code_name)
+            return display_handler(msg, display_text)
         else:
             return display_text
     except Exception as ex:
@@ -415,12 +816,37 @@ def cleanup_display_text(msg, display_text):
 def process_gwy_message(msg, prev_msg=None) -> None:
     """ Process received ramses_rf message from Gateway """
 
+    if WATCHDOG:
+        WATCHDOG.note_packet()
+
+    if LINK_STATS:
+        # Before filtering, as it is about the radio link rather than the messages
+        LINK_STATS.add(msg.src.id, msg._pkt._rssi, msg._pkt._frame)
+
+    if AVAILABILITY and msg.src.id in DEVICES:
+        # Only the system's own devices, so neighbours' and corrupted IDs are neither kept nor counted as offline
+        AVAILABILITY.note(msg.src.id)
+
+    # Filtered messages are dropped before anything else, including logging
+    if PACKET_FILTER and not PACKET_FILTER.allow(msg):
+        return
+
     log.debug("") # spacer, as we have other debug entries for a given received msg
     log.info(msg)  # Log event to file
 
+    if PACKET_ARCHIVE:
+        # As in the packet log, i.e. with the rssi, which ramses_rf holds separately from the frame
+        PACKET_ARCHIVE.add(msg.dtm, f"{msg._pkt._rssi} {msg._pkt._frame}", msg.src.id, msg.dst.id, msg.code)
+
     # Message class in ramses_rf lib does not seem to have the code name, so add it
     msg.code_name = CODE_NAMES[msg.code]
 
+    if msg.src.id not in DEVICES and note_device_sighting(msg.src.id):
+        promote_device(msg.src.id)
+
+    if EVENT_STREAM:
+        EVENT_STREAM.publish_msg(msg)
+
     if DISPLAY_FULL_JSON:
         display_full_msg(msg)
 
@@ -433,6 +859,8 @@ def process_gwy_message(msg, prev_msg=None) -> None:
             if type(item) != dict:
                 # Convert to a dict...
                 item = {msg.code_name: str(item) }
+            if ROLLING_STATS:
+                ROLLING_STATS.add_item(msg, item)
             if not DISPLAY_FULL_JSON:
                 zone_id = item[SZ_ZONE_IDX] if SZ_ZONE_IDX in item else None
                 display_simple_msg(msg, item, zone_id, "")
@@ -443,6 +871,9 @@ def process_gwy_message(msg, prev_msg=None) -> None:
             log.error(f"item: {item}, payload: {payload} ")
             log.error(f"msg: {msg}")
 
+    if PIPELINE:
+        PIPELINE.flush()
+
 
 def print_ramsesrf_gwy_schema(gwy):
 
@@ -473,12 +904,10 @@ def display_full_msg(msg):
 
 
 def display_simple_msg(msg, payload_dict, target_zone_id, suffix_text=""):
+    """ Resolve the device/zone names and colour of the row, and display it (in a pipeline worker if enabled) """
     src = get_device_name(msg.src)
     dst = get_device_name(msg.dst) if msg.src.id != msg.dst.id else ""
 
-    # Make a copy as we are deleting elements from the displayed text
-    display_text = payload_dict.copy() if isinstance(payload_dict, dict) else payload_dict
-    filtered_text = cleanup_display_text(msg, display_text)
     try:
         zone_name = "@ {:<20}".format(truncate_str(ZONES[target_zone_id], 20)) if target_zone_id and int(target_zone_id, 16) >= 0 and target_zone_id in ZONES else ""
         zone_id = "[Zone {:<3}]".format(target_zone_id) if target_zone_id and int(target_zone_id, 16) >= 0 else ""
@@ -492,20 +921,36 @@ def display_simple_msg(msg, payload_dict, target_zone_id, suffix_text=""):
         else:
             style_prefix = f"{Style.RESET_ALL}"
 
+    except Exception as e:
+        log.error(f"Exception occured: {e}", exc_info=True)
+        log.error(f"msg: {msg}, payload_dict: {payload_dict}, target_zone_id: {target_zone_id}, suffix_text: {suffix_text}")
+        return
+
+    if PIPELINE:
+        # All display rows go to the same worker, to keep them in order
+        PIPELINE.submit(PIPELINE_DISPLAY, (PIPELINE_DISPLAY, (msg.code_name, msg.verb, payload_dict, src, dst, zone_name, zone_id, suffix_text, msg._pkt._rssi, style_prefix)))
+    else:
+        print_simple_msg_row(msg, payload_dict, src, dst, zone_name, zone_id, suffix_text, msg._pkt._rssi, style_prefix)
+
+
+def print_simple_msg_row(msg, payload_dict, src, dst, zone_name, zone_id, suffix_text, rssi, style_prefix):
+    """ Format and print the row for a message. msg only needs its code_name and verb """
+    display_text = payload_dict
+    filtered_text = cleanup_display_text(msg, display_text)
+    try:
         main_txt = f"{filtered_text if filtered_text else '-': <45} {zone_name:<25}"
-        print_formatted_row(src, dst, msg.verb, msg.code_name, f"{main_txt: <75} {zone_id} {suffix_text}", msg._pkt._rssi, style_prefix)
+        print_formatted_row(src, dst, msg.verb, msg.code_name, f"{main_txt: <75} {zone_id} {suffix_text}", rssi, style_prefix)
 
     except Exception as e:
         log.error(f"Exception occured: {e}", exc_info=True)
-        log.error(f"msg: {msg}, payload_dict: {payload_dict}, target_zone_id: {target_zone_id}, suffix_text: {suffix_text}")
         log.error(f"type(display_text): {type(display_text)}")
         log.error(f"filtered_text: {filtered_text}" if filtered_text else "filtered_text is None")
-        log.error(f"Display row: {msg.code_name}: {msg.verb}| {src} -> {dst} | {display_text} {zone_name} [Zone {target_zone_id}] {suffix_text}")
-        log.error(f"|rssi '{msg._pkt._rssi}'| src '{src}' -> dst '{dst}' | verb '{msg.verb}'| cmd '{msg.code_name}'")
+        log.error(f"Display row: {msg.code_name}: {msg.verb}| {src} -> {dst} | {display_text} {zone_name} {zone_id} {suffix_text}")
+        log.error(f"|rssi '{rssi}'| src '{src}' -> dst '{dst}' | verb '{msg.verb}'| cmd '{msg.code_name}'")
 
 
 def print_formatted_row(src="", dst="", verb="", cmd="", text="", rssi="   ", style_prefix=""):
-    dtm = datetime.datetime.now().strftime("%Y-%m-%d %X")
+    dtm = DISPLAY_TIMESTAMP()
     if src:
         row = f"{dtm} |{rssi}| {truncate_str(src, 21) if src else '':<21} -> {truncate_str(dst, 21) if dst else '':<21} |{verb:<2}| {cmd:<15} | {text}"
     else:
@@ -579,8 +1024,61 @@ def get_existing_device_name(device_id):
     return DEVICES[device_id][SZ_ALIAS] if device_id in DEVICES and SZ_ALIAS in DEVICES[device_id] else None
 
 
-def update_devices_from_gwy(ignore_unnamed_zones=False):
-    """ Refresh the local DEVICES collection with the devices that GWY has found """
+def note_device_sighting(device_id):
+    """ Count a sighting of a device that is not (yet) in DEVICES. Returns True once it has been
+        seen DEVICE_PROMOTE_SIGHTINGS times, without expiring in between, and should be promoted.
+    """
+    now = time.time()
+
+    # Expire candidates not seen recently. These are at the front, so this is O(1) per sighting
+    expiry = now - DEVICE_CANDIDATE_EXPIRY_MINS * 60
+    while CANDIDATE_DEVICES:
+        oldest_id, (_, last_seen) = next(iter(CANDIDATE_DEVICES.items()))
+        if last_seen >= expiry:
+            break
+        forget_candidate_device(oldest_id, "expired")
+
+    candidate = CANDIDATE_DEVICES.get(device_id)
+    if candidate:
+        candidate[0] += 1
+        candidate[1] = now
+        CANDIDATE_DEVICES.move_to_end(device_id)
+    else:
+        candidate = CANDIDATE_DEVICES[device_id] = [1, now]
+        while len(CANDIDATE_DEVICES) > max(DEVICE_CANDIDATE_MAX, 1):
+            forget_candidate_device(next(iter(CANDIDATE_DEVICES)), "evicted")
+
+    if candidate[0] >= DEVICE_PROMOTE_SIGHTINGS:
+        del CANDIDATE_DEVICES[device_id]
+        return True
+    return False
+
+
+def forget_candidate_device(device_id, reason):
+    """ Drop a candidate device. Only evoGateway's own registry is changed: ramses_rf's device table is left alone,
+        as the library has no supported way to remove a device (and its zones/tcs may still refer to it)
+    """
+    del CANDIDATE_DEVICES[device_id]
+    DEVICE_REGISTRY_STATS[reason] += 1
+    log.info(f"Candidate device '{device_id}' {reason} from device registry")
+
+
+def promote_device(device_id):
+    """ Add a candidate device, that has now been seen often enough, to DEVICES """
+    DEVICE_REGISTRY_STATS["promoted"] += 1
+    log.info(f"Device '{device_id}' promoted to device registry")
+    update_zones_from_gwy()
+    update_devices_from_gwy(promoted_id=device_id)
+
+
+def get_device_registry_stats():
+    return {"confirmed": len(DEVICES), "candidates": len(CANDIDATE_DEVICES), **DEVICE_REGISTRY_STATS}
+
+
+def update_devices_from_gwy(ignore_unnamed_zones=False, promoted_id=None):
+    """ Refresh the local DEVICES collection with the devices that GWY has found.
+        Orphan devices are only added if already known, or just promoted from being a candidate.
+    """
     schema = GWY.tcs.schema if GWY.tcs else  GWY.schema
     global DEVICES
 
@@ -627,10 +1125,18 @@ def update_devices_from_gwy(ignore_unnamed_zones=False):
 
     if SZ_ORPHANS in schema and schema[SZ_ORPHANS]:
         for device_id in schema[SZ_ORPHANS]:
-            org_name = get_existing_device_name(device_id)
-            DEVICES[device_id] = {SZ_ALIAS: org_name if org_name else get_device_type_and_id(device_id)}
+            if device_id in DEVICES or device_id == promoted_id:
+                org_name = get_existing_device_name(device_id)
+                DEVICES[device_id] = {SZ_ALIAS: org_name if org_name else get_device_type_and_id(device_id)}
+
+    if promoted_id and promoted_id not in DEVICES:
+        DEVICES[promoted_id] = {SZ_ALIAS: get_device_type_and_id(promoted_id)}
+
+    for device_id in DEVICES:
+        CANDIDATE_DEVICES.pop(device_id, None)
 
     mqtt_publish_schema()
+    update_command_routes()
 
 
 def update_zones_from_gwy(schema={}, params={}):
@@ -666,6 +1172,52 @@ def update_zones_from_gwy(schema={}, params={}):
     # Only publish if GWY initialised
     if GWY:
         mqtt_publish_schema()
+        update_command_routes()
+
+
+def get_command_routes():
+    """ Routes for the command topics of each zone (and DHW), and each device, with the target IDs and Command
+        constructors resolved now, rather than for every command received
+    """
+    if not (GWY and GWY.tcs):
+        return []
+    ctl_id = GWY.tcs.id
+    routes = get_setter_routes(f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}", {"ctl_id": ctl_id}, SYSTEM_SETTERS, Command)
+
+    for zone_idx in ZONES:
+        topic_base = f"{MQTT_PUB_TOPIC}/{get_zone_topic_name(zone_idx)}"
+        defaults = {"ctl_id": ctl_id, "zone_idx": zone_idx}
+        routes.append(Route(f"{topic_base}/{SZ_COMMAND}", defaults | {"dst_id": ctl_id}))
+        routes += get_setter_routes(topic_base, defaults, ZONE_SETTERS, Command)
+
+    if getattr(GWY.tcs, "dhw", None) and DHW_ZONE_PREFIX:
+        topic_base = f"{MQTT_PUB_TOPIC}/{get_zone_topic_name('HW')}"
+        routes.append(Route(f"{topic_base}/{SZ_COMMAND}", {"ctl_id": ctl_id, "dst_id": ctl_id}))
+        routes += get_setter_routes(topic_base, {"ctl_id": ctl_id}, DHW_SETTERS, Command)
+
+    for device_id, device in list(DEVICES.items()):
+        if device_id.startswith("18:"):
+            continue
+        topic_base = get_device_topic_base(device_id)
+        routes.append(Route(f"{topic_base}/{SZ_COMMAND}", {"ctl_id": ctl_id, "dst_id": device_id, "dev_id": device_id, "dest_id": device_id}))
+        zone_idx = device.get("zone_id")
+        if zone_idx in ZONES:
+            routes += get_setter_routes(topic_base, {"ctl_id": ctl_id, "zone_idx": zone_idx}, ZONE_SETTERS, Command)
+
+    # The zone independent command topic would just duplicate MQTT_SUB_TOPIC
+    return [route for route in routes if route.topic != MQTT_SUB_TOPIC]
+
+
+def update_command_routes():
+    """ Rebuild the command routing table, and subscribe to any new command topics (and unsubscribe from removed ones) """
+    added, removed = COMMAND_ROUTES.update(get_command_routes() if MQTT_ZONE_COMMANDS else [])
+    if MQTT_CLIENT:
+        if removed:
+            MQTT_CLIENT.unsubscribe(removed)
+        if added:
+            MQTT_CLIENT.subscribe([(topic, 0) for topic in added])
+    if added or removed:
+        log.info(f"Command topics updated: {len(added)} added, {len(removed)} removed, {len(COMMAND_ROUTES.routes)} in total")
 
 
 def get_device_type_and_id(device_id):
@@ -682,6 +1234,241 @@ def get_sys_status_dict(status):
     return {"status": status, "status_ts": datetime.datetime.now().strftime("%Y-%m-%dT%X")}
 
 
+def register_config_reload_builder(settings, builder):
+    """ Register builder(changed, settings) to be called when a config reload changes any of the given settings.
+        It returns a dict of the globals to replace (e.g. {"ROLLING_STATS": RollingStats(...)}), built from the new
+        settings, which are then published together with the settings themselves
+    """
+    CONFIG_RELOAD_BUILDERS.append((frozenset(settings), builder))
+
+
+def register_config_reload_hook(settings, callback):
+    """ Register callback(changed, previous) to be called once a config reload has published changes to any of the
+        given settings
+    """
+    CONFIG_RELOAD_HOOKS.append((frozenset(settings), callback))
+
+
+def reload_config():
+    """ Re-read the config file and apply any changed settings to the running gateway.
+        The serial connection and the ramses_rf Gateway state are left untouched.
+    """
+    global config
+    global CONFIG_SETTINGS
+
+    new_config = configparser.RawConfigParser()
+    try:
+        if not new_config.read(CONFIG_FILE):
+            raise FileNotFoundError(f"Config file '{CONFIG_FILE}' not found")
+        new_settings = read_config_settings(new_config)
+    except Exception as ex:
+        log.error(f"Config reload failed, keeping current settings: {ex}", exc_info=True)
+        print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] Config reload failed, keeping current settings: {ex}")
+        return
+
+    with CONFIG_LOCK:
+        previous = CONFIG_SETTINGS
+        changed = {k for k, v in new_settings.items() if previous.get(k) != v}
+
+        restart_required = changed.intersection(RESTART_ONLY_SETTINGS)
+        for k in restart_required:
+            new_settings[k] = previous[k]
+        changed -= restart_required
+
+        # The objects that depend on the settings are built first, so that nothing sees the new settings with the
+        # old objects (e.g. STATS_INTERVAL_MINS enabled, but no ROLLING_STATS yet)
+        updates = {k: new_settings[k] for k in changed if k not in TRACKING_ONLY_SETTINGS}
+        for settings, builder in CONFIG_RELOAD_BUILDERS:
+            if settings & changed:
+                try:
+                    updates.update(builder(changed, new_settings))
+                except Exception as ex:
+                    log.error(f"Exception occured in config reload builder '{builder.__name__}': {ex}", exc_info=True)
+
+        # A single dict update is not interleaved with the paho thread, so readers see either the old or new settings
+        config = new_config
+        CONFIG_SETTINGS = new_settings
+        globals().update(updates)
+
+        for settings, callback in CONFIG_RELOAD_HOOKS:
+            if settings & changed:
+                try:
+                    callback(changed, previous)
+                except Exception as ex:
+                    log.error(f"Exception occured in config reload hook '{callback.__name__}': {ex}", exc_info=True)
+
+    if restart_required:
+        log.warning(f"Config changes to {sorted(restart_required)} require a restart and have not been applied")
+        print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] Config changes to {sorted(restart_required)} require a restart")
+    log.info(f"Config reloaded from '{CONFIG_FILE}'. Changed settings: {sorted(changed)}")
+    print_formatted_row(SYSTEM_MSG_TAG, text=f"Config reloaded. Changed settings: {', '.join(sorted(changed)) if changed else 'None'}")
+
+
+def _build_display_colours(changed, settings):
+    return {"DISPLAY_COLOURS": get_display_colorscheme(colours_string=settings["DISPLAY_COLOURS_CFG"] or "")}
+
+
+def _reload_mqtt_sub_topic(changed, previous):
+    if MQTT_CLIENT:
+        if previous["MQTT_SUB_TOPIC"]:
+            MQTT_CLIENT.unsubscribe(previous["MQTT_SUB_TOPIC"])
+        log.info(f"Subscribing to topic {MQTT_SUB_TOPIC} for commands")
+        MQTT_CLIENT.subscribe(MQTT_SUB_TOPIC)
+
+
+def _reload_mqtt_pub_topic(changed, previous):
+    if MQTT_CLIENT:
+        MQTT_CLIENT.will_set(f"{MQTT_PUB_TOPIC}/{MQTT_STATUS_SUBTOPIC}",
+            payload=json.dumps(get_sys_status_dict(MQTT_OFFLINE), indent=4), qos=0, retain=True)
+        mqtt_publish_status(MQTT_ONLINE)
+        if GWY:
+            mqtt_publish_schema()
+
+
+def clear_topic_caches():
+    for cache in (TOPIC_BASES, SUBTOPICS, TIMESTAMP_TOPICS):
+        cache.clear()
+
+
+def _reload_topic_caches(changed, previous):
+    # The cached topics all start with MQTT_PUB_TOPIC, and are laid out as per the topic templates
+    clear_topic_caches()
+
+
+def _reload_packet_archive_retention(changed, previous):
+    if PACKET_ARCHIVE:
+        PACKET_ARCHIVE.retention_days = PACKET_ARCHIVE_RETENTION_DAYS
+
+
+def _reload_watchdog_threshold(changed, previous):
+    if WATCHDOG:
+        WATCHDOG.lag_threshold = WATCHDOG_LAG_THRESHOLD_MS / 1000
+
+
+def _build_rolling_stats(changed, settings):
+    if settings["STATS_INTERVAL_MINS"] <= 0 and settings["ANALYTICS_INTERVAL_MINS"] <= 0:
+        return {"ROLLING_STATS": None}
+    if not ROLLING_STATS or "STATS_WINDOW_SAMPLES" in changed:
+        return {"ROLLING_STATS": RollingStats(settings["STATS_WINDOW_SAMPLES"])}
+    return {}
+
+
+def _build_link_stats(changed, settings):
+    if settings["LINK_STATS_INTERVAL_MINS"] <= 0:
+        return {"LINK_STATS": None}
+    if not LINK_STATS or "LINK_STATS_SAMPLES" in changed:
+        return {"LINK_STATS": LinkStats(settings["LINK_STATS_SAMPLES"])}
+    return {}
+
+
+def _build_availability(changed, settings):
+    if not settings["AVAILABILITY_TRACKING"]:
+        return {"AVAILABILITY": None}
+    if AVAILABILITY:
+        # The learned intervals are kept
+        AVAILABILITY.missed_intervals = settings["AVAILABILITY_MISSED_INTERVALS"]
+        AVAILABILITY.min_timeout_secs = settings["AVAILABILITY_MIN_TIMEOUT_MINS"] * 60
+        return {}
+    return {"AVAILABILITY": new_availability_tracker(settings)}
+
+
+def _build_history(changed, settings):
+    if settings["HISTORY_DAYS"] <= 0:
+        return {"HISTORY": None}
+    if HISTORY and not changed.intersection(("HISTORY_SAMPLES_PER_KEY", "HISTORY_MEMORY_MB")):
+        HISTORY.max_days = settings["HISTORY_DAYS"]     # Keep the existing history
+        return {}
+    return {"HISTORY": HistoryStore(settings["HISTORY_DAYS"], settings["HISTORY_SAMPLES_PER_KEY"], settings["HISTORY_MEMORY_MB"])}
+
+
+def new_packet_filter(rules, previous=None):
+    """ Compile the packet filter rules, keeping the hit counts of any unchanged rules from the previous filter """
+    if not rules:
+        return None
+    packet_filter = PacketFilter(rules, CODE_NAMES, previous)
+    for error in packet_filter.errors:
+        log.error(f"Invalid packet filter rule ignored - {error}")
+        print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] Invalid packet filter rule ignored - {error}")
+    return packet_filter
+
+
+def _build_packet_filter(changed, settings):
+    return {"PACKET_FILTER": new_packet_filter(settings["PACKET_FILTER_RULES"], PACKET_FILTER)}
+
+
+def new_topic_templates(templates, group_by_zone):
+    """ Compile the topic templates (or the built-in layout, as per group_by_zone), reporting any that are invalid
+        or collide, and so are ignored
+    """
+    topic_templates = TopicTemplates(templates, CODE_NAMES, group_by_zone)
+    for error in topic_templates.errors:
+        log.error(f"Topic template ignored - {error}")
+        print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] Topic template ignored - {error}")
+    return topic_templates
+
+
+def _build_topic_templates(changed, settings):
+    return {"TOPIC_TEMPLATES": new_topic_templates(settings["MQTT_TOPIC_TEMPLATES"], settings["MQTT_GROUP_BY_ZONE"])}
+
+
+def _reload_pipeline_settings(changed, previous):
+    # The workers have their own copy of the settings, from when they were forked
+    if PIPELINE:
+        PIPELINE.broadcast((PIPELINE_SETTINGS, {k: globals()[k] for k in changed if k in globals()}))
+
+
+def _build_retained_topics(changed, settings):
+    if settings["MQTT_RETAINED_GRACE_DAYS"] <= 0:
+        if RETAINED_TOPICS:
+            RETAINED_TOPICS.save()
+        return {"RETAINED_TOPICS": None}
+    if RETAINED_TOPICS:
+        RETAINED_TOPICS.grace_secs = settings["MQTT_RETAINED_GRACE_DAYS"] * 86400
+        return {}
+    return {"RETAINED_TOPICS": RetainedTopicRegistry(RETAINED_TOPICS_FILE, settings["MQTT_RETAINED_GRACE_DAYS"], log)}
+
+
+def _reload_rf_budget(changed, previous):
+    if RF_BUDGET:
+        RF_BUDGET.per_minute = RF_BUDGET_PER_MIN
+        RF_BUDGET.burst = RF_BUDGET_BURST
+
+
+def _reload_command_routes(changed, previous):
+    update_command_routes()
+
+
+def _reload_last_values(changed, previous):
+    LAST_VALUES.clear()
+
+
+def _build_zone_state(changed, settings):
+    return {"ZONE_STATE": ZoneStateAggregator() if settings["MQTT_PUB_ZONE_STATE"] else None}
+
+
+register_config_reload_builder(["DISPLAY_COLOURS_CFG"], _build_display_colours)
+register_config_reload_builder(["MQTT_PUB_ZONE_STATE"], _build_zone_state)
+register_config_reload_builder(["STATS_INTERVAL_MINS", "STATS_WINDOW_SAMPLES", "ANALYTICS_INTERVAL_MINS"], _build_rolling_stats)
+register_config_reload_builder(["LINK_STATS_INTERVAL_MINS", "LINK_STATS_SAMPLES"], _build_link_stats)
+register_config_reload_builder(["AVAILABILITY_TRACKING", "AVAILABILITY_MISSED_INTERVALS", "AVAILABILITY_MIN_TIMEOUT_MINS"],
+    _build_availability)
+register_config_reload_builder(["HISTORY_DAYS", "HISTORY_SAMPLES_PER_KEY", "HISTORY_MEMORY_MB"], _build_history)
+register_config_reload_builder(["PACKET_FILTER_RULES"], _build_packet_filter)
+register_config_reload_builder(["MQTT_TOPIC_TEMPLATES", "MQTT_GROUP_BY_ZONE"], _build_topic_templates)
+register_config_reload_builder(["MQTT_RETAINED_GRACE_DAYS"], _build_retained_topics)
+
+register_config_reload_hook(["MQTT_SUB_TOPIC"], _reload_mqtt_sub_topic)
+register_config_reload_hook(["MQTT_PUB_TOPIC", "MQTT_ZONE_IND_TOPIC"], _reload_mqtt_pub_topic)
+register_config_reload_hook(["MQTT_PUB_TOPIC", "MQTT_TOPIC_TEMPLATES", "MQTT_GROUP_BY_ZONE"], _reload_topic_caches)
+register_config_reload_hook(["PACKET_ARCHIVE_RETENTION_DAYS"], _reload_packet_archive_retention)
+register_config_reload_hook(["WATCHDOG_LAG_THRESHOLD_MS"], _reload_watchdog_threshold)
+register_config_reload_hook(["MQTT_PUB_CHANGES_ONLY"], _reload_last_values)
+register_config_reload_hook(["RF_BUDGET_PER_MIN", "RF_BUDGET_BURST"], _reload_rf_budget)
+register_config_reload_hook(["MQTT_ZONE_COMMANDS", "MQTT_PUB_TOPIC", "MQTT_ZONE_IND_TOPIC", "MQTT_SUB_TOPIC",
+    "MQTT_GROUP_BY_ZONE", "DHW_ZONE_PREFIX"], _reload_command_routes)
+register_config_reload_hook(CONFIG_SETTINGS.keys(), _reload_pipeline_settings)
+
+
 def mqtt_initialise():
     if not MQTT_SERVER:
         log.error("MQTT Server details not found. Exiting...")
@@ -696,20 +1483,111 @@ def mqtt_initialise():
 
     if MQTT_USER:
         MQTT_CLIENT.username_pw_set(MQTT_USER, MQTT_PW)
-    MQTT_CLIENT.connect(MQTT_SERVER)
+    MQTT_CLIENT.connect(MQTT_SERVER, MQTT_PORT)
 
     return MQTT_CLIENT
 
 
+def pipeline_worker_init(index):
+    """ Each pipeline worker publishes with its own connection to the broker """
+    global MQTT_CLIENT
+    client = mqtt.Client()
+    if MQTT_USER:
+        client.username_pw_set(MQTT_USER, MQTT_PW)
+    client.connect(MQTT_SERVER, MQTT_PORT)
+    client.loop_start()
+    # The inherited client shares the parent's socket, so must not be used (or disconnected) from the worker
+    MQTT_CLIENT = client
+    return client
+
+
+def pipeline_worker_handle(client, record):
+    kind, args = record
+    if kind == PIPELINE_PUBLISH:
+        mqtt_publish_values(client, *args)
+    elif kind == PIPELINE_DISPLAY:
+        code_name, verb, *row = args
+        print_simple_msg_row(SimpleNamespace(code_name=code_name, verb=verb), *row)
+    elif kind == PIPELINE_SETTINGS:
+        globals().update(args)
+        clear_topic_caches()
+        if "MQTT_PUB_CHANGES_ONLY" in args:
+            LAST_VALUES.clear()
+
+
+def pipeline_worker_finish(client):
+    client.disconnect()
+    client.loop_stop()
+
+
+def mqtt_warm_start():
+    """ Load the retained values last published (i.e. by the previous run) from the broker into the zone state and
+        last value caches, so that they are complete from the start. Called before the serial processing is started,
+        and before the MQTT client's network thread, so runs the client loop itself.
+    """
+    retained = {}
+    state = {"subscribed": False, "last_received": time.time()}
+    def on_retained(client, _, msg):
+        if msg.retain:
+            retained[msg.topic] = msg.payload.decode("utf-8", errors="replace")
+            state["last_received"] = time.time()
+    def on_subscribe(client, userdata, mid, granted_qos):
+        state["subscribed"] = True
+        state["last_received"] = time.time()
+
+    print_formatted_row(SYSTEM_MSG_TAG, text="Loading retained values from the broker...")
+    start = time.time()
+    subscription = f"{MQTT_PUB_TOPIC}/#"
+    MQTT_CLIENT.message_callback_add(subscription, on_retained)
+    MQTT_CLIENT.on_subscribe = on_subscribe
+    MQTT_CLIENT.subscribe(subscription)
+    while time.time() - start < MQTT_WARM_START_SECS:
+        MQTT_CLIENT.loop(timeout=0.1)
+        if state["subscribed"] and time.time() - state["last_received"] > WARM_START_QUIET_SECS:
+            break
+    MQTT_CLIENT.unsubscribe(subscription)
+    MQTT_CLIENT.message_callback_remove(subscription)
+    MQTT_CLIENT.on_subscribe = None
+
+    zones = 0
+    now = time.time()
+    for topic, payload in retained.items():
+        try:
+            if topic.endswith("/_state"):
+                if ZONE_STATE and ZONE_STATE.load(json.loads(payload)):
+                    zones += 1
+            elif MQTT_PUB_CHANGES_ONLY:
+                LAST_VALUES[topic] = (payload, now)
+        except Exception as ex:
+            log.error(f"Exception occured loading retained topic '{topic}': {ex}", exc_info=True)
+
+    text = f"Loaded {len(retained)} retained topics ({zones} zone states) in {time.time() - start:.1f}s"
+    log.info(text)
+    print_formatted_row(SYSTEM_MSG_TAG, text=text)
+
+
 def mqtt_on_connect(client, *_):
     log.info(f"Connected to MQTT broker. Subscribing to topic {MQTT_SUB_TOPIC} for commands")
     client.subscribe(MQTT_SUB_TOPIC)
+    if COMMAND_ROUTES.routes:
+        client.subscribe([(topic, 0) for topic in COMMAND_ROUTES.topics()])
     client.publish(f"{MQTT_PUB_TOPIC}/{MQTT_STATUS_SUBTOPIC}", MQTT_ONLINE)
     mqtt_publish_status(MQTT_ONLINE)
 
 
 def mqtt_on_message(client, _, msg):
     payload = str(msg.payload.decode("utf-8"))
+    route = COMMAND_ROUTES.get(msg.topic) if msg.topic != MQTT_SUB_TOPIC else None
+    if route:
+        if msg.retain:
+            # Don't repeat a (wrongly) retained command each time we subscribe
+            log.warning(f"Ignoring retained command on '{msg.topic}': {payload}")
+            return
+        print_formatted_row("MQTT", text=f"Received MQTT message on {msg.topic}: {payload}", style_prefix=f"{DISPLAY_COLOURS['mqtt_command']}")
+        log.info(f"MQTT message received on {msg.topic}: {payload}")
+        mqtt_process_routed_msg(route, payload)
+        return
+
     print_formatted_row("MQTT", text=f"Received MQTT message: {payload}", style_prefix=f"{DISPLAY_COLOURS['mqtt_command']}")
     log.info(f"MQTT message received: {payload}")
     mqtt_process_msg(payload)
@@ -745,16 +1623,12 @@ def mqtt_publish_received_msg(msg, payload, no_unpack=False):
             target_zone_id = payload[SZ_ZONE_IDX]
         elif SZ_DOMAIN_ID in payload:
             target_zone_id = payload[SZ_DOMAIN_ID]
-        elif SZ_UFH_IDX in str(payload):
+        elif SZ_UFH_IDX in payload:
             if not UFH_CIRCUITS: # May just need an update
                 update_zones_from_gwy()
             if UFH_CIRCUITS and payload[SZ_UFH_IDX] in UFH_CIRCUITS and SZ_ZONE_IDX in UFH_CIRCUITS[payload[SZ_UFH_IDX]]:
                 target_zone_id = UFH_CIRCUITS[payload[SZ_UFH_IDX]][SZ_ZONE_IDX]
 
-        if msg.src.id not in DEVICES: # Refresh zones/devices list
-            update_zones_from_gwy()
-            update_devices_from_gwy()
-
         if hasattr(msg.src, "zone") and msg.src.zone and hasattr(msg.src.zone, "idx") and msg.src.zone.idx and not "HW" in msg.src.zone.idx:
             src_zone_id = msg.src.zone.idx
         elif hasattr(msg.src, "_domain_id") and msg.src._domain_id and int(msg.src._domain_id, 16) >= 0:
@@ -774,92 +1648,42 @@ def mqtt_publish_received_msg(msg, payload, no_unpack=False):
         src_device = to_snake(get_device_name(msg.src))
 
         if ("dhw_" in msg.code_name or "dhw_" in src_device or (src_zone_id and "HW" in src_zone_id)) and DHW_ZONE_PREFIX:
-            # treat DHW as a zone if we are grouping by zone, otherwise as a device prefix
-            if MQTT_GROUP_BY_ZONE:
+            # treat DHW as a zone if the topics are grouped by zone, otherwise as a device prefix
+            if TOPIC_TEMPLATES.get(msg.code_name).uses_zone:
                 src_zone = f"{DHW_ZONE_PREFIX}"
             else:
                 src_device = f"{DHW_ZONE_PREFIX}/{src_device}"
 
-        if not MQTT_PUB_JSON_ONLY and "until" in payload and payload["until"] and " " in payload["until"]:
-            # Patch with T separator
-            try:
-                d, t = payload["until"].split(" ")
-                payload["until"] = f"{d}T{t}"
-            except Exception as ex:
-                log.error(f"Exception occured in patching 'until' value '{payload['until']}': {ex}", exc_info=True)
-
-        # Need separate sub-topics for certain payloads under CTL, HGI or UFH controller, such as fault log entries
-        if "topic_idx" in payload:
-            # topic_idx is not currently sent in ramses_rf payloads. Use here for custom topics, e.g. schedules
-            topic_idx = f"/{payload['topic_idx']}"
-        elif "log_idx" in payload:
-            topic_idx = f"/{payload['log_idx']}"
-        elif SZ_FRAG_NUMBER in payload:
-            topic_idx = f"/fragment_{payload['frag_number']}"
-        elif src_zone.endswith("/relays") and "ufx_idx" in payload:
-            topic_idx = f"/_ufx_idx_{payload['ufx_idx']}"
-        elif src_zone.startswith(MQTT_ZONE_IND_TOPIC) and (src_device.startswith("hgi_") or src_device.startswith("ctl_") or src_device.startswith("ufc_")) and (SZ_ZONE_IDX in payload or SZ_DOMAIN_ID in payload):
-            if SZ_ZONE_IDX in payload:
-                topic_idx = f"/{payload[SZ_ZONE_IDX]}"
-            elif payload[SZ_DOMAIN_ID].lower() in RELAYS:
-                topic_idx =  f"/_domain_{payload['domain_id'].upper()}_{to_snake(RELAYS[payload['domain_id'].lower()])}"
-            else:
-                topic_idx = payload[SZ_DOMAIN_ID].lower()
-        else:
-            topic_idx = ""
+        if HISTORY and hasattr(msg, "_pkt") and not (isinstance(msg.payload, list) and msg.payload and payload is not msg.payload[0]):
+            # Once per message, not for every item of array payloads
+            device_key = f"{src_zone}/{src_device}" if MQTT_GROUP_BY_ZONE and src_zone else src_device
+            if msg._pkt._rssi and msg._pkt._rssi.isdigit():
+                HISTORY.add(f"{device_key}/_rssi", int(msg._pkt._rssi))
 
-        if MQTT_GROUP_BY_ZONE and src_zone:
-            topic_base = f"{MQTT_PUB_TOPIC}/{src_zone}/{src_device}/{msg.code_name}{topic_idx}"
-        else:
-            topic_base = f"{MQTT_PUB_TOPIC}/{src_device}/{msg.code_name}{topic_idx}"
+        # Code specific handling, e.g. sub-topics for fault log entries and schedule fragments, or opentherm msg keys
+        _, mqtt_handler = get_code_handlers(msg.code_name)
+        topic_idx, new_key, updated_payload = mqtt_handler(msg, payload, src_zone, src_device)
 
-        subtopic = topic_base
+        topic_base = TOPIC_BASES.get((src_zone, src_device, msg.code_name, topic_idx))
+        if RETAINED_TOPICS:
+            # All the retained values are published under the topic base
+            RETAINED_TOPICS.note(topic_base)
 
         # if msg.code_name == "relay_demand" or SZ_DOMAIN_ID in payload:
         #     log.info(f"[DEBUG] ----->                          : payload: {payload}, target_zone_id: {target_zone_id}, msg: {msg}")
-        #     log.info(f"[DEBUG] ----->                          : subtopic: '{subtopic}', topic_idx: '{topic_idx}', src_zone: {src_zone}, src_device: {src_device}")
-
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%X%Z")
-        if not MQTT_PUB_JSON_ONLY and not no_unpack:
-            #Unpack the JSON and publish the individual key/value pairs
+        #     log.info(f"[DEBUG] ----->                          : topic_base: '{topic_base}', topic_idx: '{topic_idx}', src_zone: {src_zone}, src_device: {src_device}")
 
-            if MQTT_PUB_KV_WITH_JSON:
-                # Publish the payload JSON into the subtopic key
-                MQTT_CLIENT.publish(subtopic, json.dumps(payload | {"timestamp": timestamp}), 0, True)
+        timestamp = PUBLISH_TIMESTAMP()
+        unpack = not MQTT_PUB_JSON_ONLY and not no_unpack
+        if unpack and (ZONE_STATE or HISTORY):
+            record_received_values(src_zone, src_device, SUBTOPICS.get((topic_base, new_key)) if new_key else topic_base, updated_payload, timestamp)
 
-            if msg.code_name == "opentherm_msg":
-                # This is an opentherm_msg. Extract msg item and updated_payload as new dict, with msg_name as key
-                new_key, updated_payload = get_opentherm_msg(msg)
-            else:
-                updated_payload = payload
-                new_key = None
-            subtopic = f"{topic_base}/{to_snake(new_key)}" if new_key else topic_base
-
-            # As some payloads are received as lists, others not, convert everything to a list so we can process in same way
-            if updated_payload and not isinstance(updated_payload, list):
-                updated_payload = [updated_payload]
-
-            # Iterate through the list. payload_item should be a dict as updated_payload should now be a list of dict [{...}]
-            if updated_payload:
-                for payload_item in updated_payload:
-                    try:
-                        if isinstance(payload_item, dict): # we may have a further dict in the updated_payload - e.g. opentherm msg, system_fault etc
-                            for k in payload_item:
-                                MQTT_CLIENT.publish(f"{subtopic}/{to_snake(k)}", str(payload_item[k]), 0, True)
-                                log.debug(f"        -> mqtt_publish_received_msg: 2. Posted subtopic: {subtopic}/{to_snake(k)}, value: {payload_item[k]}")
-                        else:
-                            MQTT_CLIENT.publish(subtopic, str(payload_item), 0, True)
-                            log.info(f"        -> mqtt_publish_received_msg: 3. item is not a dict. Posted subtopic: {subtopic}, value: {payload_item}, type(playload_item): {type(payload_item)}")
-                    except Exception as e:
-                        log.error(f"Exception occured: {e}", exc_info=True)
-                        log.error(f"------------> payload_item: \"{payload_item}\", type(payload_item): \"{type(payload_item)}\", updated_payload: \"{updated_payload}\"")
-                        log.error(f"------------> msg: {msg}")
+        values = (topic_base, new_key, payload, updated_payload, msg.payload if not unpack else None, msg.code_name, timestamp, no_unpack)
+        if PIPELINE:
+            # Records for the same topic always go to the same worker, so are published in order
+            PIPELINE.submit(topic_base, (PIPELINE_PUBLISH, values))
         else:
-            # Publish the JSON
-            MQTT_CLIENT.publish(subtopic, json.dumps(msg.payload), 0, True)
-
-        MQTT_CLIENT.publish(f"{topic_base}/{msg.code_name}_ts", timestamp, 0, True)
-        # print("published to mqtt topic {}: {}".format(topic, msg))
+            mqtt_publish_values(MQTT_CLIENT, *values)
     except Exception as e:
         log.error(f"Exception occured: {e}", exc_info=True)
         log.error(f"msg.src.id: {msg.src.id}, command: {msg.code_name}, payload: {payload}, pub_json: {MQTT_PUB_JSON_ONLY}")
@@ -869,6 +1693,78 @@ def mqtt_publish_received_msg(msg, payload, no_unpack=False):
         pass
 
 
+def record_received_values(src_zone, src_device, subtopic, updated_payload, timestamp):
+    """ Update the zone state and history with the key/values of a received message, as they are published """
+    if updated_payload and not isinstance(updated_payload, list):
+        updated_payload = [updated_payload]
+    for payload_item in updated_payload or []:
+        if isinstance(payload_item, dict):
+            for k, value in payload_item.items():
+                key = to_snake(k)
+                if ZONE_STATE and k != SZ_ZONE_IDX:
+                    ZONE_STATE.update(src_zone, src_device, key, value, timestamp)
+                if HISTORY:
+                    HISTORY.add(f"{subtopic}/{key}"[len(MQTT_PUB_TOPIC) + 1:], value.get("value") if isinstance(value, dict) else value)
+
+
+def is_changed_value(topic, value):
+    """ True if the value is not the one last published to the topic, or was last published too long ago to be sure
+        that it is still retained. The last values are per process, but each topic is always published by the same one.
+    """
+    now = time.time()
+    last = LAST_VALUES.get(topic)
+    if last and last[0] == value and now - last[1] < MQTT_PUB_CHANGES_REFRESH_MINS * 60:
+        return False
+    LAST_VALUES[topic] = (value, now)
+    return True
+
+
+def mqtt_publish_values(client, topic_base, new_key, payload, updated_payload, msg_payload, code_name, timestamp, no_unpack=False):
+    """ Publish the (unpacked) values of a received message under its topic, as resolved by mqtt_publish_received_msg.
+        Only uses its args and the MQTT settings, so that it can be run in a pipeline worker.
+    """
+    subtopic = topic_base
+    if not MQTT_PUB_JSON_ONLY and not no_unpack:
+        #Unpack the JSON and publish the individual key/value pairs
+
+        if MQTT_PUB_KV_WITH_JSON:
+            # Publish the payload JSON into the subtopic key
+            client.publish(subtopic, json.dumps(payload | {"timestamp": timestamp}), 0, True)
+
+        subtopic = SUBTOPICS.get((topic_base, new_key)) if new_key else topic_base
+
+        # As some payloads are received as lists, others not, convert everything to a list so we can process in same way
+        if updated_payload and not isinstance(updated_payload, list):
+            updated_payload = [updated_payload]
+
+        # Iterate through the list. payload_item should be a dict as updated_payload should now be a list of dict [{...}]
+        if updated_payload:
+            for payload_item in updated_payload:
+                try:
+                    if isinstance(payload_item, dict): # we may have a further dict in the updated_payload - e.g. opentherm msg, system_fault etc
+                        if MQTT_PUB_KV:
+                            for k in payload_item:
+                                topic, value = SUBTOPICS.get((subtopic, k)), str(payload_item[k])
+                                if MQTT_PUB_CHANGES_ONLY and not is_changed_value(topic, value):
+                                    continue
+                                client.publish(topic, value, 0, True)
+                                # Not an f-string, so that it is only formatted if debug logging is enabled
+                                log.debug("        -> mqtt_publish_values: 2. Posted subtopic: %s, value: %s", topic, value)
+                    else:
+                        client.publish(subtopic, str(payload_item), 0, True)
+                        log.info(f"        -> mqtt_publish_values: 3. item is not a dict. Posted subtopic: {subtopic}, value: {payload_item}, type(playload_item): {type(payload_item)}")
+                except Exception as e:
+                    log.error(f"Exception occured: {e}", exc_info=True)
+                    log.error(f"------------> payload_item: \"{payload_item}\", type(payload_item): \"{type(payload_item)}\", updated_payload: \"{updated_payload}\"")
+                    log.error(f"------------> topic_base: {topic_base}")
+    else:
+        # Publish the JSON
+        client.publish(subtopic, json.dumps(msg_payload), 0, True)
+
+    if MQTT_PUB_KV or MQTT_PUB_JSON_ONLY:
+        client.publish(TIMESTAMP_TOPICS.get((topic_base, code_name)), timestamp, 0, True)
+
+
 def mqtt_publish_zone_schedules(with_display=False):
     """ Publish all avialable zone schedules"""
 
@@ -879,6 +1775,8 @@ def mqtt_publish_zone_schedules(with_display=False):
             mqtt_publish_received_msg(msg, {SZ_SCHEDULE: zone.schedule, SZ_ZONE_IDX: zone.idx})
             if with_display:
                 display_schedule_for_zone(zone)
+    if PIPELINE:
+        PIPELINE.flush()
 
 
 def display_schedule_for_zone(zone_idx):
@@ -899,7 +1797,40 @@ def display_schedule_for_zone(zone_idx):
         # Fake a Message object for publishing...
         msg = SimpleNamespace(**{"code_name":"zone_schedule", SZ_ZONE_IDX: zone.idx, "src": SimpleNamespace(**{"id": GWY.tcs.id, "type": GWY.get_device(GWY.tcs.id).type, "zone": zone})})
         mqtt_publish_received_msg(msg, {SZ_SCHEDULE: zone.schedule, SZ_ZONE_IDX: zone.idx})
+        if PIPELINE:
+            PIPELINE.flush()
+
+
+def mqtt_publish_retained(topic, payload):
+    """ Publish a retained zone/device specific topic, noting it in the retained topic registry """
+    MQTT_CLIENT.publish(topic, payload, 0, True)
+    if RETAINED_TOPICS:
+        RETAINED_TOPICS.note(topic)
+
 
+async def mqtt_clear_retained_topics(registry, topics):
+    """ Clear the given (stale) topics of the registry, and the retained topics below them, from the broker's
+        retained store. The broker sends any retained messages below each topic on subscribing, and each is cleared
+        by publishing an empty retained message, unless it is below a more specific topic that is still being published.
+    """
+    def clear_below(topic):
+        def on_retained(client, _, msg):
+            if msg.retain and msg.payload and not registry.is_live(msg.topic, below=topic):
+                client.publish(msg.topic, None, 0, True)
+        return on_retained
+
+    subscriptions = []
+    for topic in topics:
+        MQTT_CLIENT.publish(topic, None, 0, True)
+        MQTT_CLIENT.message_callback_add(f"{topic}/#", clear_below(topic))
+        subscriptions.append(f"{topic}/#")
+    MQTT_CLIENT.subscribe([(sub, 0) for sub in subscriptions])
+
+    await asyncio.sleep(RETAINED_GC_WAIT_SECS)
+    MQTT_CLIENT.unsubscribe(subscriptions)
+    for sub in subscriptions:
+        MQTT_CLIENT.message_callback_remove(sub)
+    registry.remove(topics)
 
 
 def mqtt_publish_send_status(cmd, status):
@@ -929,11 +1860,360 @@ def mqtt_publish_schema():
     MQTT_CLIENT.publish(f"{topic}/devices", json.dumps({str(k):  v for k, v in DEVICES.items()}, sort_keys=True), 0, True)
     MQTT_CLIENT.publish(f"{topic}/zones", json.dumps(ZONES), 0, True)
     MQTT_CLIENT.publish(f"{topic}/uhf_circuits", json.dumps(UFH_CIRCUITS, sort_keys=True), 0, True)
+    MQTT_CLIENT.publish(f"{topic}/device_registry", json.dumps(get_device_registry_stats(), sort_keys=True), 0, True)
 
     timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%X")
     MQTT_CLIENT.publish(f"{topic}/_gateway_config_ts", timestamp, 0, True)
 
 
+def mqtt_publish_packet_history(request):
+    """ Query the packet archive and publish the matching packets in chunks, followed by a 'done' message.
+        Run in its own thread, as a query may need to decompress several archive segments.
+    """
+    topic = f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_history/packets"
+    request_id = request.get("request_id")
+    count = 0
+    try:
+        limit = min(int(request.get("limit", HISTORY_MAX_PACKETS)), HISTORY_MAX_PACKETS)
+        chunk = []
+        for line in PACKET_ARCHIVE.query(request.get("device_id"), request.get("code"), request.get("since"), request.get("until"), limit):
+            chunk.append(line)
+            count += 1
+            if len(chunk) >= HISTORY_CHUNK_SIZE:
+                MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "packets": chunk}), 0, False)
+                chunk = []
+        if chunk:
+            MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "packets": chunk}), 0, False)
+        MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "done": True, "count": count}), 0, False)
+    except Exception as ex:
+        log.error(f"Exception occured in packet history query '{request}': {ex}", exc_info=True)
+        MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "done": True, "count": count, "error": str(ex)}), 0, False)
+
+
+def mqtt_publish_readings_history(request):
+    """ Publish the (decimated) history of each key matching the request's key pattern, followed by a 'done' message """
+    topic = f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_history/readings"
+    request_id = request.get("request_id")
+    count = 0
+    try:
+        pattern = str(request.get("key", "#"))
+        if pattern.startswith(f"{MQTT_PUB_TOPIC}/"):
+            pattern = pattern[len(MQTT_PUB_TOPIC) + 1:]
+        since = datetime.datetime.fromisoformat(request["since"]).timestamp() if request.get("since") else None
+        until = datetime.datetime.fromisoformat(request["until"]).timestamp() if request.get("until") else None
+        points = int(request.get("points", 200))
+
+        for key in HISTORY.keys(pattern)[:HISTORY_MAX_KEYS]:
+            times, values = HISTORY.query(key, since, until, points)
+            if times:
+                MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "key": f"{MQTT_PUB_TOPIC}/{key}",
+                    "times": [int(t) for t in times], "values": [round(v, 3) for v in values]}, separators=(",", ":")), 0, False)
+                count += 1
+        MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "done": True, "count": count}), 0, False)
+    except Exception as ex:
+        log.error(f"Exception occured in readings history query '{request}': {ex}", exc_info=True)
+        MQTT_CLIENT.publish(topic, json.dumps({"request_id": request_id, "done": True, "count": count, "error": str(ex)}), 0, False)
+
+
+def mqtt_process_history_request(json_data):
+    history_type = str(json_data[HISTORY_COMMAND]).lower().strip()
+    if history_type == "packets":
+        if not PACKET_ARCHIVE:
+            print_formatted_row(SYSTEM_MSG_TAG, text="Packet history requested, but PACKET_ARCHIVE_DIR is not configured")
+            return
+        Thread(target=mqtt_publish_packet_history, args=(json_data,), daemon=True).start()
+    elif history_type == "readings":
+        if not HISTORY:
+            print_formatted_row(SYSTEM_MSG_TAG, text="Readings history requested, but HISTORY_DAYS is not configured")
+            return
+        Thread(target=mqtt_publish_readings_history, args=(json_data,), daemon=True).start()
+    else:
+        print_formatted_row(SYSTEM_MSG_TAG, text=f"History type '{json_data[HISTORY_COMMAND]}' not recognised")
+
+
+def build_command(json_data, defaults={}):
+    """ Convert a command json, with either a 'code' or a (ramses_rf Command constructor) 'command', to a Command.
+        Any defaults (e.g. the zone_idx, for zone command topics) are used for the arguments the command takes but that
+        the json does not include. Raises ValueError if the json is not a valid command
+    """
+    if "code" in json_data:
+        command_code = json_data["code"]
+        if type(command_code) is int:
+            command_code = hex(command_code)
+            command_code = command_code.upper().replace("0X","")
+
+        if "verb" not in json_data or "payload" not in json_data:
+            raise ValueError(f"Both 'verb' and 'payload' must be provided when 'code' is used instead of 'command' (code '{command_code}')")
+
+        verb = json_data["verb"]
+        payload = json_data["payload"]
+        dest_id = json_data["dest_id"] if "dest_id" in json_data else defaults.get("dest_id", GWY.tcs.id)
+        try:
+            if "from_id" in json_data:                                                      # Allow addition of from_id kwarg
+                from_id = json_data["from_id"]
+                gw_cmd = GWY.create_cmd(verb, dest_id, command_code, payload, from_id=from_id)
+            else:
+                gw_cmd = GWY.create_cmd(verb, dest_id, command_code, payload)                 # Command.from_attrs()
+        except Exception as ex:
+            raise ValueError(f"Invalid command code '{command_code}': {ex}") from ex
+        log.debug(f"--------> MQTT message converted to Command: '{gw_cmd}'")
+        return gw_cmd
+
+    elif "command" in json_data:
+        command_name = json_data["command"]
+        if command_name and command_name == "ping":
+            command_name = "get_system_time"
+
+        ramses_cmd_constructor = getattr(Command, command_name, None) if isinstance(command_name, str) else None
+        if not ramses_cmd_constructor:
+            raise ValueError(f"Unknown command '{command_name}'")
+
+        # ramses_cmd_kwargs = sorted(list(inspect.signature(ramses_cmd_constructor).parameters.keys()))
+        # inspect.signature not able to get args through the command constructor decorators. Try wrapper attributes
+        ramses_cmd_kwargs = sorted(list(ramses_cmd_constructor.__closure__[0].cell_contents.__annotations__))
+        kwargs = {x: json_data[x] for x in json_data if x not in "command"}
+        for x in defaults:
+            if x in ramses_cmd_kwargs and x not in kwargs:
+                kwargs[x] = defaults[x]
+        if ramses_cmd_kwargs and "dst_id" in ramses_cmd_kwargs and "dst_id" not in kwargs:
+            kwargs["dst_id"] = GWY.tcs.id
+
+        # !TODO - not sure why just 'setpoint' requires this, and not others, e.g. datetime
+        if command_name == "set_zone_mode" and not "ctl_id" in kwargs:
+            kwargs["ctl_id"] = GWY.tcs.id
+
+        try:
+            return ramses_cmd_constructor(**kwargs)
+        except Exception as ex:
+            log.error(f"Command keywords: {ramses_cmd_kwargs}")
+            log.error(f"kwargs: {kwargs}")
+            raise ValueError(f"Invalid '{command_name}' command: {ex}") from ex
+
+    raise ValueError("Either 'command' or 'code' must be specified")
+
+
+def mqtt_process_batch(json_data):
+    """ Validate every command in a batch before sending any of them, and then send them all, paced by the RF budget.
+        A single status is published for the whole batch, once all the commands have completed (or it is invalid).
+    """
+    batch_id = str(json_data.get("batch_id") or datetime.datetime.now().strftime("%Y%m%dT%H%M%S"))
+    commands = json_data[BATCH_COMMAND]
+    if not isinstance(commands, list) or not commands or len(commands) > BATCH_MAX_COMMANDS:
+        mqtt_publish_batch_status(batch_id, SEND_STATUS_INVALID, errors=[f"'{BATCH_COMMAND}' must be a list of 1 to {BATCH_MAX_COMMANDS} commands"])
+        return
+
+    gw_cmds, errors = [], []
+    for i, command in enumerate(commands):
+        try:
+            if not isinstance(command, dict):
+                raise ValueError("Command must be a json object")
+            if isinstance(command.get("command"), str) and (command["command"] in GET_SCHED or command["command"] in SET_SCHED):
+                raise ValueError("Schedule commands cannot be batched")
+            gw_cmds.append(build_command(command))
+        except Exception as ex:
+            errors.append(f"{i}: {ex}")
+
+    if errors:
+        log.error(f"Command batch '{batch_id}' not sent as it has invalid commands: {errors}")
+        mqtt_publish_batch_status(batch_id, SEND_STATUS_INVALID, errors=errors)
+        return
+
+    print_formatted_row(THIS_GATEWAY_NAME, text=f"Sending command batch '{batch_id}' ({len(gw_cmds)} commands)", style_prefix=f"{DISPLAY_COLOURS['mqtt_command']}")
+    asyncio.run_coroutine_threadsafe(send_command_batch(batch_id, gw_cmds), GWY._loop)
+
+
+async def send_command_batch(batch_id, gw_cmds):
+    """ Send the commands without waiting for each to complete (other than for the RF budget), and publish the
+        aggregated result once they all have
+    """
+    loop = asyncio.get_running_loop()
+    completed = loop.create_future()
+    results = [None] * len(gw_cmds)
+
+    def check_completed():
+        if None not in results and not completed.done():
+            completed.set_result(True)
+
+    def callback_for(i):
+        def callback(msg):
+            results[i] = bool(msg)
+            loop.call_soon_threadsafe(check_completed)
+        return callback
+
+    start = time.time()
+    for i, gw_cmd in enumerate(gw_cmds):
+        if RF_BUDGET:
+            await RF_BUDGET.take()
+        log.debug(f"Sending command {i} of batch '{batch_id}': {gw_cmd}")
+        GWY.send_cmd(gw_cmd, callback=callback_for(i))
+
+    try:
+        await asyncio.wait_for(completed, BATCH_TIMEOUT_SECS)
+    except asyncio.TimeoutError:
+        log.warning(f"Command batch '{batch_id}' timed out with {results.count(None)} commands not completed")
+
+    succeeded = results.count(True)
+    status = SEND_STATUS_SUCCESS if succeeded == len(results) else SEND_STATUS_FAILED
+    mqtt_publish_batch_status(batch_id, status, succeeded=succeeded, failed=results.count(False),
+        timed_out=results.count(None), secs=round(time.time() - start, 1))
+
+    display_text = f"COMMAND BATCH '{batch_id}' {status.upper()}: {succeeded} of {len(results)} commands successful"
+    print_formatted_row(THIS_GATEWAY_NAME, text=display_text, style_prefix=f"{DISPLAY_COLOURS['mqtt_command']}")
+    log.info(display_text)
+
+
+def mqtt_publish_batch_status(batch_id, status, **details):
+    """ Publish the status of a command batch to the _last_batch topic, e.g. {"batch_id": "away", "status": "Successful", "succeeded": 13, ...} """
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%X")
+    MQTT_CLIENT.publish(f"{MQTT_SUB_TOPIC}/_last_batch", json.dumps({"batch_id": batch_id, "status": status, "status_ts": timestamp} | details), 0, True)
+
+
+async def fetch_fault_log_entry(log_idx):
+    """ Request a single fault log entry from the controller (paced by the RF budget), returning its fields, or None
+        if there is no entry at log_idx. Raises TimeoutError if there is no response
+    """
+    if RF_BUDGET:
+        await RF_BUDGET.take()
+    loop = asyncio.get_running_loop()
+    response = loop.create_future()
+
+    def set_response(msg):
+        if not response.done():
+            response.set_result(msg)
+
+    GWY.send_cmd(Command.get_system_log_entry(GWY.tcs.id, log_idx), callback=lambda msg: loop.call_soon_threadsafe(set_response, msg))
+    msg = await asyncio.wait_for(response, FAULT_LOG_TIMEOUT_SECS)
+    if not msg:
+        raise TimeoutError(f"No response for fault log entry {log_idx:02X}")
+    entry = msg.payload.get(SZ_LOG_ENTRY) if isinstance(msg.payload, dict) else None
+    # As published, i.e. tuples as lists, so they compare equal to the entries loaded from the file
+    return json.loads(json.dumps(entry)) if entry else None
+
+
+async def refresh_fault_log():
+    """ Read any new fault log entries from the controller, and publish the whole log (retained) to _fault_log,
+        and each new fault to _fault_log/new
+    """
+    if not FAULT_LOG or FAULT_LOG.refreshing:
+        return
+    if not GWY.tcs:
+        log.warning("Fault log not refreshed, as the controller has not been discovered yet")
+        return
+
+    had_entries = bool(FAULT_LOG.entries)
+    try:
+        new_entries, frames = await FAULT_LOG.refresh(fetch_fault_log_entry, FAULT_LOG_CONCURRENCY)
+    except Exception as ex:
+        log.error(f"Exception occured refreshing the fault log: {ex}")
+        return
+
+    topic = f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_fault_log"
+    MQTT_CLIENT.publish(topic, json.dumps(FAULT_LOG.document()), 0, True)
+    if had_entries:
+        # Not on the first retrieval, when every entry is new to us
+        for entry in reversed(new_entries):
+            MQTT_CLIENT.publish(f"{topic}/new", json.dumps(entry), 0, False)
+
+    display_text = f"Fault log refreshed: {len(new_entries)} new entries, {len(FAULT_LOG.entries)} in total ({frames} frames)"
+    print_formatted_row(SYSTEM_MSG_TAG, text=display_text)
+    log.info(display_text)
+
+
+async def fault_log_loop():
+    """ Refresh the fault log every FAULT_LOG_INTERVAL_MINS """
+    while True:
+        await asyncio.sleep(max(FAULT_LOG_INTERVAL_MINS, 1) * 60)
+        if FAULT_LOG_INTERVAL_MINS > 0 and MQTT_CLIENT.is_connected():
+            await refresh_fault_log()
+
+
+def start_profiler(duration_secs, interval_ms):
+    """ Start sampling the stacks of all the gateway's threads, for up to duration_secs """
+    global PROFILER
+    if PROFILER and PROFILER.running:
+        print_formatted_row(SYSTEM_MSG_TAG, text="[WARN] Sampling profiler is already running")
+        return
+    duration_secs = min(float(duration_secs), PROFILER_MAX_SECS)
+    PROFILER = SamplingProfiler(max(float(interval_ms), 1) / 1000, duration_secs, on_done=profiler_done)
+    PROFILER.start()
+    log.info(f"Sampling profiler started for {duration_secs}s, every {interval_ms}ms")
+    print_formatted_row(SYSTEM_MSG_TAG, text=f"Sampling profiler started for {duration_secs}s")
+
+
+def profiler_done(profiler):
+    """ Called from the profiler's thread when it has finished. Writes the collapsed stacks (for a flamegraph) to
+        PROFILE_DIR, and publishes the top functions
+    """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        timestamp = datetime.datetime.fromtimestamp(profiler.started).strftime("%Y%m%dT%H%M%S")
+        file_path = os.path.join(PROFILE_DIR, f"profile_{timestamp}.collapsed")
+        profiler.write_collapsed(file_path)
+        summary = profiler.top(PROFILER_TOP_COUNT) | {"file": file_path, "started": timestamp}
+        MQTT_CLIENT.publish(f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_gateway_stats/profile", json.dumps(summary), 0, True)
+
+        text = f"Sampling profiler finished: {profiler.samples} samples in {profiler.elapsed:.0f}s, written to '{file_path}'"
+        log.info(text)
+        print_formatted_row(SYSTEM_MSG_TAG, text=text)
+    except Exception as ex:
+        log.error(f"Exception occured in saving the profile: {ex}", exc_info=True)
+
+
+def mqtt_publish_tracemalloc_snapshot(count):
+    """ Take a tracemalloc snapshot, save it to PROFILE_DIR, and publish the top allocations (and the changes since
+        the previous snapshot)
+    """
+    global TRACEMALLOC_SNAPSHOT
+    if not tracemalloc.is_tracing():
+        print_formatted_row(SYSTEM_MSG_TAG, text="[WARN] tracemalloc snapshot ignored, as tracemalloc has not been started (TRACEMALLOC_START)")
+        return
+    try:
+        summary, snapshot = tracemalloc_summary(tracemalloc.take_snapshot(), TRACEMALLOC_SNAPSHOT, count)
+        TRACEMALLOC_SNAPSHOT = snapshot
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        file_path = os.path.join(PROFILE_DIR, f"snapshot_{timestamp}.tracemalloc")
+        snapshot.dump(file_path)
+        summary |= {"file": file_path, "taken": timestamp}
+        MQTT_CLIENT.publish(f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_gateway_stats/tracemalloc", json.dumps(summary), 0, True)
+
+        text = f"tracemalloc snapshot: {summary['traced_kb']}KB traced (peak {summary['peak_kb']}KB), saved to '{file_path}'"
+        log.info(text)
+        print_formatted_row(SYSTEM_MSG_TAG, text=text)
+    except Exception as ex:
+        log.error(f"Exception occured in taking tracemalloc snapshot: {ex}", exc_info=True)
+
+
+def send_command(gw_cmd, json_data, msg):
+    """ Send a single user command, publishing its status to the _last_command topic """
+    global LAST_SEND_MSG
+    LAST_SEND_MSG = json_data
+    log.debug(f"Sending command: {gw_cmd}")
+
+    if RF_BUDGET:
+        # User commands are never held back, but use up the budget so that any bulk sending backs off
+        RF_BUDGET.try_take()
+    GWY.send_cmd(gw_cmd, callback=send_command_callback)
+
+    mqtt_publish_send_status(msg, SEND_STATUS_TRANSMITTED)
+
+
+def mqtt_process_routed_msg(route, msg):
+    """ Command received on a zone or device command topic """
+    try:
+        gw_cmd = route.build(msg, build_command)
+    except ValueError as ex:
+        log.error(f"Error in sending command '{msg}' received on '{route.topic}': {ex}")
+        mqtt_publish_send_status(f"{route.topic}: {msg}", SEND_STATUS_INVALID)
+        return
+
+    try:
+        send_command(gw_cmd, {"topic": route.topic, "payload": msg}, f"{route.topic}: {msg}")
+    except Exception as ex:
+        log.error(f"Error in sending command '{msg}' received on '{route.topic}': {ex}", exc_info=True)
+
+
 def mqtt_process_msg(msg):
     log.debug(f"MQTT message received: {msg}")
 
@@ -951,6 +2231,8 @@ def mqtt_process_msg(msg):
             elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "RELOAD_DISPLAY_COLOURS":
                 global DISPLAY_COLOURS
                 DISPLAY_COLOURS = get_display_colorscheme(True)
+            elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "RELOAD_CONFIG":
+                reload_config()
             elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "POST_SCHEMA":
                 update_zones_from_gwy()
                 update_devices_from_gwy()
@@ -958,83 +2240,57 @@ def mqtt_process_msg(msg):
                 update_zones_from_gwy()
                 update_devices_from_gwy()
                 save_schema_and_devices()
+            elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "PROFILE_START":
+                start_profiler(json_data.get("duration", PROFILER_DEFAULT_SECS), json_data.get("interval_ms", PROFILER_INTERVAL_MS))
+            elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "PROFILE_STOP":
+                if PROFILER and PROFILER.running:
+                    PROFILER.stop()
+            elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "TRACEMALLOC_START":
+                tracemalloc_start(int(json_data.get("frames", TRACEMALLOC_FRAMES)))
+                print_formatted_row(SYSTEM_MSG_TAG, text="tracemalloc started")
+            elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "TRACEMALLOC_SNAPSHOT":
+                Thread(target=mqtt_publish_tracemalloc_snapshot, args=(int(json_data.get("top", PROFILER_TOP_COUNT)),), daemon=True).start()
+            elif json_data[SYS_CONFIG_COMMAND].upper().strip() == "TRACEMALLOC_STOP":
+                global TRACEMALLOC_SNAPSHOT
+                TRACEMALLOC_SNAPSHOT = None
+                tracemalloc.stop()
+                print_formatted_row(SYSTEM_MSG_TAG, text="tracemalloc stopped")
             else:
                 print_formatted_row(SYSTEM_MSG_TAG,  text="System configuration command '{}' not recognised".format(json_data[SYS_CONFIG_COMMAND]))
                 return
+        elif HISTORY_COMMAND in json_data:
+            mqtt_process_history_request(json_data)
+        elif BATCH_COMMAND in json_data:
+            mqtt_process_batch(json_data)
         else:
-            if "code" in json_data:
-                command_code = json_data["code"]
-                if type(command_code) is int:
-                    command_code = hex(command_code)
-                    command_code = command_code.upper().replace("0X","")
-
-                if "verb" not in json_data or "payload" not in json_data:
-                    log.error(f"Failed to send command '{command_code}'. Both 'verb' and 'payload' must be provided when 'code' is used instead of 'command'")
-                    return
-
-                verb = json_data["verb"]
-                payload = json_data["payload"]
-                dest_id = json_data["dest_id"] if "dest_id" in json_data else GWY.tcs.id
-                if "from_id" in json_data:                                                      # Allow addition of from_id kwarg
-                    from_id = json_data["from_id"]
-                    gw_cmd = GWY.create_cmd(verb, dest_id, command_code, payload, from_id=from_id)
+            gw_cmd = None
+            command_name = json_data.get("command")
+            if command_name == FAULT_LOG_COMMAND:
+                asyncio.run_coroutine_threadsafe(refresh_fault_log(), GWY._loop)
+                return
+            elif command_name and command_name in GET_SCHED:
+                zone_idx = json_data[SZ_ZONE_IDX] if SZ_ZONE_IDX in json_data else None
+                force_refresh = json_data["force_refresh"] if "force_refresh" in json_data else None
+                spawn_schedule_task(GET_SCHED, zone_idx=zone_idx, force_refresh=force_refresh)
+                return
+            elif command_name and command_name in SET_SCHED:
+                if SZ_SCHEDULE in json_data:
+                    spawn_schedule_task(action=SET_SCHED, zone_idx=json_data[SZ_ZONE_IDX],schedule=json_data[SZ_SCHEDULE])
+                elif "schedule_json_file" in json_data:
+                    with open(json_data["schedule_json_file"], 'r') as fp:
+                        schedule = json.load(fp)
+                    spawn_schedule_task(action=SET_SCHED, schedule=schedule)
                 else:
-                    gw_cmd = GWY.create_cmd(verb, dest_id, command_code, payload)                 # Command.from_attrs()
-                log.debug(f"--------> MQTT message converted to Command: '{gw_cmd}'")
-
-            elif "command" in json_data:
-                command_name = json_data["command"]
-                if command_name in GET_SCHED:
-                    zone_idx = json_data[SZ_ZONE_IDX] if SZ_ZONE_IDX in json_data else None
-                    force_refresh = json_data["force_refresh"] if "force_refresh" in json_data else None
-                    spawn_schedule_task(GET_SCHED, zone_idx=zone_idx, force_refresh=force_refresh)
-                    return
-                elif command_name in SET_SCHED:
-                    if SZ_SCHEDULE in json_data:
-                        spawn_schedule_task(action=SET_SCHED, zone_idx=json_data[SZ_ZONE_IDX],schedule=json_data[SZ_SCHEDULE])
-                    elif "schedule_json_file" in json_data:
-                        with open(json_data["schedule_json_file"], 'r') as fp:
-                            schedule = json.load(fp)
-                        spawn_schedule_task(action=SET_SCHED, schedule=schedule)
-                    else:
-                        log.error("'set_schedule' command requires a 'schedule' json")
-                    return
-                elif command_name and command_name == "ping":
-                    command_name = "get_system_time"
-
-                ramses_cmd_constructor = getattr(Command, command_name)
-
-
-                # ramses_cmd_kwargs = sorted(list(inspect.signature(ramses_cmd_constructor).parameters.keys()))
-                # inspect.signature not able to get args through the command constructor decorators. Try wrapper attributes
-                ramses_cmd_kwargs = sorted(list(ramses_cmd_constructor.__closure__[0].cell_contents.__annotations__))
-                kwargs = {x: json_data[x] for x in json_data if x not in "command"}
-                if ramses_cmd_kwargs and "dst_id" in ramses_cmd_kwargs and "dst_id" not in kwargs:
-                    kwargs["dst_id"] = GWY.tcs.id
-
-                # !TODO - not sure why just 'setpoint' requires this, and not others, e.g. datetime
-                if command_name == "set_zone_mode" and not "ctl_id" in kwargs:
-                    kwargs["ctl_id"] = GWY.tcs.id
-
-                try:
-                    gw_cmd = ramses_cmd_constructor(**kwargs)
-                except Exception as ex:
-                    log.error(f"Error in sending command '{msg}': {ex}")
-                    log.error(f"Command keywords: {ramses_cmd_kwargs}")
-                    log.error(f"kwargs: {kwargs}")
-                    print(traceback.format_exc())
-                    return
-            else:
-                log.error(f"Invalid mqtt payload received: '{json.dumps(json_data)}'. Either 'command' or 'code' must be specified")
+                    log.error("'set_schedule' command requires a 'schedule' json")
                 return
 
-            global LAST_SEND_MSG
-            LAST_SEND_MSG = json_data
-            log.debug(f"Sending command: {gw_cmd}")
-
-            GWY.send_cmd(gw_cmd, callback=send_command_callback)
+            try:
+                gw_cmd = build_command(json_data)
+            except ValueError as ex:
+                log.error(f"Error in sending command '{msg}': {ex}")
+                return
 
-            mqtt_publish_send_status(msg, SEND_STATUS_TRANSMITTED)
+            send_command(gw_cmd, json_data, msg)
 
     except TimeoutError:
         log.warning(f"Command '{gw_cmd if gw_cmd else msg}' failed due to time out")
@@ -1200,6 +2456,197 @@ def initialise_sys(kwargs):
     return serial_port, lib_kwargs
 
 
+async def zone_state_loop():
+    """ Publish the state document of each zone that has changed, at most every MQTT_ZONE_STATE_INTERVAL seconds """
+    while True:
+        await asyncio.sleep(max(MQTT_ZONE_STATE_INTERVAL, 1))
+        if ZONE_STATE and MQTT_CLIENT.is_connected():
+            for zone, doc in ZONE_STATE.pop_changed():
+                mqtt_publish_retained(f"{MQTT_PUB_TOPIC}/{zone}/_state", doc)
+
+
+async def rolling_stats_loop():
+    """ Publish the rolling stats of each zone and device every STATS_INTERVAL_MINS """
+    while True:
+        period_secs = max(STATS_INTERVAL_MINS, 1) * 60
+        await asyncio.sleep(period_secs)
+        # ROLLING_STATS is also kept for the thermal analytics alone, which are published by their own loop
+        if not (ROLLING_STATS and STATS_INTERVAL_MINS > 0 and MQTT_CLIENT.is_connected()):
+            continue
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%X")
+        for (scope, series_id), stats in ROLLING_STATS.aggregates(period_secs).items():
+            try:
+                topic_base = f"{MQTT_PUB_TOPIC}/{get_zone_topic_name(series_id)}" if scope == "zone" else get_device_topic_base(series_id)
+                stats["period_mins"] = STATS_INTERVAL_MINS
+                stats["timestamp"] = timestamp
+                mqtt_publish_retained(f"{topic_base}/_stats", json.dumps(stats, sort_keys=True))
+            except Exception as ex:
+                log.error(f"Exception occured publishing stats for {scope} '{series_id}': {ex}", exc_info=True)
+
+
+async def link_stats_loop():
+    """ Publish the link stats of each device, and a summary for the whole system, every LINK_STATS_INTERVAL_MINS """
+    while True:
+        await asyncio.sleep(max(LINK_STATS_INTERVAL_MINS, 1) * 60)
+        if not (LINK_STATS and MQTT_CLIENT.is_connected()):
+            continue
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%X")
+        device_stats = LINK_STATS.device_stats()
+        for device_id, stats in device_stats.items():
+            if device_id not in DEVICES:
+                # Still counted in the summary, but no topics for neighbours' devices etc
+                continue
+            try:
+                stats["timestamp"] = timestamp
+                mqtt_publish_retained(f"{get_device_topic_base(device_id)}/_link", json.dumps(stats, separators=(",", ":")))
+            except Exception as ex:
+                log.error(f"Exception occured publishing link stats for '{device_id}': {ex}", exc_info=True)
+        summary = LINK_STATS.summary(device_stats) | {"kb": round(LINK_STATS.nbytes / 1024), "timestamp": timestamp}
+        MQTT_CLIENT.publish(f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_gateway_stats/link_quality", json.dumps(summary), 0, True)
+
+
+def new_availability_tracker(settings):
+    return AvailabilityTracker(settings["AVAILABILITY_MISSED_INTERVALS"], settings["AVAILABILITY_MIN_TIMEOUT_MINS"] * 60)
+
+
+async def availability_loop():
+    """ Check the availability timer wheel every AVAILABILITY_CHECK_SECS, and publish the devices (and their zones)
+        that have gone online or offline since the last check
+    """
+    while True:
+        await asyncio.sleep(AVAILABILITY_CHECK_SECS)
+        if not AVAILABILITY:
+            continue
+        AVAILABILITY.check()
+        if not MQTT_CLIENT.is_connected():
+            # Left as changed, to be published once reconnected
+            continue
+
+        zones = set()
+        for device_id, state in AVAILABILITY.pop_changed().items():
+            if device_id not in DEVICES:
+                continue
+            try:
+                mqtt_publish_retained(f"{get_device_topic_base(device_id)}/_availability", state)
+                if DEVICES[device_id].get("zone_id"):
+                    zones.add(DEVICES[device_id]["zone_id"])
+            except Exception as ex:
+                log.error(f"Exception occured publishing availability for '{device_id}': {ex}", exc_info=True)
+
+        for zone_idx in zones:
+            # A zone is only offline once all of its (tracked) devices are
+            states = [AVAILABILITY.is_online(device_id) for device_id, device in DEVICES.items() if device.get("zone_id") == zone_idx]
+            state = SZ_OFFLINE if all(online is False for online in states) else SZ_ONLINE
+            mqtt_publish_retained(f"{MQTT_PUB_TOPIC}/{get_zone_topic_name(zone_idx)}/_availability", state)
+
+
+async def thermal_analytics_loop():
+    """ Publish the derived thermal metrics of each zone and boiler every ANALYTICS_INTERVAL_MINS """
+    while True:
+        await asyncio.sleep(max(ANALYTICS_INTERVAL_MINS, 1) * 60)
+        if not (ROLLING_STATS and ANALYTICS_INTERVAL_MINS > 0 and MQTT_CLIENT.is_connected()):
+            continue
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%X")
+        zones, boilers = thermal_analytics.compute_all(ROLLING_STATS, ANALYTICS_WINDOW_MINS * 60)
+        for zone_idx, metrics in zones.items():
+            metrics.update({"window_mins": ANALYTICS_WINDOW_MINS, "timestamp": timestamp})
+            mqtt_publish_retained(f"{MQTT_PUB_TOPIC}/{get_zone_topic_name(zone_idx)}/_analytics", json.dumps(metrics, sort_keys=True))
+        for device_id, metrics in boilers.items():
+            metrics.update({"window_mins": ANALYTICS_WINDOW_MINS, "timestamp": timestamp})
+            mqtt_publish_retained(f"{get_device_topic_base(device_id)}/_analytics", json.dumps(metrics, sort_keys=True))
+
+
+async def retained_topics_loop():
+    """ Clear any retained topics that are no longer being published, and save the registry """
+    while True:
+        await asyncio.sleep(RETAINED_GC_INTERVAL_SECS)
+        # A config reload may replace or disable the registry whilst this iteration is waiting, so it only uses its own
+        registry = RETAINED_TOPICS
+        if not registry:
+            continue
+
+        try:
+            stale = registry.stale()
+            if stale and MQTT_CLIENT.is_connected():
+                log.info(f"Clearing {len(stale)} retained topics not published in the last {MQTT_RETAINED_GRACE_DAYS} days")
+                for i in range(0, len(stale), RETAINED_GC_BATCH):
+                    await mqtt_clear_retained_topics(registry, stale[i:i + RETAINED_GC_BATCH])
+            await asyncio.get_running_loop().run_in_executor(None, registry.save)
+        except Exception as ex:
+            log.error(f"Exception occured in clearing retained topics: {ex}", exc_info=True)
+
+        MQTT_CLIENT.publish(f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_gateway_stats/retained_topics",
+            json.dumps(registry.stats()), 0, True)
+
+
+def log_loop_stall(blocked_secs, stack):
+    """ Called from the watchdog thread whilst the asyncio loop is blocked """
+    log.warning(f"asyncio loop blocked for {blocked_secs:.1f}s. Loop thread stack:\n{stack}")
+    print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] asyncio loop blocked for {blocked_secs:.1f}s (stack logged to '{EVENTS_FILE}')")
+
+
+async def restart_serial_transport():
+    """ Close and reopen the serial port, keeping all the Gateway state. Only the packet (serial) transport is
+        recreated: the message transport, and its dispatcher task (GWY.pkt_source, which the main loop waits on),
+        carry on as they are, and just send to the new packet protocol.
+    """
+    global SERIAL_RESTARTS
+    global SERIAL_RESTART_TASK
+    SERIAL_RESTARTS += 1
+    log.warning(f"No packets received for {SERIAL_SILENCE_RESTART_MINS} minutes. Restarting serial transport")
+    print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] No packets received for {SERIAL_SILENCE_RESTART_MINS} minutes. Restarting serial transport")
+
+    try:
+        if GWY.pkt_transport:
+            GWY.pkt_transport.close()
+        await asyncio.sleep(SERIAL_RESTART_DELAY)
+
+        # As in ramses_rf's Engine._start(), but without creating another dispatcher task for the message transport
+        pkt_receiver = GWY.msg_transport.get_extra_info(GWY.msg_transport.READER)
+        GWY.pkt_protocol, GWY.pkt_transport = GWY._create_pkt_stack(pkt_receiver, port_name=GWY.ser_name,
+            port_config=GWY._port_config)
+        GWY.msg_transport._dispatcher = GWY.pkt_protocol.send_data
+    except Exception as ex:
+        log.error(f"Exception occured in restarting the serial transport: {ex}", exc_info=True)
+        print_formatted_row(SYSTEM_MSG_TAG, text=f"[WARN] Unable to restart the serial transport: {ex}")
+    finally:
+        WATCHDOG.note_packet() # Restart the silence period, before any further restart
+        SERIAL_RESTART_TASK = None
+
+
+async def gateway_stats_loop():
+    """ Publish the gateway's own stats (watchdog, event stream etc), and restart the serial transport
+        if it has been silent for too long
+    """
+    global SERIAL_RESTART_TASK
+    while True:
+        await asyncio.sleep(max(WATCHDOG_PUBLISH_SECS, 1))
+        topic = f"{MQTT_PUB_TOPIC}/{MQTT_ZONE_IND_TOPIC}/_gateway_stats"
+        stats = WATCHDOG.stats() | {"serial_restarts": SERIAL_RESTARTS}
+        MQTT_CLIENT.publish(f"{topic}/watchdog", json.dumps(stats), 0, True)
+        if EVENT_STREAM:
+            MQTT_CLIENT.publish(f"{topic}/event_stream", json.dumps(EVENT_STREAM.stats()), 0, True)
+        if HISTORY:
+            HISTORY.prune()
+            MQTT_CLIENT.publish(f"{topic}/history", json.dumps(HISTORY.stats()), 0, True)
+        MQTT_CLIENT.publish(f"{topic}/rf_budget", json.dumps(RF_BUDGET.stats()), 0, True)
+        if PIPELINE:
+            MQTT_CLIENT.publish(f"{topic}/pipeline", json.dumps(PIPELINE.stats()), 0, True)
+        if PACKET_FILTER:
+            MQTT_CLIENT.publish(f"{topic}/packet_filter", json.dumps(PACKET_FILTER.stats()), 0, True)
+        if AVAILABILITY:
+            MQTT_CLIENT.publish(f"{topic}/availability", json.dumps(AVAILABILITY.stats()), 0, True)
+        if FAULT_LOG:
+            MQTT_CLIENT.publish(f"{topic}/fault_log", json.dumps(FAULT_LOG.stats()), 0, True)
+
+        if (SERIAL_SILENCE_RESTART_MINS > 0 and SERIAL_RESTART_TASK is None and GWY.ser_name
+                and stats["secs_since_last_packet"] > SERIAL_SILENCE_RESTART_MINS * 60):
+            SERIAL_RESTART_TASK = asyncio.ensure_future(restart_serial_transport())
+
+
 def show_startup_info(lib_kwargs):
     if DEVICES and len(DEVICES) >1:
         print_formatted_row("", text="")
@@ -1230,26 +2677,115 @@ def show_startup_info(lib_kwargs):
 async def main(**kwargs):
     serial_port, lib_kwargs = initialise_sys(kwargs)
 
+    global ZONE_STATE
+    if MQTT_PUB_ZONE_STATE:
+        ZONE_STATE = ZoneStateAggregator()
+
+    if MQTT_WARM_START:
+        # Before the pipeline workers are forked, so that they get the last values too
+        mqtt_warm_start()
+
+    global PIPELINE
+    if PIPELINE_WORKERS > 0:
+        # Forked before any other threads are started, i.e. the MQTT client loop and ramses_rf
+        PIPELINE = ProcessPipeline(PIPELINE_WORKERS, pipeline_worker_init, pipeline_worker_handle, pipeline_worker_finish, log)
+        PIPELINE.start()
+
+    global PACKET_ARCHIVE
+    if PACKET_ARCHIVE_DIR:
+        PACKET_ARCHIVE = PacketArchive(PACKET_ARCHIVE_DIR, PACKET_ARCHIVE_RETENTION_DAYS)
+
+    global PACKET_FILTER
+    PACKET_FILTER = new_packet_filter(PACKET_FILTER_RULES)
+
+    global TOPIC_TEMPLATES
+    TOPIC_TEMPLATES = new_topic_templates(MQTT_TOPIC_TEMPLATES, MQTT_GROUP_BY_ZONE)
+
     global GWY
     GWY = Gateway(serial_port, **lib_kwargs)
     GWY.create_client(process_gwy_message)
 
+    # SIGHUP reloads the config file, as with most daemons
+    asyncio.get_running_loop().add_signal_handler(SIGHUP, reload_config)
+
     update_devices_from_gwy()
     update_zones_from_gwy()
     mqtt_publish_schema()
     show_startup_info(lib_kwargs)
 
+    global WATCHDOG
+    WATCHDOG = LoopWatchdog(lag_threshold=WATCHDOG_LAG_THRESHOLD_MS / 1000, on_stall=log_loop_stall)
+    WATCHDOG.start(asyncio.get_running_loop())
+
+    global RF_BUDGET
+    RF_BUDGET = RfBudget(RF_BUDGET_PER_MIN, RF_BUDGET_BURST)
+
+    global RETAINED_TOPICS
+    if MQTT_RETAINED_GRACE_DAYS > 0:
+        RETAINED_TOPICS = RetainedTopicRegistry(RETAINED_TOPICS_FILE, MQTT_RETAINED_GRACE_DAYS, log)
+
+    global ROLLING_STATS
+    if STATS_INTERVAL_MINS > 0 or ANALYTICS_INTERVAL_MINS > 0:
+        # The thermal analytics are computed from the rolling stats buffers
+        ROLLING_STATS = RollingStats(STATS_WINDOW_SAMPLES)
+
+    global LINK_STATS
+    if LINK_STATS_INTERVAL_MINS > 0:
+        LINK_STATS = LinkStats(LINK_STATS_SAMPLES)
+
+    global FAULT_LOG
+    if FAULT_LOG_FILE:
+        FAULT_LOG = FaultLog(FAULT_LOG_FILE, log=log)
+
+    global AVAILABILITY
+    if AVAILABILITY_TRACKING:
+        AVAILABILITY = new_availability_tracker(CONFIG_SETTINGS)
+
+    global HISTORY
+    if HISTORY_DAYS > 0:
+        HISTORY = HistoryStore(HISTORY_DAYS, HISTORY_SAMPLES_PER_KEY, HISTORY_MEMORY_MB)
+
+    global EVENT_STREAM
+    if EVENT_STREAM_SOCKET:
+        EVENT_STREAM = EventStreamServer(EVENT_STREAM_SOCKET, EVENT_STREAM_BUFFER, log)
+        await EVENT_STREAM.start()
+
     try:
         MQTT_CLIENT.loop_start()
         await GWY.start()
+        stats_task = asyncio.ensure_future(gateway_stats_loop())
+        zone_state_task = asyncio.ensure_future(zone_state_loop())
+        rolling_stats_task = asyncio.ensure_future(rolling_stats_loop())
+        analytics_task = asyncio.ensure_future(thermal_analytics_loop())
+        link_stats_task = asyncio.ensure_future(link_stats_loop())
+        availability_task = asyncio.ensure_future(availability_loop())
+        fault_log_task = asyncio.ensure_future(fault_log_loop())
+        retained_topics_task = asyncio.ensure_future(retained_topics_loop())
+
         await GWY.pkt_source
+
+        stats_task.cancel()
+        zone_state_task.cancel()
+        rolling_stats_task.cancel()
+        analytics_task.cancel()
+        link_stats_task.cancel()
+        availability_task.cancel()
+        fault_log_task.cancel()
+        retained_topics_task.cancel()
     except Exception as ex:
         msg = f" - ended via: Exception: {ex}"
     else:  # if no Exceptions raised, e.g. EOF when parsing
         msg = " - ended without error (e.g. EOF)"
 
     mqtt_publish_schema()
+    if PIPELINE:
+        PIPELINE.close()
     MQTT_CLIENT.loop_stop()
+    WATCHDOG.stop()
+    if EVENT_STREAM:
+        EVENT_STREAM.close()
+    if RETAINED_TOPICS:
+        RETAINED_TOPICS.save()
 
 
 if __name__ == "__main__":
@@ -1266,6 +2802,9 @@ if __name__ == "__main__":
     else:  # if no Exceptions raised, e.g. EOF when parsing
         msg = " - ended without error (e.g. EOF)"
 
+    if PACKET_ARCHIVE:
+        PACKET_ARCHIVE.close()
+
     if GWY:
         # Always update the zones file on exit
         save_zones()
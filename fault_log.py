@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+""" Local copy of the controller's fault log, persisted to a json file, and refreshed incrementally.
+
+    The controller keeps its log newest first, i.e. a new fault is log_idx 00 and the older entries all move up one,
+    so the entries already held only need to be found again, not re-read. A refresh reads log_idx 00 and, if that is
+    the newest entry already held, stops there: a single frame. Otherwise it reads on (up to 'concurrency' entries at
+    a time) until it reaches the newest entry held, or the end of the log. If it reaches the end without finding it
+    (e.g. the log has been cleared, or the controller replaced), the entries read replace those held.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+MAX_ENTRIES = 64    # log_idx 00 to 3F
+
+
+class FaultLog():
+    ''' The fault log entries (each as the list of fields ramses_rf decodes), newest first '''
+    def __init__(self, file_path, max_entries=MAX_ENTRIES, log=None):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.log = log
+        self.entries = []
+        self.updated = None
+        self.refreshes = 0
+        self.frames = 0
+        self._lock = asyncio.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path, "r") as fp:
+                data = json.load(fp)
+            self.entries = [list(entry) for entry in data.get("entries", [])][:self.max_entries]
+            self.updated = data.get("updated")
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            if self.log:
+                self.log.error(f"Exception occured loading the fault log from '{self.file_path}', starting afresh: {ex}", exc_info=True)
+
+    def save(self):
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w") as fp:
+            json.dump({"entries": self.entries, "updated": self.updated}, fp)
+        os.replace(temp_path, self.file_path)
+
+    @property
+    def refreshing(self):
+        return self._lock.locked()
+
+    async def refresh(self, fetch, concurrency=3):
+        """ Read the entries added since the last refresh. fetch(log_idx) is a coroutine returning the entry at
+            log_idx (None if there is none), and raising if it could not be read, in which case nothing is changed.
+            Returns (the new entries, newest first, frames used)
+        """
+        async with self._lock:
+            head = self.entries[0] if self.entries else None
+            fetched, frames, found_head = [], 0, False
+            log_idx, window = 0, 1     # Just log_idx 00 at first, as there is usually nothing new
+            while log_idx < self.max_entries:
+                indexes = range(log_idx, min(log_idx + window, self.max_entries))
+                results = await asyncio.gather(*(fetch(i) for i in indexes))
+                frames += len(indexes)
+                for entry in results:
+                    if entry is None or entry == head:
+                        found_head = entry is not None
+                        break
+                    fetched.append(entry)
+                else:
+                    log_idx += len(indexes)
+                    window = max(concurrency, 1)
+                    continue
+                break
+
+            if found_head or head is None:
+                new_entries = fetched
+                self.entries = (fetched + self.entries)[:self.max_entries]
+            else:
+                known = {json.dumps(entry) for entry in self.entries}
+                new_entries = [entry for entry in fetched if json.dumps(entry) not in known]
+                self.entries = fetched
+
+            self.refreshes += 1
+            self.frames += frames
+            self.updated = time.time()
+            self.save()
+            return new_entries, frames
+
+    def document(self):
+        """ The whole log, for publishing """
+        return {"entries": [{"log_idx": f"{i:02X}", "entry": entry} for i, entry in enumerate(self.entries)],
+            "count": len(self.entries), "updated": round(self.updated) if self.updated else None}
+
+    def stats(self):
+        return {"entries": len(self.entries), "refreshes": self.refreshes, "frames": self.frames,
+            "frames_per_refresh": round(self.frames / self.refreshes, 1) if self.refreshes else None}
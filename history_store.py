@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+""" In-memory history of the numeric values published by evoGateway, keyed by topic (relative to MQTT_PUB_TOPIC).
+
+    Each key has a fixed capacity ring buffer, and the number of keys is limited by a memory budget, with the
+    least recently updated keys dropped first once the budget is reached.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from paho.mqtt.client import topic_matches_sub
+
+from ring_buffer import RingBuffer, decimate
+
+
+class HistoryStore():
+    ''' Ring buffer per topic key, under an overall memory budget '''
+    def __init__(self, max_days=7, samples_per_key=2016, memory_budget_mb=16):
+        self.max_days = max_days
+        self.samples_per_key = samples_per_key
+        self.max_keys = max(int(memory_budget_mb * 1024 * 1024 / (16 * samples_per_key)), 1)
+        self.series = OrderedDict()     # least recently updated first
+        self.dropped_keys = 0
+        self._lock = Lock()
+
+    def add(self, key, value, timestamp=None):
+        """ Add a value for the given key. Only int/float values are kept (bools are not history) """
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        timestamp = timestamp or time.time()
+        with self._lock:
+            buffer = self.series.get(key)
+            if buffer is None:
+                while len(self.series) >= self.max_keys:
+                    self.series.popitem(last=False)
+                    self.dropped_keys += 1
+                buffer = self.series[sys.intern(key)] = RingBuffer(self.samples_per_key)
+            else:
+                self.series.move_to_end(key)
+            buffer.append(timestamp, value)
+
+    def prune(self):
+        """ Drop keys with no values within max_days """
+        cutoff = time.time() - self.max_days * 86400
+        with self._lock:
+            for key in [k for k, buffer in self.series.items() if buffer.latest()[0] < cutoff]:
+                del self.series[key]
+
+    def keys(self, pattern):
+        """ Keys matching an MQTT style topic pattern, i.e. with + and # wildcards """
+        with self._lock:
+            return [k for k in self.series if k == pattern or topic_matches_sub(pattern, k)]
+
+    def query(self, key, since=None, until=None, points=200):
+        """ (times, values) for the key between since and until (epoch seconds), decimated to at most 'points' """
+        earliest = time.time() - self.max_days * 86400
+        since = max(since, earliest) if since else earliest
+        with self._lock:
+            buffer = self.series.get(key)
+            if buffer is None:
+                return [], []
+            times, values = buffer.between(since, until)
+        return decimate(times, values, points)
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self.series), "max_keys": self.max_keys, "dropped_keys": self.dropped_keys,
+                "samples": sum(len(b) for b in self.series.values()),
+                "memory_kb": round(sum(b.nbytes for b in self.series.values()) / 1024)}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+""" Per-device RF link quality, from the RSSI and arrival time of every packet received from each device.
+
+    Each device has a ring buffer of (arrival time, RSSI) samples, so memory is fixed per device, and the number of
+    devices is capped (the least recently heard from is dropped to make room). Recording a packet is just a couple of
+    array stores and a string compare; the RSSI spread, packet rate and inter-arrival gaps are only worked out when
+    the stats are published.
+
+    RSSI is as reported by the HGI80/evofw3, i.e. the magnitude of the dBm value, so higher is a weaker signal.
+"""
+
+import statistics
+import time
+from bisect import bisect_left
+
+from ring_buffer import RingBuffer, summarise
+
+DUPLICATE_SECS  = 2     # The same frame again within this time is a duplicate (i.e. a repeat we also heard)
+LONG_GAP_FACTOR = 3     # A gap this many times the device's median gap is counted as missed packets
+WEAKEST_COUNT   = 5
+
+
+class DeviceLink():
+    ''' Link stats for one device '''
+    __slots__ = ("samples", "packets", "duplicates", "first_seen", "last_seen", "last_frame")
+
+    def __init__(self, capacity, timestamp):
+        self.samples = RingBuffer(capacity)
+        self.packets = 0
+        self.duplicates = 0
+        self.first_seen = timestamp
+        self.last_seen = 0.0
+        self.last_frame = None
+
+    def stats(self, now):
+        times, values = self.samples.ordered()
+        rssi = summarise(received_rssi(values), 1)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        doc = {"packets": self.packets, "duplicates": self.duplicates, "rssi": rssi,
+            "last_seen": round(now - self.last_seen), "samples": len(times)}
+
+        # Rate over the last hour, or over the samples held if they do not go back that far
+        window = min(3600, now - times[0]) if times else 0
+        recent = len(times) - bisect_left(times, now - window)
+        doc["packets_per_hour"] = round(recent * 3600 / window, 1) if window >= 60 else None
+
+        if gaps:
+            median = statistics.median(gaps)
+            doc["gap_secs"] = {"median": round(median, 1), "mean": round(sum(gaps) / len(gaps), 1), "max": round(max(gaps), 1)}
+            doc["long_gaps"] = sum(1 for gap in gaps if gap > median * LONG_GAP_FACTOR) if median > 0 else 0
+        return doc
+
+
+def received_rssi(values):
+    # RSSI 0 is the HGI80's echo of a packet we sent, rather than a received signal
+    return [value for value in values if value]
+
+
+class LinkStats():
+    ''' {device_id: DeviceLink}, capped at max_devices '''
+    def __init__(self, samples_per_device=256, max_devices=500):
+        self.samples_per_device = samples_per_device
+        self.max_devices = max_devices
+        self.devices = {}
+        self.evicted = 0
+
+    def add(self, device_id, rssi, frame=None, timestamp=None):
+        """ Record a packet received from the device. rssi is the string from the packet, e.g. '045' """
+        timestamp = timestamp or time.time()
+        link = self.devices.get(device_id)
+        if link is None:
+            if len(self.devices) >= self.max_devices:
+                del self.devices[min(self.devices, key=lambda k: self.devices[k].last_seen)]
+                self.evicted += 1
+            link = self.devices[device_id] = DeviceLink(self.samples_per_device, timestamp)
+
+        if frame is not None and frame == link.last_frame and timestamp - link.last_seen < DUPLICATE_SECS:
+            link.duplicates += 1
+        link.last_frame = frame
+        link.packets += 1
+        link.last_seen = timestamp
+        link.samples.append(timestamp, int(rssi) if rssi and rssi.isdigit() else 0)
+
+    def device_stats(self, now=None):
+        """ {device_id: stats document} """
+        now = now or time.time()
+        return {device_id: link.stats(now) for device_id, link in list(self.devices.items())}
+
+    def summary(self, device_stats):
+        """ House-wide summary, from the device_stats() documents """
+        with_rssi = {k: v for k, v in device_stats.items() if v["rssi"]}
+        weakest = sorted(with_rssi, key=lambda k: with_rssi[k]["rssi"]["mean"], reverse=True)[:WEAKEST_COUNT]
+        most_gaps = sorted((k for k, v in device_stats.items() if v.get("long_gaps")),
+            key=lambda k: device_stats[k]["long_gaps"], reverse=True)[:WEAKEST_COUNT]
+        rates = [v["packets_per_hour"] for v in device_stats.values() if v["packets_per_hour"] is not None]
+        return {"devices": len(device_stats), "evicted": self.evicted,
+            "packets_per_hour": round(sum(rates), 1),
+            "rssi_mean": round(sum(v["rssi"]["mean"] for v in with_rssi.values()) / len(with_rssi), 1) if with_rssi else None,
+            "weakest": {k: with_rssi[k]["rssi"]["mean"] for k in weakest},
+            "most_long_gaps": {k: device_stats[k]["long_gaps"] for k in most_gaps},
+            "duplicates": sum(v["duplicates"] for v in device_stats.values())}
+
+    @property
+    def nbytes(self):
+        return sum(link.samples.nbytes for link in self.devices.values())
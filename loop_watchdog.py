@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+""" Event loop lag and serial silence watchdog for evoGateway.
+
+    An asyncio task samples how late the loop wakes from a fixed sleep (i.e. the loop lag). A separate thread
+    watches the task's heartbeat, so that if the loop is blocked, the stack of the blocking code can be captured
+    whilst it is still running (the loop itself cannot report on this until it is unblocked).
+"""
+
+import asyncio
+import sys
+import time
+import traceback
+from threading import Thread, Event, get_ident
+
+MIN_LAG_THRESHOLD   = 0.1   # Secs. The monitor thread wakes every half threshold, so it must not spin
+
+
+class LoopWatchdog():
+    ''' Samples event loop lag and tracks the time since the last received packet. '''
+    def __init__(self, interval=1.0, lag_threshold=0.5, on_stall=None):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.on_stall = on_stall            # on_stall(blocked_secs, stack_text), called from the watchdog thread
+        self.last_packet = time.monotonic()
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._lag_max = 0.0
+        self._lag_total = 0.0
+        self._lag_samples = 0
+        self._loop_thread_id = None
+        self._task = None
+        self._stopped = Event()
+
+    @property
+    def lag_threshold(self):
+        return self._lag_threshold
+
+    @lag_threshold.setter
+    def lag_threshold(self, secs):
+        self._lag_threshold = max(secs, MIN_LAG_THRESHOLD)
+
+    def start(self, loop):
+        """ Start sampling. Must be called from the thread running the loop. """
+        self._loop_thread_id = get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = loop.create_task(self._sample_lag())
+        Thread(target=self._monitor, name="loop_watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    def note_packet(self):
+        self.last_packet = time.monotonic()
+
+    def secs_since_last_packet(self):
+        return time.monotonic() - self.last_packet
+
+    async def _sample_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.monotonic()
+            lag = max(self._heartbeat - started - self.interval, 0.0)
+            self._lag_max = max(self._lag_max, lag)
+            self._lag_total += lag
+            self._lag_samples += 1
+
+    def _monitor(self):
+        stall_reported = False
+        while not self._stopped.wait(self.lag_threshold / 2):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked <= self.lag_threshold:
+                stall_reported = False
+            elif not stall_reported:
+                # Only one snapshot per stall, taken whilst the offending code is still on the loop's stack
+                stall_reported = True
+                self.stalls += 1
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<loop thread stack not available>"
+                if self.on_stall:
+                    self.on_stall(blocked, stack)
+
+    def stats(self, reset=True):
+        """ Loop lag since the last call (if reset), and the time since the last packet """
+        stats = {
+            "loop_lag_max_ms": round(self._lag_max * 1000, 1),
+            "loop_lag_mean_ms": round(self._lag_total / self._lag_samples * 1000, 1) if self._lag_samples else None,
+            "loop_stalls": self.stalls,
+            "secs_since_last_packet": round(self.secs_since_last_packet(), 1),
+        }
+        if reset:
+            self._lag_max, self._lag_total, self._lag_samples = 0.0, 0.0, 0
+        return stats
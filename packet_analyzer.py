@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Offline analyzer for evoGateway/ramses_rf packet logs.
+
+    Parses any number of (rotated, optionally gzipped) packet log files in parallel across a process pool,
+    using the ramses_rf packet parser, and writes per-device, per-code and RSSI aggregates as CSV (or
+    Parquet, if pyarrow is installed). e.g.
+
+        python3 packet_analyzer.py --out-dir analysis packet.log*
+"""
+
+import argparse
+import configparser
+import csv
+import glob
+import gzip
+import math
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime as dt
+
+from ramses_rf.protocol.exceptions import EvohomeError
+from ramses_rf.protocol.packet import Packet
+
+CONFIG_FILE         = "evogateway.cfg"
+DTM_LENGTH          = 26                # i.e. len("2021-05-20T12:34:56.123456")
+GAP_BUCKETS         = 24                # gap histogram buckets are powers of 2 seconds, i.e. up to ~97 days
+MISSED_GAP_FACTOR   = 1.5               # gaps longer than this multiple of the typical interval count as missed packets
+
+DEVICE_COLUMNS      = ["device_id", "packets", "invalid", "first_dtm", "last_dtm", "packets_per_hour",
+                        "rssi_min", "rssi_mean", "rssi_max", "max_gap_secs", "est_missed"]
+CODE_COLUMNS        = ["device_id", "code", "verb", "packets", "packets_per_hour", "typical_gap_secs", "max_gap_secs", "est_missed"]
+RSSI_COLUMNS        = ["device_id", "rssi", "packets"]
+
+
+def open_log_file(file_name):
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, "rt", errors="replace")
+    return open(file_name, "r", errors="replace")
+
+
+def gap_bucket(gap_secs):
+    return min(int(math.log2(gap_secs)) if gap_secs >= 1 else 0, GAP_BUCKETS - 1)
+
+
+def analyze_file(file_name):
+    """ Parse a single packet log file, returning its aggregates.
+        Runs in a worker process, so only returns plain (picklable) types.
+    """
+    devices = {}
+    codes = {}
+    invalid = Counter()
+
+    with open_log_file(file_name) as fp:
+        for line in fp:
+            line = line.rstrip()
+            if len(line) <= DTM_LENGTH or line.startswith("#"):
+                continue
+            try:
+                pkt = Packet.from_file(None, line[:DTM_LENGTH], line[DTM_LENGTH + 1:])
+                src_id = pkt.src.id
+                code = pkt.code
+                verb = pkt.verb.strip()
+                secs = pkt.dtm.timestamp()
+            except (EvohomeError, ValueError, AttributeError, IndexError):
+                invalid[line[DTM_LENGTH + 12:DTM_LENGTH + 21]] += 1      # the src device id column, if any
+                continue
+
+            dev = devices.get(src_id)
+            if dev is None:
+                dev = devices[src_id] = {"packets": 0, "first": secs, "last": secs, "max_gap": 0.0, "rssi": Counter()}
+            else:
+                dev["max_gap"] = max(dev["max_gap"], secs - dev["last"])
+            dev["packets"] += 1
+            dev["last"] = secs
+            if pkt._rssi and pkt._rssi.isdigit():
+                dev["rssi"][int(pkt._rssi)] += 1
+
+            key = (src_id, code, verb)
+            c = codes.get(key)
+            if c is None:
+                c = codes[key] = {"packets": 0, "first": secs, "last": secs, "gaps": [0] * GAP_BUCKETS}
+            else:
+                c["gaps"][gap_bucket(secs - c["last"])] += 1
+            c["packets"] += 1
+            c["last"] = secs
+
+    return file_name, devices, codes, invalid
+
+
+class PacketLogAggregates():
+    ''' Merged aggregates across all the analyzed files. Files are merged as they complete, in any order. '''
+    def __init__(self):
+        self.devices = {}
+        self.codes = {}
+        self.invalid = Counter()
+        # (first, last) per file for each device/code, so that gaps across file boundaries can be added at the end
+        self.device_spans = defaultdict(list)
+        self.code_spans = defaultdict(list)
+        self.files = 0
+
+    def merge(self, devices, codes, invalid):
+        self.files += 1
+        self.invalid.update(invalid)
+        for device_id, d in devices.items():
+            self.device_spans[device_id].append((d["first"], d["last"]))
+            agg = self.devices.get(device_id)
+            if agg is None:
+                self.devices[device_id] = d
+            else:
+                agg["packets"] += d["packets"]
+                agg["first"] = min(agg["first"], d["first"])
+                agg["last"] = max(agg["last"], d["last"])
+                agg["max_gap"] = max(agg["max_gap"], d["max_gap"])
+                agg["rssi"].update(d["rssi"])
+
+        for key, c in codes.items():
+            self.code_spans[key].append((c["first"], c["last"]))
+            agg = self.codes.get(key)
+            if agg is None:
+                self.codes[key] = c
+            else:
+                agg["packets"] += c["packets"]
+                agg["first"] = min(agg["first"], c["first"])
+                agg["last"] = max(agg["last"], c["last"])
+                agg["gaps"] = [a + b for a, b in zip(agg["gaps"], c["gaps"])]
+
+    def _add_boundary_gaps(self):
+        for device_id, spans in self.device_spans.items():
+            spans.sort()
+            for (_, prev_last), (next_first, _) in zip(spans, spans[1:]):
+                gap = next_first - prev_last
+                self.devices[device_id]["max_gap"] = max(self.devices[device_id]["max_gap"], gap)
+
+        for key, spans in self.code_spans.items():
+            spans.sort()
+            for (_, prev_last), (next_first, _) in zip(spans, spans[1:]):
+                self.codes[key]["gaps"][gap_bucket(next_first - prev_last)] += 1
+
+    def rows(self):
+        """ Return the device, code and rssi rows, each as a list of dicts """
+        self._add_boundary_gaps()
+
+        code_rows = []
+        missed_by_device = Counter()
+        for (device_id, code, verb), c in sorted(self.codes.items()):
+            gaps = c["gaps"]
+            typical_gap, max_gap, missed = None, None, 0
+            if sum(gaps):
+                # Typical interval is the median gap bucket; each longer gap counts the intervals it should have had
+                half, running = sum(gaps) / 2, 0
+                for bucket, count in enumerate(gaps):
+                    running += count
+                    if running >= half:
+                        typical_gap = 2 ** bucket
+                        break
+                max_gap = 2 ** max(b for b, count in enumerate(gaps) if count)
+                for bucket, count in enumerate(gaps):
+                    if count and 2 ** bucket > typical_gap * MISSED_GAP_FACTOR:
+                        missed += count * max(int(2 ** bucket / typical_gap) - 1, 0)
+            missed_by_device[device_id] += missed
+            code_rows.append({"device_id": device_id, "code": code, "verb": verb, "packets": c["packets"],
+                "packets_per_hour": packets_per_hour(c["packets"], c["first"], c["last"]),
+                "typical_gap_secs": typical_gap, "max_gap_secs": max_gap, "est_missed": missed})
+
+        device_rows = []
+        rssi_rows = []
+        for device_id, d in sorted(self.devices.items()):
+            rssi = d["rssi"]
+            rssi_count = sum(rssi.values())
+            device_rows.append({"device_id": device_id, "packets": d["packets"], "invalid": self.invalid.get(device_id, 0),
+                "first_dtm": dt.fromtimestamp(d["first"]).isoformat(), "last_dtm": dt.fromtimestamp(d["last"]).isoformat(),
+                "packets_per_hour": packets_per_hour(d["packets"], d["first"], d["last"]),
+                "rssi_min": min(rssi) if rssi else None,
+                "rssi_mean": round(sum(k * v for k, v in rssi.items()) / rssi_count, 1) if rssi_count else None,
+                "rssi_max": max(rssi) if rssi else None,
+                "max_gap_secs": round(d["max_gap"]), "est_missed": missed_by_device[device_id]})
+            rssi_rows.extend({"device_id": device_id, "rssi": k, "packets": v} for k, v in sorted(rssi.items()))
+
+        return device_rows, code_rows, rssi_rows
+
+
+def packets_per_hour(packets, first, last):
+    hours = (last - first) / 3600
+    return round(packets / hours, 2) if hours > 0 else None
+
+
+def write_rows(rows, columns, file_name, out_format):
+    if out_format == "parquet":
+        import pyarrow as pa                # optional dependency, only needed for parquet output
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist(rows, schema=None) if rows else pa.table({c: [] for c in columns})
+        pq.write_table(table, f"{file_name}.parquet")
+    else:
+        with open(f"{file_name}.csv", "w", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def get_default_log_files():
+    """ Default to the packet log file (and its rotations) as given in the evogateway config file """
+    config = configparser.RawConfigParser()
+    config.read(CONFIG_FILE)
+    packet_log_file = config.get("Files", "PACKET_LOG_FILE", fallback="packet.log")
+    return [packet_log_file] + sorted(glob.glob(f"{packet_log_file}.*"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze evoGateway/ramses_rf packet log files")
+    parser.add_argument("files", nargs="*", help="Packet log files or glob patterns (default: PACKET_LOG_FILE and its rotations)")
+    parser.add_argument("-o", "--out-dir", default=".", help="Directory for the output files")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("-f", "--format", choices=["csv", "parquet"], default="csv", help="Output file format")
+    args = parser.parse_args(argv)
+
+    patterns = args.files if args.files else get_default_log_files()
+    files = sorted({f for p in patterns for f in glob.glob(p) if os.path.isfile(f)})
+    if not files:
+        print("No packet log files found")
+        return 1
+
+    # Largest files first, so that the pool is not left waiting on one big file at the end
+    files.sort(key=os.path.getsize, reverse=True)
+
+    started = time.time()
+    aggregates = PacketLogAggregates()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(analyze_file, f) for f in files]
+        for future in as_completed(futures):
+            try:
+                file_name, devices, codes, invalid = future.result()
+            except Exception as ex:
+                print(f"Failed to analyze file: {ex}")
+                continue
+            aggregates.merge(devices, codes, invalid)
+            print(f"[{aggregates.files}/{len(files)}] {file_name}", file=sys.stderr)
+
+    device_rows, code_rows, rssi_rows = aggregates.rows()
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_rows(device_rows, DEVICE_COLUMNS, os.path.join(args.out_dir, "devices"), args.format)
+    write_rows(code_rows, CODE_COLUMNS, os.path.join(args.out_dir, "codes"), args.format)
+    write_rows(rssi_rows, RSSI_COLUMNS, os.path.join(args.out_dir, "rssi"), args.format)
+
+    print(f"Analyzed {len(files)} files, {sum(d['packets'] for d in device_rows)} packets from {len(device_rows)} devices "
+        f"in {time.time() - started:.1f}s. Output written to '{args.out_dir}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+""" Time partitioned, compressed archive of received packets, with a sidecar index per segment.
+
+    Packets are written as packet log lines to hourly gzip segments (<archive_dir>/YYYY-MM-DD/HH.log.gz). Each
+    segment has a small json index (HH.idx.json) of the devices and codes it holds, so that a query only needs to
+    decompress the segments that can contain matching packets. Segments older than the retention period are removed.
+
+    Can also be run from the command line to query the archive, e.g.
+
+        python3 packet_archive.py --device 04:123456 --code 30C9 --since 2021-05-20T00:00 --until 2021-05-21T00:00
+"""
+
+import argparse
+import configparser
+import gzip
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime as dt, timedelta as td
+from threading import RLock
+
+CONFIG_FILE             = "evogateway.cfg"
+SEGMENT_SUFFIX          = ".log.gz"
+INDEX_SUFFIX            = ".idx.json"
+DTM_LENGTH              = 26                # i.e. len("2021-05-20T12:34:56.123456")
+FLUSH_INTERVAL_SECS     = 30
+
+
+def segment_key(dtm):
+    """ The (day directory, hour) partition for a given datetime """
+    return f"{dtm:%Y-%m-%d}", f"{dtm:%H}"
+
+
+def parse_dtm(value):
+    if value is None or isinstance(value, dt):
+        return value
+    return dt.fromisoformat(str(value).strip())
+
+
+class PacketArchive():
+    ''' Append-only packet archive. add() is called from the asyncio loop; query() may be called from any thread. '''
+    def __init__(self, archive_dir, retention_days=90):
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self._lock = RLock()
+        self._key = None
+        self._fp = None
+        self._index = None
+        self._last_flush = 0
+        os.makedirs(archive_dir, exist_ok=True)
+        self.prune()
+
+    def _paths(self, key):
+        day, hour = key
+        return (os.path.join(self.archive_dir, day, f"{hour}{SEGMENT_SUFFIX}"),
+                os.path.join(self.archive_dir, day, f"{hour}{INDEX_SUFFIX}"))
+
+    def _open_segment(self, key):
+        self._close_segment()
+        segment_path, index_path = self._paths(key)
+        os.makedirs(os.path.dirname(segment_path), exist_ok=True)
+        # Appending to an existing segment (e.g. after a restart) just adds another gzip member
+        self._index = load_index(index_path) if os.path.isfile(segment_path) else None
+        if not self._index:
+            self._index = {"first": None, "last": None, "count": 0, "devices": {}, "codes": {}}
+        self._fp = gzip.open(segment_path, "at", encoding="utf-8")
+        self._key = key
+
+    def _close_segment(self):
+        if self._fp:
+            self._fp.close()
+            self._write_index()
+            self._fp = None
+            self._key = None
+            self.prune()
+
+    def _write_index(self):
+        _, index_path = self._paths(self._key)
+        with open(f"{index_path}.tmp", "w") as fp:
+            json.dump(self._index, fp)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def add(self, dtm, frame, src_id, dst_id, code):
+        """ Archive a received packet. frame is the packet log line without the dtm, i.e. the rssi and then the frame
+            (e.g. '045  I --- 04:123456 --:------ 01:123456 30C9 003 0007D0')
+        """
+        with self._lock:
+            key = segment_key(dtm)
+            if key != self._key:
+                self._open_segment(key)
+
+            ts = dtm.isoformat(timespec="microseconds")
+            self._fp.write(f"{ts} {frame}\n")
+
+            index = self._index
+            index["count"] += 1
+            index["first"] = index["first"] or ts
+            index["last"] = ts
+            for device_id in (src_id, dst_id) if src_id != dst_id else (src_id,):
+                entry = index["devices"].get(device_id)
+                if entry:
+                    entry[0] += 1
+                    entry[2] = ts
+                else:
+                    index["devices"][device_id] = [1, ts, ts]
+            index["codes"][code] = index["codes"].get(code, 0) + 1
+
+            now = time.monotonic()
+            if now - self._last_flush > FLUSH_INTERVAL_SECS:
+                self.flush()
+                self._last_flush = now
+
+    def flush(self):
+        with self._lock:
+            if self._fp:
+                self._fp.flush()
+                self._write_index()
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def prune(self):
+        """ Remove day directories that are entirely older than the retention period """
+        if not self.retention_days or self.retention_days <= 0:
+            return
+        cutoff = f"{dt.now() - td(days=self.retention_days):%Y-%m-%d}"
+        for day in os.listdir(self.archive_dir):
+            if day < cutoff and os.path.isdir(os.path.join(self.archive_dir, day)):
+                shutil.rmtree(os.path.join(self.archive_dir, day), ignore_errors=True)
+
+    def segments(self, since=None, until=None):
+        """ Yield the (day, hour) keys of the segments that overlap the given time range, oldest first """
+        since_key = segment_key(since) if since else None
+        until_key = segment_key(until) if until else None
+        for day in sorted(os.listdir(self.archive_dir)):
+            if (since_key and day < since_key[0]) or (until_key and day > until_key[0]):
+                continue
+            day_dir = os.path.join(self.archive_dir, day)
+            if not os.path.isdir(day_dir):
+                continue
+            for f in sorted(os.listdir(day_dir)):
+                if f.endswith(SEGMENT_SUFFIX):
+                    key = (day, f[:-len(SEGMENT_SUFFIX)])
+                    if (since_key and key < since_key) or (until_key and key > until_key):
+                        continue
+                    yield key
+
+    def query(self, device_id=None, code=None, since=None, until=None, limit=None):
+        """ Yield the archived packet log lines matching all of the given filters, oldest first """
+        since, until = parse_dtm(since), parse_dtm(until)
+        since_ts = since.isoformat(timespec="microseconds") if since else None
+        until_ts = until.isoformat(timespec="microseconds") if until else None
+        code = code.upper() if code else None
+        count = 0
+
+        for key in self.segments(since, until):
+            segment_path, index_path = self._paths(key)
+            with self._lock:
+                if key == self._key:
+                    self.flush()
+                    index = self._index
+                else:
+                    index = load_index(index_path)
+
+            # The index lets us skip segments without the device/code. Segments without an index are always scanned.
+            if index:
+                if device_id and device_id not in index["devices"]:
+                    continue
+                if code and code not in index["codes"]:
+                    continue
+                if (since_ts and index["last"] and index["last"] < since_ts) or (until_ts and index["first"] and index["first"] > until_ts):
+                    continue
+
+            for line in read_segment(segment_path):
+                ts = line[:DTM_LENGTH]
+                if (since_ts and ts < since_ts) or (until_ts and ts > until_ts):
+                    continue
+                if device_id and device_id not in line[DTM_LENGTH + 12:DTM_LENGTH + 42]:
+                    continue
+                if code and line[DTM_LENGTH + 42:DTM_LENGTH + 46] != code:
+                    continue
+                yield line
+                count += 1
+                if limit and count >= limit:
+                    return
+
+
+def load_index(index_path):
+    try:
+        with open(index_path, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def read_segment(segment_path):
+    """ Yield the lines of a segment. The segment being written has no gzip trailer yet, which is not an error here. """
+    try:
+        with gzip.open(segment_path, "rt", encoding="utf-8", errors="replace") as fp:
+            for line in fp:
+                yield line.rstrip("\n")
+    except EOFError:
+        pass
+
+
+def main(argv=None):
+    config = configparser.RawConfigParser()
+    config.read(CONFIG_FILE)
+
+    parser = argparse.ArgumentParser(description="Query the evoGateway packet archive")
+    parser.add_argument("--archive-dir", default=config.get("Files", "PACKET_ARCHIVE_DIR", fallback=None),
+        help="Archive directory (default: PACKET_ARCHIVE_DIR from the evogateway config file)")
+    parser.add_argument("-d", "--device", help="Device ID, as source or destination, e.g. 04:123456")
+    parser.add_argument("-c", "--code", help="Packet code, e.g. 30C9")
+    parser.add_argument("-s", "--since", type=parse_dtm, help="Start date/time, in iso format")
+    parser.add_argument("-u", "--until", type=parse_dtm, help="End date/time, in iso format")
+    parser.add_argument("-n", "--limit", type=int, help="Maximum number of packets to return")
+    args = parser.parse_args(argv)
+
+    if not args.archive_dir or not os.path.isdir(args.archive_dir):
+        print(f"Packet archive directory '{args.archive_dir}' not found")
+        return 1
+
+    archive = PacketArchive(args.archive_dir, retention_days=0)
+    for line in archive.query(args.device, args.code, args.since, args.until, args.limit):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+""" Allow/deny rules applied to every message before it is logged, displayed or published.
+
+    Rules are given in the [Packet Filter] section of the config file, one per line, as
+
+        <rule name> = <allow|deny> [verb=I,RQ] [code=30C9,rf_check] [src=04:*] [dst=18:*] [device=01:123456] [zone=01,02]
+
+    Each field is a comma separated list, matching any of its values; a rule matches if all its fields match.
+    Codes can be given as hex or by name, and devices by full ID or by type (e.g. '04:*'). 'device' matches either
+    the source or destination, and a list starting with '!' matches anything not in it (e.g. 'src=!01:*,04:*').
+    Rules are evaluated in order and the first match wins; the option 'default' sets the action if none do.
+
+    The decision for a (verb, code, src, dst) is cached, so once seen, most messages only cost a dict lookup.
+    Zone rules need the payload though, so if any rule has a zone, decisions are not cached.
+"""
+
+ALLOW           = "allow"
+DENY            = "deny"
+SZ_DEFAULT      = "default"
+SZ_ZONE_IDX     = "zone_idx"
+FIELDS          = ("verb", "code", "src", "dst", "device", "zone")
+CACHE_MAX       = 4096
+
+
+class DeviceMatcher():
+    ''' Full device IDs and/or device types, optionally negated '''
+    def __init__(self, values):
+        self.negate = values[0].startswith("!")
+        if self.negate:
+            values = [values[0][1:]] + values[1:]
+        self.types = frozenset(v.split(":")[0] for v in values if v.endswith(":*"))
+        self.ids = frozenset(v for v in values if not v.endswith(":*"))
+        for v in self.ids:
+            if len(v) != 9 or v[2] != ":":
+                raise ValueError(f"Invalid device ID '{v}'")
+
+    def matches(self, device_id):
+        return ((device_id in self.ids or device_id[:2] in self.types) != self.negate)
+
+
+class Rule():
+    ''' A single compiled rule. Fields that were not given are None, and match anything. '''
+    def __init__(self, name, spec, code_names):
+        self.name = name
+        self.spec = spec
+        parts = spec.split()
+        if not parts or parts[0].lower() not in (ALLOW, DENY):
+            raise ValueError(f"Rule must start with '{ALLOW}' or '{DENY}'")
+        self.allow = parts[0].lower() == ALLOW
+
+        fields = {}
+        for part in parts[1:]:
+            field, _, values = part.partition("=")
+            field = field.lower()
+            if field not in FIELDS or not values:
+                raise ValueError(f"Invalid rule field '{part}'")
+            fields[field] = [v.strip() for v in values.split(",") if v.strip()]
+
+        self.verbs = frozenset(v.upper() for v in fields["verb"]) if "verb" in fields else None
+        self.codes = frozenset(self._code(c, code_names) for c in fields["code"]) if "code" in fields else None
+        self.src = DeviceMatcher(fields["src"]) if "src" in fields else None
+        self.dst = DeviceMatcher(fields["dst"]) if "dst" in fields else None
+        self.device = DeviceMatcher(fields["device"]) if "device" in fields else None
+        self.zones = frozenset(z.upper() for z in fields["zone"]) if "zone" in fields else None
+
+    @staticmethod
+    def _code(code, code_names):
+        if code.upper() in code_names:
+            return code.upper()
+        for hex_code, name in code_names.items():
+            if name == code.lower():
+                return hex_code
+        raise ValueError(f"Unknown code '{code}'")
+
+    def matches(self, verb, code, src_id, dst_id, zones):
+        if self.codes is not None and code not in self.codes:
+            return False
+        if self.verbs is not None and verb not in self.verbs:
+            return False
+        if self.src is not None and not self.src.matches(src_id):
+            return False
+        if self.dst is not None and not self.dst.matches(dst_id):
+            return False
+        if self.device is not None and not (self.device.matches(src_id) or self.device.matches(dst_id)):
+            return False
+        if self.zones is not None and not self.zones.intersection(zones):
+            return False
+        return True
+
+
+class PacketFilter():
+    ''' The compiled rule set, with hit counts per rule.
+
+        rules:      list of (name, spec) as read from the config section
+        code_names: {hex code: code name}, for rules that give codes by name
+        previous:   the filter being replaced on a reload, whose hit counts are kept for unchanged rules
+    '''
+    def __init__(self, rules, code_names, previous=None):
+        self.default_allow = True
+        self.rules = []
+        self.errors = []
+        for name, spec in rules:
+            if name.lower() == SZ_DEFAULT:
+                if spec.strip().lower() not in (ALLOW, DENY):
+                    self.errors.append(f"{name}: default must be '{ALLOW}' or '{DENY}'")
+                self.default_allow = spec.strip().lower() != DENY
+                continue
+            try:
+                self.rules.append(Rule(name, spec, code_names))
+            except ValueError as ex:
+                self.errors.append(f"{name}: {ex}")
+
+        self.use_cache = not any(r.zones is not None for r in self.rules)
+        self._cache = {}
+
+        previous_hits = {(r.name, r.spec): hits for r, hits in zip(previous.rules, previous.hits)} if previous else {}
+        self.hits = [previous_hits.get((r.name, r.spec), 0) for r in self.rules]
+        self.default_hits = previous.default_hits if previous and previous.default_allow == self.default_allow else 0
+        self.allowed = previous.allowed if previous else 0
+        self.denied = previous.denied if previous else 0
+
+    def _evaluate(self, verb, code, src_id, dst_id, zones):
+        """ Index of the first matching rule, or None for the default """
+        for i, rule in enumerate(self.rules):
+            if rule.matches(verb, code, src_id, dst_id, zones):
+                return i
+        return None
+
+    def allow(self, msg):
+        """ True if the message should be processed """
+        verb, code, src_id, dst_id = msg.verb.strip(), msg.code, msg.src.id, msg.dst.id
+        if self.use_cache:
+            key = (verb, code, src_id, dst_id)
+            try:
+                index = self._cache[key]
+            except KeyError:
+                index = self._evaluate(verb, code, src_id, dst_id, ())
+                if len(self._cache) >= CACHE_MAX:
+                    self._cache.clear()
+                self._cache[key] = index
+        else:
+            index = self._evaluate(verb, code, src_id, dst_id, get_msg_zones(msg))
+
+        if index is None:
+            self.default_hits += 1
+            allowed = self.default_allow
+        else:
+            self.hits[index] += 1
+            allowed = self.rules[index].allow
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.denied += 1
+        return allowed
+
+    def stats(self):
+        return {"allowed": self.allowed, "denied": self.denied,
+            "rules": {r.name: {"action": ALLOW if r.allow else DENY, "hits": hits} for r, hits in zip(self.rules, self.hits)},
+            SZ_DEFAULT: {"action": ALLOW if self.default_allow else DENY, "hits": self.default_hits}}
+
+
+def get_msg_zones(msg):
+    """ The zone indexes of a message, from its payload, or failing that, from the source device's zone """
+    payload = msg.payload
+    items = payload if isinstance(payload, list) else (payload,)
+    zones = {item[SZ_ZONE_IDX].upper() for item in items if isinstance(item, dict) and isinstance(item.get(SZ_ZONE_IDX), str)}
+    if not zones:
+        zone = getattr(msg.src, "zone", None)
+        if zone is not None and getattr(zone, "idx", None):
+            zones = {str(zone.idx).upper()}
+    return zones
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+""" Worker processes for the stages that do not need the ramses_rf Gateway state, i.e. MQTT publishing and display.
+
+    Records are routed to a worker by a key (e.g. the topic), so all the records with the same key are handled by
+    the same worker, in the order they were submitted. Records are batched per worker until flush() is called
+    (i.e. once per message), and each batch is pickled and sent by the queue's feeder thread, so submitting a
+    record only costs the caller a list append.
+
+    Workers are forked, so they start with a copy of the parent's module state (settings, handler registries etc).
+    They must be started before any other threads (e.g. the paho network thread), as only the forking thread is
+    copied into the child. The log's handlers (e.g. a RotatingFileHandler) are replaced in each worker by a queue
+    back to the parent, so that only the parent writes to, and rotates, the log files.
+"""
+
+import multiprocessing
+import signal
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+QUEUE_MAX_BATCHES   = 10000
+JOIN_TIMEOUT        = 5
+
+
+class ProcessPipeline():
+    ''' Fixed set of worker processes, each with its own queue.
+
+        init(index) -> state:   called once in each worker, e.g. to connect its own MQTT client
+        handle(state, record):  called in the worker for each record
+        finish(state):          optional, called in the worker when the pipeline is closed
+    '''
+    def __init__(self, workers, init, handle, finish=None, log=None):
+        context = multiprocessing.get_context("fork")
+        self.log = log
+        self.queues = [context.Queue(QUEUE_MAX_BATCHES) for _ in range(workers)]
+        self.pending = [[] for _ in range(workers)]
+        self.log_queue = context.Queue() if log else None
+        self.log_listener = QueueListener(self.log_queue, *log.handlers, respect_handler_level=True) if log else None
+        self.processes = [context.Process(target=_worker_main, args=(i, queue, init, handle, finish, log, self.log_queue),
+            name=f"pipeline_worker_{i}", daemon=True) for i, queue in enumerate(self.queues)]
+        self.submitted = 0
+        self.dropped = 0
+        self._lock = Lock()     # Records may also be submitted from other threads, e.g. the schedule timers
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        if self.log_listener:
+            # A thread, so only once the workers are forked
+            self.log_listener.start()
+
+    def submit(self, key, record):
+        """ Queue a record for the worker that handles the given key. Sent on the next flush() """
+        with self._lock:
+            self.pending[hash(key) % len(self.pending)].append(record)
+            self.submitted += 1
+
+    def flush(self):
+        with self._lock:
+            for i, batch in enumerate(self.pending):
+                if batch:
+                    self._put(i, batch)
+                    self.pending[i] = []
+
+    def broadcast(self, record):
+        """ Send a record to every worker, after anything already submitted """
+        self.flush()
+        with self._lock:
+            for i in range(len(self.queues)):
+                self._put(i, [record])
+
+    def _put(self, index, batch):
+        try:
+            self.queues[index].put_nowait(batch)
+        except Exception:
+            # Queue full, i.e. the worker is not keeping up or has died
+            self.dropped += len(batch)
+
+    def close(self):
+        self.flush()
+        for queue in self.queues:
+            try:
+                queue.put(None, timeout=JOIN_TIMEOUT)
+            except Exception:
+                pass
+        for process in self.processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        if self.log_listener:
+            self.log_listener.stop()
+
+    def stats(self):
+        return {"workers": len(self.processes), "alive": sum(p.is_alive() for p in self.processes),
+            "submitted": self.submitted, "dropped": self.dropped}
+
+
+def _worker_main(index, queue, init, handle, finish, log, log_queue):
+    # Ctrl-C goes to the whole process group, but workers are stopped by the parent, once their queues are drained
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if log:
+        for handler in list(log.handlers):
+            log.removeHandler(handler)
+        log.addHandler(QueueHandler(log_queue))
+    state = init(index)
+    while True:
+        batch = queue.get()
+        if batch is None:
+            break
+        for record in batch:
+            try:
+                handle(state, record)
+            except Exception as ex:
+                if log:
+                    log.error(f"Exception occured in pipeline worker {index}: {ex}", exc_info=True)
+    if finish:
+        finish(state)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+""" Registry of the retained topics published by evoGateway, with the time each was last published, persisted to
+    a json file so that it survives restarts.
+
+    Received message values are registered by their topic base (e.g. evohome/living_room/trv_xx/temperature), as the
+    leaf topics under it all come and go together. Once a topic has not been published for the grace period (e.g.
+    after renaming a zone or device, or toggling MQTT_GROUP_BY_ZONE), it is stale, and it and everything under it can
+    be cleared from the broker's retained store.
+"""
+
+import json
+import os
+import time
+
+
+class RetainedTopicRegistry():
+    ''' {topic: last publish time (epoch secs)}. note() is called for every publish, so is just a dict assignment. '''
+    def __init__(self, file_path, grace_days=7, log=None):
+        self.file_path = file_path
+        self.grace_secs = grace_days * 86400
+        self.log = log
+        self.topics = {}
+        self.cleared = 0
+        self.started = time.time()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path, "r") as fp:
+                self.topics = {str(k): float(v) for k, v in json.load(fp).items()}
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            if self.log:
+                self.log.error(f"Exception occured loading retained topics from '{self.file_path}', starting afresh: {ex}", exc_info=True)
+
+    def save(self):
+        topics = dict(self.topics)  # Copy, as other threads may be adding topics
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w") as fp:
+            json.dump({k: round(v) for k, v in topics.items()}, fp, sort_keys=True)
+        os.replace(temp_path, self.file_path)
+
+    def note(self, topic, timestamp=None):
+        self.topics[topic] = timestamp or time.time()
+
+    def stale(self, now=None):
+        """ Topics not published within the grace period. None until the gateway has itself been running for the grace
+            period, so that topics are not cleared just because the gateway has been stopped for a while.
+        """
+        now = now or time.time()
+        cutoff = now - self.grace_secs
+        if self.started > cutoff:
+            return []
+        return [topic for topic, timestamp in list(self.topics.items()) if timestamp < cutoff]
+
+    def is_live(self, topic, below=""):
+        """ True if the topic, or any registered topic between it and 'below', has been published within the grace period """
+        cutoff = time.time() - self.grace_secs
+        parts = topic.split("/")
+        for i in range(len(parts), len(below.split("/")) if below else 0, -1):
+            timestamp = self.topics.get("/".join(parts[:i]))
+            if timestamp and timestamp >= cutoff:
+                return True
+        return False
+
+    def remove(self, topics):
+        for topic in topics:
+            if self.topics.pop(topic, None) is not None:
+                self.cleared += 1
+
+    def stats(self):
+        return {"topics": len(self.topics), "stale": len(self.stale()), "cleared": self.cleared,
+            "grace_days": round(self.grace_secs / 86400, 2)}
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+""" Token bucket limiting the rate at which the gateway transmits, shared by everything that sends commands in bulk
+    (e.g. command batches, fault log retrieval), so that together they stay within a sensible share of the RF
+    channel's duty cycle, and do not swamp the controller.
+"""
+
+import asyncio
+import time
+from threading import Lock
+
+
+class RfBudget():
+    ''' Allows 'burst' commands at once, refilling at 'per_minute' (0 = unlimited). Bulk senders await take(), and single
+        user commands call try_take(), which never delays them but uses up budget that bulk senders would otherwise use.
+    '''
+    def __init__(self, per_minute=30, burst=10):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.tokens = float(burst)
+        self.taken = 0
+        self.waited_secs = 0.0
+        self._updated = time.monotonic()
+        self._lock = Lock()     # Single commands are sent from the paho thread
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def try_take(self, count=1):
+        """ Take the tokens if available now. Returns True if they were taken """
+        with self._lock:
+            if self.per_minute <= 0:
+                # Unlimited
+                self.taken += count
+                return True
+            self._refill()
+            if self.tokens < count:
+                return False
+            self.tokens -= count
+            self.taken += count
+            return True
+
+    def wait_secs(self, count=1):
+        """ Time until the given number of tokens will be available """
+        with self._lock:
+            self._refill()
+            if self.tokens >= count or self.per_minute <= 0:
+                return 0
+            return (count - self.tokens) * 60 / self.per_minute
+
+    async def take(self, count=1):
+        """ Wait until the tokens are available, and take them """
+        while not self.try_take(count):
+            delay = max(self.wait_secs(count), 0.05)
+            self.waited_secs += delay
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            self._refill()
+            return {"tokens": round(self.tokens, 2), "per_minute": self.per_minute, "burst": self.burst,
+                "taken": self.taken, "waited_secs": round(self.waited_secs, 1)}
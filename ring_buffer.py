@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+""" Fixed capacity numeric time series, held in typed arrays rather than lists/dicts of floats.
+
+    Aggregates are computed over array slices with the builtin sum/min/max, which run as single C loops over
+    the buffer, so there is no per-sample python work once the samples have been added.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class RingBuffer():
+    ''' (timestamp, value) samples, oldest overwritten first once the buffer is full. 16 bytes per sample. '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.count = 0
+        self._next = 0
+
+    def append(self, timestamp, value):
+        self.times[self._next] = timestamp
+        self.values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def latest(self):
+        """ The most recent (timestamp, value), or None if empty """
+        if not self.count:
+            return None
+        i = self._next - 1
+        return self.times[i], self.values[i]
+
+    def ordered(self):
+        """ All samples as (times, values) arrays, oldest first """
+        if self.count < self.capacity:
+            return self.times[:self.count], self.values[:self.count]
+        n = self._next
+        return self.times[n:] + self.times[:n], self.values[n:] + self.values[:n]
+
+    def between(self, start=None, end=None):
+        """ The samples with start <= timestamp <= end, as (times, values) arrays, oldest first """
+        times, values = self.ordered()
+        lo = bisect_left(times, start) if start is not None else 0
+        hi = bisect_right(times, end) if end is not None else len(times)
+        return times[lo:hi], values[lo:hi]
+
+    @property
+    def nbytes(self):
+        return self.times.itemsize * self.capacity + self.values.itemsize * self.capacity
+
+    def __len__(self):
+        return self.count
+
+
+def summarise(values, ndigits=2):
+    """ mean/min/max/n of an array of values """
+    n = len(values)
+    if not n:
+        return None
+    return {"mean": round(sum(values) / n, ndigits), "min": round(min(values), ndigits), "max": round(max(values), ndigits), "n": n}
+
+
+def decimate(times, values, points):
+    """ Reduce the samples to at most the given number of points, each the mean of a run of consecutive samples """
+    n = len(values)
+    if n <= points or points <= 0:
+        return list(times), list(values)
+    step = n / points
+    out_times, out_values = [], []
+    for i in range(points):
+        lo, hi = int(i * step), int((i + 1) * step)
+        out_times.append(times[hi - 1])
+        out_values.append(sum(values[lo:hi]) / (hi - lo))
+    return out_times, out_values
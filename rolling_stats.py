@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+""" Rolling statistics per zone and per device, from the temperature, setpoint, demand and OpenTherm values received.
+
+    Each (zone or device, key) has its own ring buffer of recent samples. Every period, the samples within
+    the period are aggregated (mean/min/max), giving a downsampled series that can be published in place of
+    the full rate values.
+"""
+
+import time
+from threading import Lock
+
+from ring_buffer import RingBuffer, summarise
+
+SZ_ZONE_IDX     = "zone_idx"
+STAT_KEYS       = ("temperature", "setpoint", "heat_demand", "relay_demand")
+PERCENT_KEYS    = ("heat_demand", "relay_demand", "rel_modulation_level")
+# OpenTherm values, by the msg_name ramses_rf gives them (the OpenTherm VAR names), and the key they are kept under
+OPENTHERM_KEYS  = {"RelativeModulationLevel": "rel_modulation_level", "BoilerWaterTemperature": "boiler_output_temp",
+                   "ReturnWaterTemperature": "boiler_return_temp", "ControlSetpoint": "ch_setpoint",
+                   "CHWaterPressure": "ch_water_pressure"}
+
+
+class RollingStats():
+    ''' Ring buffers keyed by ("zone", zone_idx, key) and ("device", device_id, key) '''
+    def __init__(self, window_samples=512):
+        self.window_samples = window_samples
+        self.series = {}
+        self._lock = Lock()
+
+    def _add(self, series_key, timestamp, value):
+        buffer = self.series.get(series_key)
+        if buffer is None:
+            buffer = self.series[series_key] = RingBuffer(self.window_samples)
+        buffer.append(timestamp, value)
+
+    def add_item(self, msg, item, timestamp=None):
+        """ Add any stats values in a single (dict) payload item of a message """
+        timestamp = timestamp or time.time()
+
+        msg_name = item.get("msg_name")
+        opentherm_key = OPENTHERM_KEYS.get(msg_name) if isinstance(msg_name, str) else None   # Some are lists
+        if opentherm_key and isinstance(item.get("value"), (int, float)):
+            # OpenTherm values are per device (i.e. the OTB)
+            with self._lock:
+                self._add(("device", msg.src.id, opentherm_key), timestamp, float(item["value"]))
+            return
+
+        keys = [k for k in STAT_KEYS if item.get(k) is not None]
+        if not keys:
+            return
+
+        zone_idx = item.get(SZ_ZONE_IDX)
+        if zone_idx is None:
+            zone = getattr(msg.src, "zone", None)
+            zone_idx = getattr(zone, "idx", None)
+
+        with self._lock:
+            for key in keys:
+                value = float(item[key])
+                # Zone values are those about the zone, i.e. from the controller's zone arrays or the zone's own devices
+                if zone_idx is not None:
+                    self._add(("zone", zone_idx, key), timestamp, value)
+                self._add(("device", msg.src.id, key), timestamp, value)
+
+    def between(self, series_key, start=None, end=None):
+        """ (times, values) arrays of a single series, or None if there is no such series """
+        with self._lock:
+            buffer = self.series.get(series_key)
+            return buffer.between(start, end) if buffer else None
+
+    def series_keys(self, scope=None, key=None):
+        with self._lock:
+            return [k for k in self.series if (scope is None or k[0] == scope) and (key is None or k[2] == key)]
+
+    def aggregates(self, period_secs, now=None):
+        """ Aggregate the last period's samples, returning {(scope, zone_idx or device_id): {key: summary, ...}} """
+        now = now or time.time()
+        start = now - period_secs
+        results = {}
+        with self._lock:
+            for (scope, series_id, key), buffer in self.series.items():
+                _, values = buffer.between(start, now)
+                summary = summarise(values, 4 if key in PERCENT_KEYS else 2)
+                if summary:
+                    results.setdefault((scope, series_id), {})[key] = summary
+
+            # Setpoint deviation, i.e. mean temperature vs. the setpoint in force (the latest, even if before the period)
+            for (scope, series_id), stats in results.items():
+                if "temperature" in stats:
+                    setpoint = self.series.get((scope, series_id, "setpoint"))
+                    latest = setpoint.latest() if setpoint else None
+                    if latest:
+                        stats["setpoint_deviation"] = round(stats["temperature"]["mean"] - latest[1], 2)
+        return results
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.series.values())
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+""" Low overhead sampling profiler and tracemalloc snapshots, for diagnosing CPU and memory hot spots in a running
+    gateway without restarting it (e.g. with DEBUG logging, which changes the timing and loses the state).
+
+    The profiler samples the stacks of all the threads (i.e. the asyncio loop, the paho thread etc.) from a background
+    thread, with sys._current_frames(), so the profiled code is not instrumented. The stacks are written in the
+    collapsed format used by flamegraph.pl, speedscope etc, one line per distinct stack:
+
+        MainThread;evogateway.py:main;base_events.py:run_forever;...;evogateway.py:process_gwy_message 42
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Frames (file:function) that a thread is just blocked in, when they are on top of the stack, excluded from the top
+# functions. These are the python frames that call the blocking C functions, which are not in the stack themselves
+IDLE_FRAMES = ("selectors.py:select",           # asyncio loop (select/poll/epoll)
+               "threading.py:wait",             # Event/Condition wait, e.g. the watchdog and profiler threads
+               "threading.py:_wait_for_tstate_lock",
+               "queue.py:get",
+               "thread.py:_worker",             # Idle executor threads
+               "socket.py:accept",
+               "connection.py:_recv",           # multiprocessing pipes
+               "client.py:_loop")               # paho's network thread, in select.select
+
+
+class SamplingProfiler():
+    ''' Samples every interval_secs for duration_secs (or until stop()), then calls on_done(profiler) '''
+    def __init__(self, interval_secs=0.005, duration_secs=60, on_done=None):
+        self.interval_secs = interval_secs
+        self.duration_secs = duration_secs
+        self.on_done = on_done
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling_profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        end = time.monotonic() + self.duration_secs
+        start = time.monotonic()
+        while not self._stop.is_set() and time.monotonic() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+            self._stop.wait(self.interval_secs)
+        self.elapsed = time.monotonic() - start
+        if self.on_done:
+            self.on_done(self)
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack.append(thread_name)
+        return ";".join(reversed(stack))
+
+    def write_collapsed(self, file_path):
+        with open(file_path, "w") as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write(f"{stack} {count}\n")
+
+    def top(self, count=20, skip_idle=True):
+        """ The functions with the most samples, by self (i.e. on top of the stack) and total (anywhere in the stack).
+            Threads just waiting (e.g. on select/sleep) are excluded if skip_idle.
+        """
+        self_counts, total_counts = Counter(), Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames or (skip_idle and is_idle(frames[-1])):
+                continue
+            self_counts[frames[-1]] += samples
+            for frame in set(frames):
+                total_counts[frame] += samples
+        busy = sum(self_counts.values()) or 1
+        return {"samples": self.samples, "secs": round(self.elapsed, 1), "busy_samples": sum(self_counts.values()),
+            "self": [{"function": k, "samples": v, "pct": round(100 * v / busy, 1)} for k, v in self_counts.most_common(count)],
+            "total": [{"function": k, "samples": v, "pct": round(100 * v / busy, 1)} for k, v in total_counts.most_common(count)]}
+
+
+def is_idle(frame):
+    return frame in IDLE_FRAMES
+
+
+def tracemalloc_start(frames=10):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def tracemalloc_summary(snapshot, previous=None, count=20):
+    """ Top allocations by line, and, if there is a previous snapshot, the top changes since it """
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+    current, peak = tracemalloc.get_traced_memory()
+    summary = {"traced_kb": round(current / 1024), "peak_kb": round(peak / 1024),
+        "top": [{"line": str(stat.traceback[0]), "kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:count]]}
+    if previous:
+        summary["changes"] = [{"line": str(stat.traceback[0]), "kb_diff": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+            for stat in snapshot.compare_to(previous, "lineno")[:count]]
+    return summary, snapshot
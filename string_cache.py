@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+""" Caches of the strings built for every received message (topics, snake case names and timestamps), so that each
+    is built once and then reused, rather than allocated (and garbage collected) again for every message.
+
+    A house has a few hundred distinct topics at most, so the caches are small. They are just cleared if they ever
+    fill up (e.g. from a neighbour's devices), and when a setting the strings depend on (e.g. MQTT_PUB_TOPIC) is
+    changed. Lookups are a dict get, so are safe from any thread, and a race just builds the same string twice.
+"""
+
+import datetime
+import sys
+import time
+
+_MISSING = object()
+
+
+class StringCache():
+    ''' {key: value}, where value = build(*key) for tuple keys, or build(key) otherwise, built on first use. String
+        values are interned, so that the topics in the MQTT client's queue etc are all the same objects
+    '''
+    def __init__(self, build, max_size=4096):
+        self.build = build
+        self.max_size = max_size
+        self.cache = {}
+        self.cleared = 0
+
+    def get(self, key):
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.build(*key) if isinstance(key, tuple) else self.build(key)
+            if isinstance(value, str):
+                value = sys.intern(value)
+            if len(self.cache) >= self.max_size:
+                self.clear()
+            self.cache[key] = value
+        return value
+
+    def clear(self):
+        self.cache = {}
+        self.cleared += 1
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class SecondTimestamp():
+    ''' datetime.now().strftime(format), but only formatted once a second, e.g. for the timestamps published with
+        every message
+    '''
+    def __init__(self, format):
+        self.format = format
+        self._second = None
+        self._text = None
+
+    def __call__(self):
+        now = time.time()
+        second = int(now)
+        if second != self._second:
+            self._text = datetime.datetime.fromtimestamp(second).strftime(self.format)
+            self._second = second
+        return self._text
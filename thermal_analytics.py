@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+""" Derived thermal metrics, computed in one batch over the recent window of the rolling stats buffers.
+
+    Per zone:   heating/cooling rate (least squares slope of temperature, °C/hour), estimated minutes to reach the
+                setpoint, mean heat demand, and the rate achieved per unit of demand (i.e. how effective the demand is).
+    Boiler:     mean modulation, mean flow/return temperature difference, and the fraction of time the return
+                temperature was low enough for a condensing boiler to condense.
+
+    Other than making the times relative, the sums are taken with the builtin sum() and map() over the buffer
+    slices, so each is a single C loop rather than per sample python code.
+"""
+
+import time
+from operator import mul
+
+CONDENSING_RETURN_TEMP  = 55.0      # Return temperatures below this allow a condensing boiler to condense
+MIN_SAMPLES             = 3
+
+
+def linear_slope(times, values):
+    """ Least squares slope of values against times (per second), or None if there are too few samples """
+    n = len(values)
+    if n < MIN_SAMPLES:
+        return None
+    t0 = times[0]
+    ts = [t - t0 for t in times]    # relative times, to keep the sums well conditioned
+    sum_t = sum(ts)
+    sum_v = sum(values)
+    sum_tt = sum(map(mul, ts, ts))
+    sum_tv = sum(map(mul, ts, values))
+    denominator = n * sum_tt - sum_t * sum_t
+    if denominator <= 0:
+        return None
+    return (n * sum_tv - sum_t * sum_v) / denominator
+
+
+def zone_analytics(stats, zone_idx, window_secs, now=None):
+    """ Derived metrics for a single zone, from the RollingStats series, or None if there is no temperature data """
+    now = now or time.time()
+    start = now - window_secs
+    temperature = stats.between(("zone", zone_idx, "temperature"), start, now)
+    if not temperature or len(temperature[1]) < MIN_SAMPLES:
+        return None
+    times, values = temperature
+
+    result = {"samples": len(values), "temperature": round(values[-1], 2)}
+    slope = linear_slope(times, values)
+    rate = slope * 3600 if slope is not None else None
+    result["rate_per_hour"] = round(rate, 3) if rate is not None else None
+
+    setpoint = stats.between(("zone", zone_idx, "setpoint"))
+    if setpoint and len(setpoint[1]):
+        target = setpoint[1][-1]
+        difference = target - values[-1]
+        result["setpoint"] = target
+        if abs(difference) < 0.1:
+            result["mins_to_setpoint"] = 0
+        elif rate and (difference > 0) == (rate > 0):
+            # Only if heading towards the setpoint
+            result["mins_to_setpoint"] = round(difference / rate * 60)
+        else:
+            result["mins_to_setpoint"] = None
+
+    demand = stats.between(("zone", zone_idx, "heat_demand"), start, now)
+    if demand and len(demand[1]):
+        mean_demand = sum(demand[1]) / len(demand[1])
+        result["heat_demand_mean"] = round(mean_demand, 3)
+        result["rate_per_demand"] = round(rate / mean_demand, 3) if rate is not None and mean_demand > 0.05 else None
+
+    return result
+
+
+def boiler_analytics(stats, device_id, window_secs, now=None):
+    """ Modulation and condensing metrics from the OpenTherm values of an OTB device, or None if there are none """
+    now = now or time.time()
+    start = now - window_secs
+    result = {}
+
+    modulation = stats.between(("device", device_id, "rel_modulation_level"), start, now)
+    if modulation and len(modulation[1]):
+        result["modulation_mean"] = round(sum(modulation[1]) / len(modulation[1]), 3)
+
+    flow = stats.between(("device", device_id, "boiler_output_temp"), start, now)
+    ret = stats.between(("device", device_id, "boiler_return_temp"), start, now)
+    if ret and len(ret[1]):
+        returns = ret[1]
+        result["return_temp_mean"] = round(sum(returns) / len(returns), 2)
+        result["condensing_fraction"] = round(sum(1 for t in returns if t < CONDENSING_RETURN_TEMP) / len(returns), 3)
+        if flow and len(flow[1]):
+            result["flow_temp_mean"] = round(sum(flow[1]) / len(flow[1]), 2)
+            result["flow_return_delta_mean"] = round(result["flow_temp_mean"] - result["return_temp_mean"], 2)
+
+    return result or None
+
+
+def compute_all(stats, window_secs, now=None):
+    """ Compute the metrics for every zone and OpenTherm device in one pass.
+        Returns ({zone_idx: metrics}, {device_id: boiler metrics})
+    """
+    now = now or time.time()
+    zones = {}
+    for _, zone_idx, _ in stats.series_keys("zone", "temperature"):
+        metrics = zone_analytics(stats, zone_idx, window_secs, now)
+        if metrics:
+            zones[zone_idx] = metrics
+
+    boilers = {}
+    for _, device_id, _ in stats.series_keys("device", "rel_modulation_level") + stats.series_keys("device", "boiler_return_temp"):
+        if device_id not in boilers:
+            metrics = boiler_analytics(stats, device_id, window_secs, now)
+            if metrics:
+                boilers[device_id] = metrics
+    return zones, boilers
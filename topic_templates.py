@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+""" Topic templates: the layout of the topics that received values are published to, e.g.
+
+        {prefix}/{zone}/{device}/{code}{idx}/{key}
+
+    given in the [Topic Templates] section of the config file, with a 'default' template and optional templates for
+    particular codes (by name or hex), e.g. to publish all the temperatures together:
+
+        default     = {prefix}/{zone}/{device}/{code}{idx}/{key}
+        temperature = {prefix}/temperatures/{zone}/{device}{idx}/{key}
+
+    Fields:
+        prefix  MQTT_PUB_TOPIC
+        zone    the zone name (e.g. living_room, _zone_independent or _dhw), empty if the device has no zone
+        device  the device's name (e.g. trv_living_room)
+        code    the code name (e.g. temperature)
+        idx     any sub-topic for the payload (e.g. /01 for a controller's zone specific payload, /fragment_1)
+        key     the payload key, which must be the last part, as the message's json and <code>_ts are published in
+                its place
+
+    Parts (between /'s) that are empty once filled in are left out, e.g. the zone for devices without one, except for
+    a part that is just {prefix}, so that an empty MQTT_PUB_TOPIC gives a leading '/' as it always has.
+
+    Each template is compiled once into a function that joins its parts, and the templates are checked against each
+    other (for every code, and some sample zones, devices and idx's) for any two messages whose values would be
+    published to the same topics, or one under the other's. Templates that are invalid or collide are ignored, so
+    that the default (or failing that, the built-in layout) is used instead.
+"""
+
+import string
+
+FIELDS              = ("prefix", "zone", "device", "code", "idx")
+SZ_KEY              = "key"
+SZ_DEFAULT          = "default"
+TEMPLATE_GROUP_BY_ZONE = "{prefix}/{zone}/{device}/{code}{idx}/{key}"
+TEMPLATE_BY_DEVICE  = "{prefix}/{device}/{code}{idx}/{key}"
+
+SAMPLE_PREFIX       = "prefix"
+SAMPLE_DEVICES      = (("zone_x", "device_x"), ("zone_x", "device_y"), ("zone_y", "device_z"), ("", "device_w"))
+SAMPLE_IDXS         = ("", "/01", "/02")
+MAX_COLLISIONS      = 5     # Reported
+
+
+class TopicTemplate():
+    ''' A single compiled template. base(...) returns the topic the key is published under '''
+    def __init__(self, spec):
+        self.spec = spec.strip()
+        if not self.spec.endswith("/{" + SZ_KEY + "}"):
+            raise ValueError(f"Template must end with '/{{{SZ_KEY}}}'")
+
+        parts, fields = [], set()
+        for segment in self.spec[:-len(SZ_KEY) - 3].split("/"):
+            terms = []
+            for literal, field, format_spec, conversion in string.Formatter().parse(segment):
+                if literal:
+                    terms.append(repr(literal))
+                if field is None:
+                    continue
+                if field not in FIELDS or format_spec or conversion:
+                    raise ValueError(f"Invalid field '{{{field}}}'")
+                terms.append(field)
+                fields.add(field)
+            if terms == ["prefix"]:
+                parts.append("prefix")
+            elif terms:
+                # None is left out of the join, but an empty prefix is not
+                parts.append(f"({' + '.join(terms)}) or None")
+        if not parts:
+            raise ValueError("Template is empty")
+        self.fields = frozenset(fields)
+        self.uses_zone = "zone" in fields
+
+        source = f"def base({', '.join(FIELDS)}):\n    return '/'.join(part for part in ({', '.join(parts)},) if part is not None)\n"
+        namespace = {}
+        exec(compile(source, f"<topic template '{self.spec}'>", "exec"), namespace)
+        self._base = namespace["base"]
+
+    def base(self, prefix, zone, device, code, idx):
+        return self._base(prefix or "", zone or "", device or "", code or "", idx or "")
+
+
+class TopicTemplates():
+    ''' The default template and any per code ones.
+
+        templates:      list of (name, spec) as read from the config section; name is 'default' or a code
+        code_names:     {hex code: code name}
+        group_by_zone:  the built-in layout, if there is no valid 'default' template
+    '''
+    def __init__(self, templates, code_names, group_by_zone=True):
+        self.errors = []
+        self.builtin = TopicTemplate(TEMPLATE_GROUP_BY_ZONE if group_by_zone else TEMPLATE_BY_DEVICE)
+        self.default = self.builtin
+        self.codes = {}     # {code name: TopicTemplate}
+        for name, spec in templates:
+            try:
+                template = TopicTemplate(spec)
+                if name.lower() == SZ_DEFAULT:
+                    self.default = template
+                else:
+                    self.codes[self._code_name(name, code_names)] = template
+            except ValueError as ex:
+                self.errors.append(f"{name}: {ex}")
+
+        code_names = sorted(set(code_names.values()))
+        collisions = self.collisions(code_names)
+        if collisions:
+            self._report(collisions)
+            # Fall back to the default for the codes with their own templates that collide, or if the default
+            # collides with itself, to the built-in layout
+            for code in {code for _, owners in collisions for code, _, _ in owners if code in self.codes}:
+                del self.codes[code]
+            if self.default is not self.builtin and self.collisions(code_names):
+                self.default = self.builtin
+            collisions = self.collisions(code_names)
+            if collisions:
+                self._report(collisions)
+                self.codes.clear()
+                self.default = self.builtin
+
+    @staticmethod
+    def _code_name(code, code_names):
+        if code.upper() in code_names:
+            return code_names[code.upper()]
+        if code.lower() in code_names.values():
+            return code.lower()
+        raise ValueError(f"Unknown code '{code}'")
+
+    def get(self, code_name):
+        return self.codes.get(code_name, self.default)
+
+    def collisions(self, code_names):
+        """ [(topic, owners)] where the owners are (code, device, idx)'s that would publish to the same topics """
+        owners = {}
+        collisions = []
+        for code in code_names:
+            template = self.get(code)
+            for zone, device in SAMPLE_DEVICES:
+                for idx in SAMPLE_IDXS:
+                    owner = (code, device, idx)
+                    topic = template.base(SAMPLE_PREFIX, zone, device, code, idx)
+                    other = owners.setdefault(topic, owner)
+                    if other != owner:
+                        collisions.append((topic, (other, owner)))
+
+        for topic, owner in owners.items():
+            # Values published under another code's topic, e.g. {prefix}/{device}/{key} for one code, and
+            # {prefix}/{device}/{code}/{key} for the others
+            parts = topic.split("/")
+            for i in range(1, len(parts)):
+                other = owners.get("/".join(parts[:i]))
+                if other and other[0] != owner[0]:
+                    collisions.append((topic, (other, owner)))
+        return collisions
+
+    def _report(self, collisions):
+        """ The first collision between each pair of codes """
+        reported = {}
+        for topic, (first, second) in collisions:
+            reported.setdefault((first[0], second[0]), (topic, first, second))
+        for topic, first, second in list(reported.values())[:MAX_COLLISIONS]:
+            self.errors.append(f"Topic collision: {describe(first)} and {describe(second)} are both published under '{topic}'")
+        if len(reported) > MAX_COLLISIONS:
+            self.errors.append(f"... and {len(reported) - MAX_COLLISIONS} more topic collisions")
+
+
+def describe(owner):
+    code, device, idx = owner
+    return f"'{code}' from {device}{idx}"
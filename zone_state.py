@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+""" Merged state per zone (and DHW/relays), built up from the individual key/values published for each message,
+    so that the whole state of a zone can be published as a single document, and only when it has changed.
+"""
+
+import json
+from threading import Lock
+
+
+class ZoneStateAggregator():
+    ''' One state document per zone topic, e.g.
+
+            {"zone": "living_room", "updated": "2021-05-20T12:34:56",
+             "state": {"temperature": 19.5, "setpoint": 21.0, "heat_demand": 0.35, ...},
+             "state_ts": {"temperature": "2021-05-20T12:34:56", ...},
+             "devices": {"trv_living_room_04_123456": {"temperature": 19.8, "heat_demand": 0.4, ...}, ...}}
+
+        'state' holds the latest value of each key from any device in the zone, and 'devices' the latest
+        from each device. Nested values (e.g. schedules) are not included, to keep the documents compact.
+    '''
+    def __init__(self):
+        self.zones = {}
+        self._dirty = set()
+        self._lock = Lock()
+
+    def _zone(self, zone):
+        doc = self.zones.get(zone)
+        if doc is None:
+            doc = self.zones[zone] = {"zone": zone, "updated": None, "state": {}, "state_ts": {}, "devices": {}}
+        return doc
+
+    def update(self, zone, device, key, value, timestamp):
+        """ Update a single key/value for the zone. Returns True if the zone state has changed """
+        if isinstance(value, dict):
+            if "value" not in value:
+                return False
+            value = value["value"]     # e.g. opentherm msgs
+        elif isinstance(value, list):
+            return False
+
+        with self._lock:
+            doc = self._zone(zone)
+            doc["state_ts"][key] = timestamp
+            device_state = doc["devices"].setdefault(device, {})
+            if doc["state"].get(key) == value and device_state.get(key) == value and key in doc["state"]:
+                return False
+            doc["state"][key] = value
+            device_state[key] = value
+            doc["updated"] = timestamp
+            self._dirty.add(zone)
+            return True
+
+    def load(self, doc):
+        """ Load a previously published state document (e.g. retained on the broker), without marking it as changed """
+        if not isinstance(doc, dict) or not isinstance(doc.get("zone"), str):
+            return False
+        with self._lock:
+            zone = self._zone(doc["zone"])
+            for key in ("state", "state_ts", "devices"):
+                if isinstance(doc.get(key), dict):
+                    zone[key].update(doc[key])
+            zone["updated"] = doc.get("updated")
+        return True
+
+    def pop_changed(self):
+        """ Return a list of (zone, json state document) for the zones changed since the last call """
+        with self._lock:
+            changed = [(zone, json.dumps(self.zones[zone], separators=(",", ":"), default=str)) for zone in sorted(self._dirty)]
+            self._dirty.clear()
+        return changed
+
+    def __len__(self):
+        return len(self.zones)